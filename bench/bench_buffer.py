@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for obfsproxy.network.buffer.Buffer.
+
+A buffer is filled with 'backlog' bytes in 4 KB writes and then
+emptied with MTU-sized reads, the way a connection buffer behaves
+when a circuit has a lot of data queued. With a linear buffer, the
+time spent per byte stays the same regardless of the backlog size.
+
+Run from the top of the source tree:
+    python bench/bench_buffer.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.network.buffer as obfs_buf
+
+WRITE_SIZE = 4096
+READ_SIZE = 1448
+
+BACKLOGS = [64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+def run(backlog):
+    """Fill and empty a buffer of 'backlog' bytes. Return elapsed seconds."""
+    chunk = 'X' * WRITE_SIZE
+    buf = obfs_buf.Buffer()
+
+    start = time.time()
+
+    for _ in xrange(backlog / WRITE_SIZE):
+        buf.write(chunk)
+
+    while buf:
+        buf.peek(21) # transports often peek at a header first
+        buf.read(READ_SIZE)
+
+    return time.time() - start
+
+def main():
+    print "%12s %12s %14s" % ("backlog", "seconds", "ns/byte")
+    for backlog in BACKLOGS:
+        elapsed = run(backlog)
+        print "%12d %12.4f %14.2f" % (backlog, elapsed, elapsed * 1e9 / backlog)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+Circuit table benchmark.
+
+Fills a circuit table with 'circuits' circuits from 'circuits' / 5
+peers over four transports and reports what counting the circuits of a
+peer, of a transport and in a state costs, against going through all
+circuits, which is what it took without the table. Also reports what a
+circuit's lifecycle (create, complete, close) costs, which includes
+keeping the table up to date.
+
+Run from the top of the source tree:
+    python bench/bench_circuit_table.py [circuits]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+import obfsproxy.common.log as logging
+import obfsproxy.network.circuit_table as circuit_table
+import obfsproxy.network.network as network
+import obfsproxy.transports.dummy as dummy
+
+TRANSPORTS = ('obfs2', 'obfs3', 'scramblesuit', 'dummy')
+GONE = failure.Failure(Exception("Connection lost."))
+
+class FakeCircuit(object):
+    def __init__(self, i, peers):
+        self.transport_name = TRANSPORTS[i % len(TRANSPORTS)]
+        self.peer = '10.0.%d.%d' % divmod(i % peers, 256)
+        self.state = circuit_table.STATES[i % len(circuit_table.STATES)]
+
+def best(function, number):
+    """Return the microseconds 'function' takes, at best."""
+    return 1e6 * min(timeit.repeat(function, repeat=5, number=number)) / number
+
+def lifecycle():
+    circuit = network.Circuit(dummy.DummyClient())
+    for side in ('upstream', 'downstream'):
+        conn = network.StaticDestinationProtocol(circuit, 'client', None)
+        conn.transport = proto_helpers.StringTransport()
+        setattr(circuit, side, conn)
+    circuit.circuitCompleted(circuit.upstream)
+    circuit.close()
+    circuit.upstream.connectionLost(GONE)
+    circuit.downstream.connectionLost(GONE)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    peers = max(count / 5, 1)
+    logging.get_obfslogger().disable_logs()
+
+    print "circuit lifecycle: %.1f us" % best(lifecycle, 2000)
+    assert len(circuit_table.table) == 0
+
+    table = circuit_table.CircuitTable()
+    circuits = [FakeCircuit(i, peers) for i in xrange(count)]
+    for circuit in circuits:
+        table.add(circuit)
+
+    peer, transport, state = '10.0.0.7', 'obfs3', circuit_table.OPEN
+    lookups = (
+        ("peer",
+         lambda: len(table.of_peer(peer)),
+         lambda: sum(1 for c in circuits if c.peer == peer)),
+        ("transport",
+         lambda: len(table.of_transport(transport)),
+         lambda: sum(1 for c in circuits if c.transport_name == transport)),
+        ("state",
+         lambda: len(table.in_state(state)),
+         lambda: sum(1 for c in circuits if c.state == state)))
+
+    print "%d circuits, %d peers" % (count, peers)
+    print "%12s %12s %12s" % ("count by", "table us", "scan us")
+    for name, indexed, scan in lookups:
+        assert indexed() == scan()
+        print "%12s %12.3f %12.1f" % (name, best(indexed, 100000), best(scan, 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+Symmetric crypto benchmark.
+
+For every available crypto backend, measures the AES-CTR throughput
+of obfs2/obfs3 (aes.AES_CTR_128) and ScrambleSuit (PayloadCrypter) on
+MTU-sized and 64 KB pieces of data, on one core. Also measures
+ScrambleSuit's HMAC-SHA256-128 over MTU-sized messages.
+
+Run from the top of the source tree:
+    python bench/bench_crypto.py [seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.aes as aes
+import obfsproxy.common.crypto_backend as crypto_backend
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+
+SIZES = (1448, 65536)
+
+def mbps(function, size, seconds):
+    """Return the MB/s at which 'function' processes 'size'-byte pieces."""
+    data = os.urandom(size)
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        function(data)
+        count += 1
+
+    return count * size / (1024.0 * 1024.0) / (time.time() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+
+    print "%14s %22s %10s %10s" % ("backend", "operation", "bytes", "MB/s")
+    for name in crypto_backend.get_available_backends():
+        crypto_backend.set_backend(name)
+
+        cipher = aes.AES_CTR_128(os.urandom(16), os.urandom(16), counter_wraparound=True)
+        crypter = mycrypto.PayloadCrypter()
+        crypter.setSessionKey(os.urandom(32), os.urandom(8))
+
+        for size in SIZES:
+            print "%14s %22s %10d %10.1f" % (name, "AES_CTR_128.crypt", size,
+                                             mbps(cipher.crypt, size, seconds))
+        for size in SIZES:
+            print "%14s %22s %10d %10.1f" % (name, "PayloadCrypter.encrypt", size,
+                                             mbps(crypter.encrypt, size, seconds))
+
+    key = os.urandom(32)
+    print "%14s %22s %10d %10.1f" % ("-", "HMAC_SHA256_128", 1448,
+                                     mbps(lambda data: mycrypto.HMAC_SHA256_128(key, data),
+                                          1448, seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+UniformDH keypair pool benchmark.
+
+First, the time a new connection spends on the event loop to get its
+UniformDH keypair, when it comes out of the pool and when it has to be
+generated inline.
+
+Then, the time-to-first-byte of obfs3 and ScrambleSuit (see
+bench_ttfb.py) without the pool and with the default pool. Samples are
+taken 'pause' seconds apart, which gives the pool idle time to refill.
+
+Run from the top of the source tree:
+    python bench/bench_dh_pool.py [samples] [pause]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+from bench_ttfb import TRANSPORTS, echo_server, run
+
+KEYPAIRS = 200
+
+def get_cost(pool, prefill):
+    """Return the average time of KeypairPool.get() in seconds."""
+    if prefill:
+        pool.set_size(KEYPAIRS)
+        pool.fill()
+
+    start = time.time()
+    for _ in xrange(KEYPAIRS):
+        pool.get()
+    return (time.time() - start) / KEYPAIRS
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pause = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+    print "keypair from the pool: %8.1f us" % (get_cost(obfs3_dh.KeypairPool(), True) * 1e6)
+    print "keypair made inline:   %8.1f us" % (get_cost(obfs3_dh.KeypairPool(), False) * 1e6)
+    print
+
+    echo_port = echo_server()
+    print "%14s %10s %12s %12s" % ("transport", "pool size", "median ms", "p90 ms")
+    for transport, args in TRANSPORTS:
+        if transport not in ('obfs3', 'scramblesuit'):
+            continue
+
+        for size in (0, obfs3_dh.DEFAULT_POOL_SIZE):
+            options = ['--no-log', '--dh-pool-size', str(size)]
+            results = run(transport, args, echo_port, samples, options, pause)
+            print "%14s %10d %12.2f %12.2f" % (transport, size,
+                                               results[len(results) / 2] * 1000,
+                                               results[len(results) * 9 / 10] * 1000)
+
+if __name__ == '__main__':
+    main()
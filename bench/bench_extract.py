@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit bulk download benchmark.
+
+Encrypts 'megabytes' of payload into full-sized ScrambleSuit protocol
+messages, the way a server sends a bulk download, and then measures on
+one core how fast a MessageExtractor turns them back into payload when
+they arrive in 64 KB reads.
+
+Run from the top of the source tree:
+    python bench/bench_extract.py [megabytes]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.message as message
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+
+READ_SIZE = 65536
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    logging.get_obfslogger().disable_logs()
+
+    sessionKey, iv = os.urandom(32), os.urandom(8)
+    hmacKey = mycrypto.HMACContext(os.urandom(const.SHARED_SECRET_LENGTH))
+    sender, receiver = mycrypto.PayloadCrypter(), mycrypto.PayloadCrypter()
+    sender.setSessionKey(sessionKey, iv)
+    receiver.setSessionKey(sessionKey, iv)
+
+    payload = os.urandom(const.MPU)
+    count = megabytes * 1024 * 1024 / const.MPU
+    wire = "".join([message.ProtocolMessage(payload=payload).encryptAndHMAC(sender, hmacKey)
+                    for _ in xrange(count)])
+    reads = [wire[i:i + READ_SIZE] for i in xrange(0, len(wire), READ_SIZE)]
+
+    extractor = message.MessageExtractor()
+    received = 0
+    start = time.time()
+    for data in reads:
+        for msg in extractor.extract(data, receiver, hmacKey):
+            received += len(msg.payload)
+    elapsed = time.time() - start
+
+    assert received == count * const.MPU
+    print "%d messages in %d KB reads: %.1f MB/s of payload" % \
+          (count, READ_SIZE / 1024, received / (1024.0 * 1024.0) / elapsed)
+
+if __name__ == '__main__':
+    main()
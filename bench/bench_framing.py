@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit send path benchmark.
+
+Measures on one core how fast bursts of application data are turned
+into padded, encrypted and authenticated ScrambleSuit protocol messages,
+both with one ProtocolMessage (and one cipher call) per message and with
+the frames of a whole burst encrypted in one go.
+
+Run from the top of the source tree:
+    python bench/bench_framing.py [seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.message as message
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
+
+# A Tor cell and a full 64 KB read.
+BURSTS = (586, 65536)
+
+def per_message(crypter, hmacKey, morpher, data):
+    blurb = "".join([msg.encryptAndHMAC(crypter, hmacKey)
+                     for msg in message.createProtocolMessages(data)])
+    return [blurb + morpher.getPadding(crypter, hmacKey, len(blurb))]
+
+def per_burst(crypter, hmacKey, morpher, data):
+    frames = message.createFrames(data)
+    frames += morpher.getPaddingFrames(len(data) + len(frames) * const.HDR_LENGTH)
+    return message.encryptFrames(crypter, hmacKey, frames)
+
+def mbps(function, size, seconds):
+    """Return the MB/s of application data that 'function' sends."""
+    crypter = mycrypto.PayloadCrypter()
+    crypter.setSessionKey(os.urandom(32), os.urandom(8))
+    hmacKey = mycrypto.HMACContext(os.urandom(const.SHARED_SECRET_LENGTH))
+    morpher = packetmorpher.new()
+    data = os.urandom(size)
+
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        function(crypter, hmacKey, morpher, data)
+        count += 1
+
+    return count * size / (1024.0 * 1024.0) / (time.time() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    logging.get_obfslogger().disable_logs()
+
+    print "%12s %8s %10s" % ("framing", "burst", "MB/s")
+    for size in BURSTS:
+        for name, function in (("per message", per_message), ("per burst", per_burst)):
+            print "%12s %8d %10.1f" % (name, size, mbps(function, size, seconds))
+
+if __name__ == '__main__':
+    main()
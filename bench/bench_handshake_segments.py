@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit server handshake parsing benchmark.
+
+Feeds 'handshakes' session ticket handshakes, UniformDH handshakes and
+probes (random data) to a ScrambleSuit server in 1-byte, 100-byte and
+full-size segments, and reports the CPU time the server spends per
+handshake to authenticate it (or to give up on a probe).  Handshakes
+carry the maximum amount of padding.  The UniformDH key exchange itself
+is not included.
+
+Run from the top of the source tree:
+    python bench/bench_handshake_segments.py [handshakes]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.network.buffer as obfs_buf
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+import obfsproxy.transports.scramblesuit.scramblesuit as scramblesuit
+import obfsproxy.transports.scramblesuit.ticket as ticket
+import obfsproxy.transports.scramblesuit.util as util
+
+SECRET = "S" * const.SHARED_SECRET_LENGTH
+SEGMENTS = (1, 100, const.MAX_HANDSHAKE_LENGTH)
+
+def authMessage(header, key):
+    """Return 'header' with maximum padding, its mark and its HMAC."""
+    padding = os.urandom(const.MAX_PADDING_LENGTH - len(header))
+    mark = mycrypto.HMAC_SHA256_128(key, header)
+    return header + padding + mark + \
+           mycrypto.HMAC_SHA256_128(key, header + padding + mark + util.getEpoch())
+
+def ticketMessage():
+    server = scramblesuit.ScrambleSuitTransport()
+    blurb = ticket.issueTicketAndKey(server.srvState)
+    server.deriveSecrets(blurb[:const.MASTER_KEY_LENGTH])
+    return authMessage(blurb[const.MASTER_KEY_LENGTH:], server.recvHMAC)
+
+def uniformDHMessage():
+    return authMessage(os.urandom(const.PUBLIC_KEY_LENGTH), SECRET)
+
+def probeMessage():
+    return os.urandom(const.MAX_HANDSHAKE_LENGTH + 1)
+
+def authenticate(server, data):
+    """Do what the server does with the data it received so far."""
+    return server.receiveTicket(data) or \
+           server.uniformdh.extractPublicKey(data, server.srvState)
+
+def run(messages, segment):
+    """Return the CPU time per handshake when receiving 'segment' bytes at once."""
+    elapsed = 0
+    for msg in messages:
+        server = scramblesuit.ScrambleSuitTransport()
+        data = obfs_buf.Buffer()
+
+        start = time.clock()
+        for i in xrange(0, len(msg), segment):
+            data.write(msg[i:i + segment])
+            if authenticate(server, data):
+                break
+        elapsed += time.clock() - start
+
+    return elapsed / len(messages)
+
+def main():
+    handshakes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logging.get_obfslogger().disable_logs()
+
+    suit = scramblesuit.ScrambleSuitTransport
+    suit.weAreServer, suit.weAreClient, suit.weAreExternal = True, False, False
+    suit.uniformDHSecret = SECRET
+
+    const.STATE_LOCATION = tempfile.mkdtemp(prefix='bench_handshake_segments_')
+    try:
+        print "%10s %14s %14s %14s" % ("segment", "ticket us", "UniformDH us", "probe us")
+        for segment in SEGMENTS:
+            results = [run([create() for _ in xrange(handshakes)], segment)
+                       for create in (ticketMessage, uniformDHMessage, probeMessage)]
+            print "%10d %14.1f %14.1f %14.1f" % ((segment,) +
+                                                 tuple(1e6 * r for r in results))
+    finally:
+        shutil.rmtree(const.STATE_LOCATION)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Handshake storm benchmark.
+
+A client and a server obfsproxy (obfs3 by default) are started in front
+of a local echo server, once for every handshake process count given
+on the command line. One circuit is opened and pinged (one byte echoed
+every 10 ms) while 'concurrency' clients open new circuits as fast as
+they can. We report the handshake rate and the round trip times of the
+established circuit during the storm.
+
+Run from the top of the source tree:
+    python bench/bench_handshake_storm.py [transport] [processes ...]
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from bench_ttfb import TRANSPORTS, echo_server, free_port, start_proxy, ttfb, wait_for_listener
+from bench_workers import parallel
+
+CONCURRENCY = 16
+STORM_SECONDS = 10
+PING_INTERVAL = 0.01
+
+def ping(port, stop):
+    """Echo a byte through one circuit until 'stop' is set. Return the RTTs."""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    rtts = []
+    while not stop.is_set():
+        start = time.time()
+        sock.sendall('X')
+        if sock.recv(1) != 'X':
+            raise RuntimeError("Echo failed.")
+        rtts.append(time.time() - start)
+        time.sleep(PING_INTERVAL)
+
+    sock.close()
+    return sorted(rtts)
+
+def storm(port):
+    """Open circuits through 'port' for STORM_SECONDS. Return how many succeeded."""
+    deadline = time.time() + STORM_SECONDS
+
+    def loop():
+        count = 0
+        while time.time() < deadline:
+            try:
+                ttfb(port)
+                count += 1
+            except (socket.error, RuntimeError):
+                pass # refused
+        return count
+
+    return sum(parallel(CONCURRENCY, loop))
+
+def run(transport, args, echo_port, n_processes):
+    data_dir = tempfile.mkdtemp(prefix='bench_storm_')
+    server_port = free_port()
+    client_port = free_port()
+    options = ['--no-log', '--handshake-processes', str(n_processes)]
+
+    server = start_proxy(transport, args, 'server', server_port, echo_port,
+                         os.path.join(data_dir, 'server'), options)
+    client = start_proxy(transport, args, 'client', client_port, server_port,
+                         os.path.join(data_dir, 'client'), options)
+
+    try:
+        wait_for_listener(server_port)
+        wait_for_listener(client_port)
+        ttfb(client_port) # warm up
+
+        stop = threading.Event()
+        rtts = []
+        pinger = threading.Thread(target=lambda: rtts.extend(ping(client_port, stop)))
+        pinger.start()
+
+        handshakes = storm(client_port)
+        stop.set()
+        pinger.join()
+
+        return handshakes / float(STORM_SECONDS), rtts
+    finally:
+        client.terminate()
+        server.terminate()
+        client.wait()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    transport = sys.argv[1] if len(sys.argv) > 1 else 'obfs3'
+    process_counts = [int(n) for n in sys.argv[2:]] or [0, 1, 2]
+    args = dict(TRANSPORTS)[transport]
+    echo_port = echo_server()
+
+    print "%10s %14s %14s %14s %14s" % ("processes", "handshakes/s", "ping p50 ms",
+                                        "ping p99 ms", "ping max ms")
+    for n_processes in process_counts:
+        rate, rtts = run(transport, args, echo_port, n_processes)
+        print "%10d %14.1f %14.2f %14.2f %14.2f" % (n_processes, rate,
+                                                    rtts[len(rtts) / 2] * 1000,
+                                                    rtts[len(rtts) * 99 / 100] * 1000,
+                                                    rtts[-1] * 1000)
+
+if __name__ == '__main__':
+    main()
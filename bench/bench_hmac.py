@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit HMAC benchmark.
+
+Measures, on one core, how many HMAC-SHA256-128s per second ScrambleSuit
+computes over MTU-sized messages with a raw key and (if available) with a
+precomputed HMACContext, and how many MTU-sized protocol messages per
+second go through encryptAndHMAC() and MessageExtractor.extract().
+
+Run from the top of the source tree:
+    python bench/bench_hmac.py [seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.message as message
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+
+def rate(function, seconds):
+    """Return how many times per second 'function' can be called."""
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        function()
+        count += 1
+
+    return count / (time.time() - start)
+
+def hmac_key(key):
+    """Return what ScrambleSuit authenticates messages with."""
+    if hasattr(mycrypto, 'HMACContext'):
+        return mycrypto.HMACContext(key)
+    return key
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    logging.get_obfslogger().disable_logs()
+
+    key = os.urandom(const.SHARED_SECRET_LENGTH)
+    data = os.urandom(1448)
+
+    print "%28s %12s" % ("operation", "per second")
+    print "%28s %12.0f" % ("HMAC_SHA256_128(key)",
+                           rate(lambda: mycrypto.HMAC_SHA256_128(key, data), seconds))
+    if hasattr(mycrypto, 'HMACContext'):
+        context = mycrypto.HMACContext(key)
+        print "%28s %12.0f" % ("HMACContext.digest",
+                               rate(lambda: context.digest(data), seconds))
+
+    sessionKey, iv = os.urandom(32), os.urandom(8)
+    sender, receiver = mycrypto.PayloadCrypter(), mycrypto.PayloadCrypter()
+    sender.setSessionKey(sessionKey, iv)
+    receiver.setSessionKey(sessionKey, iv)
+    sendHMAC, recvHMAC = hmac_key(key), hmac_key(key)
+    extractor = message.MessageExtractor()
+    payload = os.urandom(const.MPU)
+
+    def roundtrip():
+        msg = message.ProtocolMessage(payload=payload)
+        extractor.extract(msg.encryptAndHMAC(sender, sendHMAC), receiver, recvHMAC)
+
+    print "%28s %12.0f" % ("encrypt+HMAC+extract (MTU)", rate(roundtrip, seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit inter-arrival time obfuscation benchmark.
+
+Sends a bulk transfer and a single Tor cell through a ScrambleSuit
+connection in every IAT mode and reports the resulting throughput and
+how long the data was held back. The reactor's clock is simulated, so
+the numbers show the delays IAT obfuscation adds, not CPU time.
+
+Run from the top of the source tree:
+    python bench/bench_iat.py [bulk bytes]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import task
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.timerwheel as timerwheel
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.scramblesuit as scramblesuit
+
+# (mode, minimum rate in bytes per second)
+SETTINGS = ((const.IAT_MODE_OFF, None),
+            (const.IAT_MODE_FULL, None),
+            (const.IAT_MODE_ADAPTIVE, 256 * 1024),
+            (const.IAT_MODE_ADAPTIVE, 1024 * 1024),
+            (const.IAT_MODE_ADAPTIVE, 10 * 1024 * 1024))
+
+class Downstream(object):
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+class Circuit(object):
+    downstream = Downstream()
+
+def transfer(mode, minRate, size):
+    """Return how many (simulated) seconds sending 'size' bytes takes."""
+    clock = task.Clock()
+    scramblesuit.reactor = clock
+    timerwheel.wheel = timerwheel.TimerWheel(clock)
+
+    transport = scramblesuit.ScrambleSuitTransport()
+    transport.circuit = Circuit()
+    transport.deriveSecrets("M" * const.MASTER_KEY_LENGTH)
+    transport.iatMode = mode
+    transport.iatMinRate = minRate or const.IAT_MIN_RATE
+
+    transport.sendRemote("X" * size)
+    while clock.getDelayedCalls():
+        clock.advance(min(call.getTime() for call in clock.getDelayedCalls()) -
+                      clock.seconds())
+
+    return clock.seconds()
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024 * 1024
+    logging.get_obfslogger().disable_logs()
+
+    suit = scramblesuit.ScrambleSuitTransport
+    suit.weAreServer, suit.weAreClient, suit.weAreExternal = False, True, False
+
+    print "%10s %12s %14s %16s" % ("mode", "min rate", "bulk KB/s", "cell delay ms")
+    for mode, minRate in SETTINGS:
+        bulk = transfer(mode, minRate, size)
+        cell = sum(transfer(mode, minRate, 586) for _ in xrange(100)) / 100
+
+        print "%10s %12s %14s %16.2f" % (mode, minRate or "-",
+                                         "%.0f" % (size / 1024.0 / bulk) if bulk else "inf",
+                                         1000 * cell)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit padding budget benchmark.
+
+Pads 'bursts' bursts with the packet length distributions of 20 random
+bridges, for several padding budgets and two kinds of traffic: single
+Tor cells (interactive) and a mix of cells and 16 KB bursts (web).
+Reports the padding overhead (padding bytes per byte of data), the
+share of bursts whose padding was capped and the CPU time per burst.
+
+Run from the top of the source tree:
+    python bench/bench_padding.py [bursts]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
+import obfsproxy.transports.scramblesuit.probdist as probdist
+
+BUDGETS = (None, 1.0, 0.5, 0.25, 0.1)
+BRIDGES = 20
+CELL = 586
+
+def interactive(prng):
+    return CELL
+
+def web(prng):
+    return CELL if prng.random() < 0.7 else 16 * 1024
+
+def run(budget, traffic, bursts):
+    """Return (overhead, capped share, microseconds per burst)."""
+    data = padding = capped = 0
+    elapsed = 0
+    for bridge in xrange(BRIDGES):
+        dist = probdist.seededDistributions(str(bridge))[0]
+        morpher = packetmorpher.new(dist, packetmorpher.PaddingBudget(budget))
+        prng = random.Random(bridge)
+        lengths = [traffic(prng) for _ in xrange(bursts)]
+
+        start = time.clock()
+        for length in lengths:
+            morpher.calcPadding(length)
+        elapsed += time.clock() - start
+
+        data += morpher.budget.dataBytes
+        padding += morpher.budget.paddingBytes
+        capped += morpher.budget.cappedBursts
+
+    return (float(padding) / data, float(capped) / (BRIDGES * bursts),
+            1e6 * elapsed / (BRIDGES * bursts))
+
+def main():
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    logging.get_obfslogger().disable_logs()
+
+    print "%12s %8s %10s %8s %10s" % ("traffic", "budget", "overhead",
+                                      "capped", "us/burst")
+    for traffic in (interactive, web):
+        for budget in BUDGETS:
+            overhead, capped, usec = run(budget, traffic, bursts)
+            print "%12s %8s %9.1f%% %7.1f%% %10.2f" % (traffic.__name__,
+                  "off" if budget is None else budget, 100 * overhead,
+                  100 * capped, usec)
+
+if __name__ == '__main__':
+    main()
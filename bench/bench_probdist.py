@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit padding path benchmark.
+
+Measures how long drawing a sample from a packet length distribution,
+and deciding the padding of a Tor cell with it, takes for distributions
+with few and with many bins.  Also measures how long a client takes to
+set up the distributions for a PRNG seed it receives, the first time and
+when reconnecting to the same bridge.
+
+Run from the top of the source tree:
+    python bench/bench_probdist.py [samples]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
+import obfsproxy.transports.scramblesuit.probdist as probdist
+
+BINS = (10, 50, 100)
+
+def usec(function, samples):
+    """Return the best of five runs in microseconds per call."""
+    return 1e6 * min(timeit.repeat(function, number=samples, repeat=5)) / samples
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    logging.get_obfslogger().disable_logs()
+
+    print "%6s %14s %14s" % ("bins", "sample us", "padding us")
+    for bins in BINS:
+        const.MIN_BINS = const.MAX_BINS = bins
+        prng = random.Random("bench")
+        dist = probdist.new(lambda: prng.randint(const.HDR_LENGTH, const.MTU),
+                            seed="bench")
+        morpher = packetmorpher.new(dist)
+
+        print "%6d %14.3f %14.3f" % (bins, usec(dist.randomSample, samples),
+                                     usec(lambda: morpher.getPaddingFrames(586),
+                                          samples))
+
+    const.MIN_BINS, const.MAX_BINS = 1, 100
+    seed = os.urandom(const.PRNG_SEED_LENGTH)
+    seeds = 200
+
+    def uncached():
+        probdist._seeded.clear()
+        probdist.seededDistributions(seed)
+
+    print
+    print "%14s %14s" % ("new seed us", "known seed us")
+    print "%14.3f %14.3f" % (usec(uncached, seeds),
+                             usec(lambda: probdist.seededDistributions(seed),
+                                  seeds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Circuit limits benchmark: a bridge under a scan.
+
+Runs an obfs2 server listener in front of a local sink that stands in
+for the ORPort, and opens 'probes' connections to it over DURATION
+seconds that send a few bytes and then stall, like scanners and probes
+do. Reports the open circuits, file descriptors and resident memory
+at the end, with and without a handshake timeout of two seconds. Every
+setting runs in a fresh process.
+
+Run from the top of the source tree:
+    python bench/bench_probes.py [probes]
+"""
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import protocol, reactor
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.transport_config as transport_config
+import obfsproxy.network.circuit_table as circuit_table
+import obfsproxy.network.network as network
+import obfsproxy.transports.transports as transports
+
+# Seconds over which the probes arrive.
+DURATION = 10
+
+class Probe(protocol.Protocol):
+    def connectionMade(self):
+        self.transport.write('X' * 10)
+
+class Sink(protocol.Protocol):
+    pass
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+def run(probes, handshake_timeout):
+    logging.get_obfslogger().disable_logs()
+    network.set_circuit_limits(handshake_timeout, network.IDLE_TIMEOUT,
+                               network.MAX_CIRCUIT_BUFFER, network.MAX_CIRCUITS)
+
+    sink = reactor.listenTCP(0, protocol.Factory.forProtocol(Sink), interface='127.0.0.1')
+    pt_config = transport_config.TransportConfig()
+    pt_config.setListenerMode('server')
+    pt_config.setObfsproxyMode('external')
+    transports.transports['obfs2']['base'].setup(pt_config)
+    factory = network.StaticDestinationServerFactory(
+        ('127.0.0.1', sink.getHost().port), 'server',
+        transports.get_transport_class('obfs2', 'server'), pt_config)
+    listener = reactor.listenTCP(0, factory, interface='127.0.0.1', backlog=1024)
+
+    base = (rss_kb(), open_fds())
+    creator = protocol.ClientCreator(reactor, Probe)
+    for i in xrange(probes):
+        reactor.callLater(i * float(DURATION) / probes, creator.connectTCP, '127.0.0.1',
+                          listener.getHost().port)
+
+    def report():
+        reaped = metrics.CIRCUITS_REAPED.labels('obfs2', network.REAPED_HANDSHAKE_TIMEOUT)
+        print "%10s %10d %10d %10d %12d" % (handshake_timeout or "off",
+              len(circuit_table.table), reaped.value, open_fds() - base[1],
+              rss_kb() - base[0])
+        reactor.stop()
+
+    reactor.callLater(DURATION + 0.5, report)
+    reactor.run()
+
+def main():
+    if len(sys.argv) > 2:
+        run(int(sys.argv[1]), int(sys.argv[2]))
+        return
+
+    probes = sys.argv[1] if len(sys.argv) > 1 else '5000'
+    print "%s probes, %d seconds" % (probes, DURATION)
+    print "%10s %10s %10s %10s %12s" % ("timeout", "circuits", "reaped",
+                                        "fds", "RSS KB")
+    sys.stdout.flush()
+    for timeout in ('0', '2'):
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                               probes, timeout])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit replay table benchmark.
+
+Adds 'entries' fresh HMACs to a replay table, the way a busy bridge does
+within one epoch, and then looks up as many fresh ones. Reports the
+operations per second and how much memory the table took, for the exact
+table and the Bloom filter table. Every table is filled in a process of
+its own, so that its memory can be measured. Filling stops after
+'seconds' if the table is too slow. Fresh HMACs which are taken for
+replays are counted as false positives.
+
+Run from the top of the source tree:
+    python bench/bench_replay.py [entries] [seconds]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.replay as replay
+
+HMAC_LENGTH = 16
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def measure(kind, entries, seconds):
+    logging.get_obfslogger().disable_logs()
+
+    hmacs = os.urandom(HMAC_LENGTH * entries * 2)
+    rss = maxrss_mb()
+
+    if kind == 'bloom':
+        tracker = replay.BloomTracker(entries)
+    else:
+        tracker = replay.Tracker()
+
+    added = 0
+    start = time.time()
+    for offset in xrange(0, HMAC_LENGTH * entries, HMAC_LENGTH):
+        tracker.addElement(hmacs[offset:offset + HMAC_LENGTH])
+        added += 1
+        if (added % 1000 == 0) and (time.time() - start > seconds):
+            break
+    add_rate = added / (time.time() - start)
+    rss = maxrss_mb() - rss
+
+    looked_up = present = 0
+    start = time.time()
+    for offset in xrange(HMAC_LENGTH * entries, HMAC_LENGTH * (entries + added), HMAC_LENGTH):
+        present += tracker.isPresent(hmacs[offset:offset + HMAC_LENGTH])
+        looked_up += 1
+        if (looked_up % 1000 == 0) and (time.time() - start > seconds):
+            break
+    lookup_rate = looked_up / (time.time() - start)
+
+    print "%8s %10d %12.0f %12.0f %10.1f %8d" % (kind, added, add_rate, lookup_rate, rss,
+                                                 present)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+        return
+
+    entries = sys.argv[1] if len(sys.argv) > 1 else '1000000'
+    seconds = sys.argv[2] if len(sys.argv) > 2 else '30'
+
+    kinds = ['exact']
+    if hasattr(replay, 'BloomTracker'):
+        kinds.append('bloom')
+
+    print "%8s %10s %12s %12s %10s %8s" % ("table", "entries", "adds/s", "lookups/s", "MB",
+                                           "false+")
+    sys.stdout.flush()
+    for kind in kinds:
+        subprocess.check_call([sys.executable, __file__, '--measure', kind, entries, seconds])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit shared server state benchmark.
+
+Measures how many HMACs per second 'processes' server processes can
+register in the replay table, with a private replay table (plus the
+replay journal) and with a replay table shared between all processes.
+
+Run from the top of the source tree:
+    python bench/bench_shared_state.py [handshakes]
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.state as state
+
+PROCESSES = (1, 2, 4)
+
+def register(shared, handshakes, queue):
+    state.setShared(shared)
+    state._state = None
+    srvState = state.load()
+    hmacs = [os.urandom(const.HMAC_SHA256_128_LENGTH) for _ in xrange(handshakes)]
+
+    start = time.time()
+    for hmac in hmacs:
+        srvState.registerKey(hmac)
+    queue.put(time.time() - start)
+
+def run(shared, processes, handshakes):
+    """Return the aggregate number of HMACs registered per second."""
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=register,
+                                       args=(shared, handshakes, queue))
+               for _ in xrange(processes)]
+    for worker in workers:
+        worker.start()
+    durations = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    return processes * handshakes / max(durations)
+
+def main():
+    handshakes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logging.get_obfslogger().disable_logs()
+
+    const.STATE_LOCATION = tempfile.mkdtemp(prefix='bench_shared_state_')
+    try:
+        # Create the state file once, so that all processes load the same.
+        state.load()
+        state._state = None
+
+        print "%10s %16s %16s" % ("processes", "private HMAC/s", "shared HMAC/s")
+        for processes in PROCESSES:
+            print "%10d %16.0f %16.0f" % (processes,
+                                          run(False, processes, handshakes),
+                                          run(True, processes, handshakes))
+    finally:
+        shutil.rmtree(const.STATE_LOCATION)
+
+if __name__ == '__main__':
+    main()
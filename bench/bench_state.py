@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit server state benchmark.
+
+Fills the replay table of a fresh server state with 'entries' HMACs and
+then measures how long registering the HMAC of a new handshake keeps the
+reactor busy, including writing the state to disk.
+
+Run from the top of the source tree:
+    python bench/bench_state.py [handshakes]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.state as state
+
+SIZES = (1000, 10000, 100000)
+
+def main():
+    handshakes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logging.get_obfslogger().disable_logs()
+
+    print "%10s %14s %14s" % ("entries", "mean ms", "max ms")
+    for entries in SIZES:
+        const.STATE_LOCATION = tempfile.mkdtemp(prefix='bench_state_')
+        try:
+            srvState = state.load()
+            for _ in xrange(entries):
+                srvState.replayTracker.addElement(os.urandom(const.HMAC_SHA256_128_LENGTH))
+
+            durations = []
+            for _ in xrange(handshakes):
+                hmac = os.urandom(const.HMAC_SHA256_128_LENGTH)
+                start = time.time()
+                srvState.registerKey(hmac)
+                durations.append(time.time() - start)
+
+            print "%10d %14.3f %14.3f" % (entries, 1000 * sum(durations) / len(durations),
+                                          1000 * max(durations))
+        finally:
+            shutil.rmtree(const.STATE_LOCATION)
+
+if __name__ == '__main__':
+    main()
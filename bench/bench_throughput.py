@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+Bulk throughput benchmark.
+
+Like bench_ttfb.py, a client and a server obfsproxy are started in
+front of a local echo server, this time with the logging options given
+on the command line (by default '--log-min-severity warning', where
+per-packet debug messages must cost nothing). A single connection then
+pushes 'megabytes' of data through both proxies and reads the echo
+back. Every transport is measured REPETITIONS times, since a single
+transfer varies by 20% or more from one run to the next; the median and
+the range are reported.
+
+b64 is left out: it relies on TCP segment boundaries to split its
+base64 objects, so it loses data on bulk transfers.
+
+Run from the top of the source tree:
+    python bench/bench_throughput.py [megabytes] [obfsproxy options...]
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from bench_ttfb import TRANSPORTS, echo_server, free_port, start_proxy, wait_for_listener
+
+CHUNK = 'X' * 65536
+
+# How many transfers are measured per transport.
+REPETITIONS = 9
+
+def transfer(port, total):
+    """Push 'total' bytes through 'port' and wait for the echo. Return seconds."""
+    sock = socket.create_connection(('127.0.0.1', port))
+
+    def send():
+        for _ in xrange(total / len(CHUNK)):
+            sock.sendall(CHUNK)
+
+    start = time.time()
+
+    sender = threading.Thread(target=send)
+    sender.daemon = True
+    sender.start()
+
+    received = 0
+    while received < total:
+        data = sock.recv(65536)
+        if not data:
+            raise RuntimeError("Connection closed after %d bytes." % received)
+        received += len(data)
+
+    elapsed = time.time() - start
+    sock.close()
+
+    return elapsed
+
+def run(transport, args, echo_port, total, options):
+    """Return the seconds it takes to echo 'total' bytes through 'transport'."""
+    data_dir = tempfile.mkdtemp(prefix='bench_throughput_')
+    server_port = free_port()
+    client_port = free_port()
+
+    server = start_proxy(transport, args, 'server', server_port, echo_port,
+                         os.path.join(data_dir, 'server'), options)
+    client = start_proxy(transport, args, 'client', client_port, server_port,
+                         os.path.join(data_dir, 'client'), options)
+
+    try:
+        wait_for_listener(server_port)
+        wait_for_listener(client_port)
+
+        return transfer(client_port, total)
+    finally:
+        client.terminate()
+        server.terminate()
+        client.wait()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    options = sys.argv[2:] or ['--log-min-severity', 'warning']
+    total = megabytes * 1024 * 1024
+    echo_port = echo_server()
+
+    print "%14s %12s %16s" % ("transport", "median MB/s", "range MB/s")
+    for transport, args in TRANSPORTS:
+        if transport == 'b64':
+            continue
+
+        rates = sorted(megabytes / run(transport, args, echo_port, total, options)
+                       for _ in xrange(REPETITIONS))
+        print "%14s %12.2f %7.2f - %6.2f" % (transport, rates[len(rates) / 2],
+                                             rates[0], rates[-1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+ScrambleSuit client session ticket benchmark.
+
+Stores tickets for 'bridges' bridges and then measures how long a client
+connection keeps the reactor busy with tickets: redeeming the stored
+ticket of a bridge and storing the new one the bridge sends.
+
+Run from the top of the source tree:
+    python bench/bench_tickets.py [connections]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.log as logging
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.ticket as ticket
+
+SIZES = (10, 100, 1000)
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logging.get_obfslogger().disable_logs()
+
+    masterKey = os.urandom(const.MASTER_KEY_LENGTH)
+    rawTicket = os.urandom(const.TICKET_LENGTH)
+
+    print "%10s %14s" % ("bridges", "ms/connection")
+    for bridges in SIZES:
+        const.STATE_LOCATION = tempfile.mkdtemp(prefix='bench_tickets_') + '/'
+        try:
+            for i in xrange(bridges):
+                ticket.storeNewTicket(masterKey, rawTicket, "192.0.2.1:%d" % i)
+
+            start = time.time()
+            for i in xrange(connections):
+                bridge = "192.0.2.1:%d" % (i % bridges)
+                ticket.findStoredTicket(bridge)
+                ticket.storeNewTicket(masterKey, rawTicket, bridge)
+            duration = time.time() - start
+
+            print "%10d %14.3f" % (bridges, 1000 * duration / connections)
+        finally:
+            shutil.rmtree(const.STATE_LOCATION)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Timer benchmark: Twisted's reactor.callLater() against the timer wheel.
+
+Runs 'circuits' circuits on the real reactor, each of which re-arms a
+timer of 0 to 10 ms whenever it fires, like inter-arrival time
+obfuscation does. Reports how many timers fire per CPU second, and what
+scheduling and cancelling a timer costs with many timers pending.
+
+Run from the top of the source tree:
+    python bench/bench_timers.py [circuits] [seconds]
+"""
+
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import reactor
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.timerwheel as timerwheel
+
+MAX_DELAY = 0.01
+
+def twisted_call_later(delay, function, *args):
+    return reactor.callLater(delay, function, *args)
+
+def wheel_call_later(delay, function, *args):
+    return timerwheel.wheel.call_later(delay, function, *args)
+
+class Circuit(object):
+    def __init__(self, call_later, counter):
+        self.call_later = call_later
+        self.counter = counter
+        self.timer = call_later(random.uniform(0, MAX_DELAY), self.flush)
+
+    def flush(self):
+        self.counter[0] += 1
+        self.timer = self.call_later(random.uniform(0, MAX_DELAY), self.flush)
+
+def run(call_later, circuits, seconds):
+    """Return the timers that fired per CPU second."""
+    counter = [0]
+    state = {}
+
+    def start():
+        state['circuits'] = [Circuit(call_later, counter)
+                             for _ in xrange(circuits)]
+        state['fired'] = counter[0]
+        state['cpu'] = time.clock()
+
+    def stop():
+        state['cpu'] = time.clock() - state['cpu']
+        state['fired'] = counter[0] - state['fired']
+        for circuit in state['circuits']:
+            circuit.timer.cancel()
+        reactor.crash()
+
+    reactor.callLater(0, start)
+    reactor.callLater(seconds, stop)
+    reactor.run()
+
+    return state['fired'] / state['cpu']
+
+def schedule_cancel(call_later, circuits):
+    """Return the microseconds a timer takes to schedule and cancel."""
+    pending = [call_later(random.uniform(0, MAX_DELAY), int)
+               for _ in xrange(circuits)]
+    number = 20000
+    cost = min(timeit.repeat(lambda: call_later(0.005, int).cancel(),
+                             repeat=5, number=number)) / number
+    for timer in pending:
+        timer.cancel()
+    return 1e6 * cost
+
+def main():
+    circuits = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    logging.get_obfslogger().disable_logs()
+
+    print "%d circuits, %.0f seconds" % (circuits, seconds)
+    print "%10s %16s %20s" % ("timers", "fires/CPU sec", "schedule+cancel us")
+    for name, call_later in (("callLater", twisted_call_later),
+                             ("wheel", wheel_call_later)):
+        print "%10s %16.0f %20.2f" % (name, run(call_later, circuits, seconds),
+                                      schedule_cancel(call_later, circuits))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Time-to-first-byte benchmark for all transports.
+
+For every transport, a client and a server obfsproxy are started in
+external mode in front of a local echo server:
+
+    bench -> client obfsproxy -> server obfsproxy -> echo server
+
+Each sample opens a new connection to the client obfsproxy, sends one
+byte and waits for it to come back, so it covers circuit setup on both
+proxies, the transport handshake and one round trip of payload.
+
+Run from the top of the source tree:
+    python bench/bench_ttfb.py [samples]
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TOP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+OBFSPROXY = os.path.join(TOP, 'bin', 'obfsproxy')
+
+SCRAMBLESUIT_PASSWORD = 'A' * 32
+
+# Extra CLI arguments of each transport, given after the transport name.
+TRANSPORTS = [
+    ('dummy', []),
+    ('b64', []),
+    ('obfs2', []),
+    ('obfs3', []),
+    ('scramblesuit', ['--password', SCRAMBLESUIT_PASSWORD]),
+]
+
+def free_port():
+    """Return a TCP port on localhost that is free right now."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def echo_server():
+    """Start an echo server in a thread. Return its port."""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def echo(conn):
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            conn.sendall(data)
+        conn.close()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            thread = threading.Thread(target=echo, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    return listener.getsockname()[1]
+
+def start_proxy(transport, args, mode, listen_port, dest_port, data_dir,
+                options=('--no-log',)):
+    """
+    Start an obfsproxy in external mode. 'options' are the global CLI
+    options to give it. Return its Popen object.
+    """
+    cmd = [sys.executable, OBFSPROXY] + list(options) + ['--data-dir', data_dir,
+           transport] + args + [mode, '127.0.0.1:%d' % listen_port,
+                                '--dest', '127.0.0.1:%d' % dest_port]
+
+    return subprocess.Popen(cmd, cwd=TOP)
+
+def wait_for_listener(port, timeout=10):
+    """Wait until something accepts connections on 'port'."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+
+    raise RuntimeError("Nothing is listening on port %d." % port)
+
+def ttfb(port):
+    """Return the time it takes to echo a byte through 'port'."""
+    start = time.time()
+
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall('X')
+    if sock.recv(1) != 'X':
+        raise RuntimeError("Echo failed.")
+
+    elapsed = time.time() - start
+    sock.close()
+
+    return elapsed
+
+def run(transport, args, echo_port, samples, options=('--no-log',), pause=0):
+    """
+    Return the sorted TTFB samples of 'transport', taken 'pause'
+    seconds apart. 'options' are the global CLI options of the proxies.
+    """
+    data_dir = tempfile.mkdtemp(prefix='bench_ttfb_')
+    server_port = free_port()
+    client_port = free_port()
+
+    server = start_proxy(transport, args, 'server', server_port, echo_port,
+                         os.path.join(data_dir, 'server'), options)
+    client = start_proxy(transport, args, 'client', client_port, server_port,
+                         os.path.join(data_dir, 'client'), options)
+
+    try:
+        wait_for_listener(server_port)
+        wait_for_listener(client_port)
+
+        ttfb(client_port) # warm up
+        results = []
+        for _ in xrange(samples):
+            time.sleep(pause)
+            results.append(ttfb(client_port))
+        return sorted(results)
+    finally:
+        client.terminate()
+        server.terminate()
+        client.wait()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    echo_port = echo_server()
+
+    print "%14s %12s %12s %12s" % ("transport", "median ms", "p90 ms", "max ms")
+    for transport, args in TRANSPORTS:
+        results = run(transport, args, echo_port, samples)
+        print "%14s %12.2f %12.2f %12.2f" % (transport,
+                                             results[len(results) / 2] * 1000,
+                                             results[len(results) * 9 / 10] * 1000,
+                                             results[-1] * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+UniformDH benchmark.
+
+Measures how many keypairs per second obfs3_dh.UniformDH generates, and
+how many shared secrets per second it computes, on one core. Whether
+gmpy is used depends on whether it's installed.
+
+Run from the top of the source tree:
+    python bench/bench_uniformdh.py [seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import obfsproxy.common.modexp as modexp
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+def rate(function, seconds):
+    """Return how many times per second 'function' runs."""
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        function()
+        count += 1
+
+    return count / (time.time() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print "gmpy:            %10s" % (modexp.mpz.__module__ != modexp.__name__)
+
+    start = time.time()
+    obfs3_dh.UniformDH()
+    print "first keypair:   %10.1f ms" % ((time.time() - start) * 1000)
+
+    peer = obfs3_dh.UniformDH()
+    print "keypairs/s:      %10.1f" % rate(obfs3_dh.UniformDH, seconds)
+    print "secrets/s:       %10.1f" % rate(lambda: peer.get_secret(peer.get_public()), seconds)
+
+if __name__ == '__main__':
+    main()
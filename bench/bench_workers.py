@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Worker mode scaling benchmark.
+
+A client and a server obfsproxy (obfs3 by default) are started with
+'--workers N' in front of a local echo server, for every N given on the
+command line. For each N we measure:
+
+  handshakes/s: new circuits per second (connect, echo one byte,
+                close) with 'concurrency' clients at a time.
+  MB/s: aggregate throughput of 'concurrency' parallel bulk streams.
+
+Scaling obviously needs as many free CPU cores as workers on both
+proxies.
+
+Run from the top of the source tree:
+    python bench/bench_workers.py [transport] [N ...]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from bench_ttfb import TRANSPORTS, echo_server, free_port, start_proxy, ttfb, wait_for_listener
+from bench_throughput import transfer
+
+CONCURRENCY = 8
+HANDSHAKE_SECONDS = 5
+STREAM_BYTES = 8 * 1024 * 1024
+
+def parallel(n_threads, function):
+    """Run 'function' in 'n_threads' threads. Return their results."""
+    results = []
+    def run():
+        results.append(function())
+
+    threads = [threading.Thread(target=run) for _ in xrange(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def handshake_rate(port):
+    """Return circuits per second through 'port'."""
+    deadline = time.time() + HANDSHAKE_SECONDS
+
+    def loop():
+        count = 0
+        while time.time() < deadline:
+            ttfb(port)
+            count += 1
+        return count
+
+    start = time.time()
+    total = sum(parallel(CONCURRENCY, loop))
+    return total / (time.time() - start)
+
+def throughput(port):
+    """Return the aggregate MB/s of parallel streams through 'port'."""
+    start = time.time()
+    parallel(CONCURRENCY, lambda: transfer(port, STREAM_BYTES))
+    elapsed = time.time() - start
+
+    return CONCURRENCY * STREAM_BYTES / (1024.0 * 1024.0) / elapsed
+
+def run(transport, args, echo_port, n_workers):
+    data_dir = tempfile.mkdtemp(prefix='bench_workers_')
+    server_port = free_port()
+    client_port = free_port()
+    options = ['--no-log', '--workers', str(n_workers)]
+
+    server = start_proxy(transport, args, 'server', server_port, echo_port,
+                         os.path.join(data_dir, 'server'), options)
+    client = start_proxy(transport, args, 'client', client_port, server_port,
+                         os.path.join(data_dir, 'client'), options)
+
+    try:
+        wait_for_listener(server_port)
+        wait_for_listener(client_port)
+        time.sleep(1) # let every worker come up
+
+        return handshake_rate(client_port), throughput(client_port)
+    finally:
+        client.terminate()
+        server.terminate()
+        client.wait()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    transport = sys.argv[1] if len(sys.argv) > 1 else 'obfs3'
+    worker_counts = [int(n) for n in sys.argv[2:]] or [1, 2, 4]
+    args = dict(TRANSPORTS)[transport]
+    echo_port = echo_server()
+
+    print "%8s %14s %12s" % ("workers", "handshakes/s", "MB/s")
+    for n_workers in worker_counts:
+        rate, mbps = run(transport, args, echo_port, n_workers)
+        print "%8d %14.1f %12.2f" % (n_workers, rate, mbps)
+
+if __name__ == '__main__':
+    main()
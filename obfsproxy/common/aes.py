@@ -3,11 +3,10 @@
 
 """ This module is a convenience wrapper for the AES cipher in CTR mode. """
 
-from Crypto.Cipher import AES
-from Crypto.Util import Counter
+import obfsproxy.common.crypto_backend as crypto_backend
 
 class AES_CTR_128(object):
-    """An AES-CTR-128 PyCrypto wrapper."""
+    """An AES-CTR-128 wrapper, on top of our crypto backend."""
 
     def __init__(self, key, iv, counter_wraparound=False):
         """Initialize AES with the given key and IV.
@@ -19,13 +18,11 @@ class AES_CTR_128(object):
         assert(len(key) == 16)
         assert(len(iv) == 16)
 
-        self.ctr = Counter.new(128, initial_value=long(iv.encode('hex'), 16),
-                               allow_wraparound=counter_wraparound)
-        self.cipher = AES.new(key, AES.MODE_CTR, counter=self.ctr)
+        self.cipher = crypto_backend.backend.aes_ctr(key, iv, counter_wraparound)
 
     def crypt(self, data):
         """
         Encrypt or decrypt 'data'.
         """
-        return self.cipher.encrypt(data)
+        return self.cipher(data)
 
@@ -0,0 +1,95 @@
+"""
+Symmetric crypto backends.
+
+AES-CTR is what obfs2, obfs3 and ScrambleSuit spend most of their CPU
+time on for every byte they carry. This module picks the fastest
+implementation available:
+
+'cryptography': AES-CTR from OpenSSL through the 'cryptography'
+                package, if it's installed.
+'pycrypto': AES-CTR from PyCrypto, which obfsproxy depends on anyway.
+
+All backends produce the same output for the same input.
+
+(HMAC-SHA256 needs no backend: see hmac_sha256.py. The standard
+library's 'hashlib' is backed by OpenSSL already.)
+"""
+
+import warnings
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+try:
+    with warnings.catch_warnings():
+        # Recent versions of 'cryptography' warn about Python 2 on import.
+        warnings.simplefilter('ignore')
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+class PyCryptoBackend(object):
+    """AES-CTR from PyCrypto."""
+
+    name = 'pycrypto'
+
+    def aes_ctr(self, key, counter_block, wraparound=False):
+        """
+        Return a function that encrypts (and decrypts) data with AES in
+        counter mode under 'key'. The 16-byte 'counter_block' is the
+        first counter block, which is incremented as a 128-bit
+        big-endian integer. If 'wraparound' is False, running out of
+        counter blocks raises OverflowError.
+        """
+        ctr = Counter.new(128, initial_value=long(counter_block.encode('hex'), 16),
+                          allow_wraparound=wraparound)
+        return AES.new(key, AES.MODE_CTR, counter=ctr).encrypt
+
+class CryptographyBackend(object):
+    """
+    AES-CTR from OpenSSL, through the 'cryptography' package.
+
+    OpenSSL always wraps the counter around. Running out of 2^128
+    counter blocks is not a practical concern, so 'wraparound' is
+    ignored.
+    """
+
+    name = 'cryptography'
+
+    def __init__(self):
+        self.backend = default_backend()
+
+    def aes_ctr(self, key, counter_block, wraparound=False):
+        """See PyCryptoBackend.aes_ctr()."""
+        return Cipher(algorithms.AES(key), modes.CTR(counter_block),
+                      backend=self.backend).encryptor().update
+
+def get_available_backends():
+    """Return the names of the backends we can use, fastest first."""
+    names = []
+    if Cipher is not None:
+        names.append(CryptographyBackend.name)
+    names.append(PyCryptoBackend.name)
+
+    return names
+
+def set_backend(name):
+    """
+    Use the backend called 'name' from now on. Raises ValueError if
+    that backend is not available.
+    """
+    global backend
+
+    if name not in get_available_backends():
+        raise ValueError("The '%s' crypto backend is not available (try one of: %s)." %
+                         (name, ', '.join(get_available_backends())))
+
+    if name == CryptographyBackend.name:
+        backend = CryptographyBackend()
+    else:
+        backend = PyCryptoBackend()
+
+""" Global variable that holds the backend we use. """
+backend = None
+set_backend(get_available_backends()[0])
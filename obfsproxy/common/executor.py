@@ -0,0 +1,176 @@
+"""
+Handshake compute executor.
+
+The public key operations of the obfs3 and ScrambleSuit handshakes
+(1536-bit modular exponentiations) are too slow to run on the event
+loop. Threads don't help much either: without gmpy, pow() holds the
+GIL for the whole computation, so a burst of new handshakes still
+stalls the circuits that are already open.
+
+The executor runs these operations in a pool of worker processes
+instead, and hands the results back to the event loop as Deferreds.
+When the pool is not running (no processes configured, or in the
+tests), they run in Twisted's thread pool like they used to. The pool
+is only started for transports that need it (obfs3 and ScrambleSuit).
+
+To keep a handshake storm from queueing up unbounded work (and
+latency), new handshakes are refused once 'max_backlog' of them are
+waiting for a result.
+"""
+
+import multiprocessing
+import signal
+
+from twisted.internet import defer, reactor, threads
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+# How many worker processes compute handshakes by default.
+DEFAULT_PROCESSES = 1
+# How many handshakes can wait for a result before we refuse new ones.
+DEFAULT_MAX_BACKLOG = 64
+
+class HandshakeBacklogFull(Exception):
+    """Too many handshakes are waiting to be computed."""
+    pass
+
+def _init_process():
+    """Let the main process handle SIGINT."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _call(function, args):
+    """
+    Call 'function' in a worker process. Return a tuple (success,
+    result or exception), since multiprocessing does not tell us about
+    exceptions raised by asynchronous calls.
+    """
+    try:
+        return (True, function(*args))
+    except Exception, e:
+        return (False, e)
+
+class HandshakeExecutor(object):
+    """
+    Runs handshake computations off the event loop.
+
+    Attributes:
+    n_processes: How many worker processes to start. 0 means that
+                 computations run in threads.
+    max_backlog: How many handshakes can wait for a result before new
+                 ones are refused.
+    processes: The multiprocessing.Pool of our workers, or None if it
+               is not running.
+    backlog: How many handshakes are waiting for a result.
+    rejected: How many handshakes were refused.
+    """
+
+    def __init__(self):
+        self.n_processes = 0
+        self.max_backlog = DEFAULT_MAX_BACKLOG
+        self.processes = None
+        self.backlog = 0
+        self.rejected = 0
+        self.latency = metrics.HANDSHAKE_COMPUTE_SECONDS.labels()
+
+    def set_process_count(self, n_processes):
+        """
+        Compute handshakes in 'n_processes' worker processes. Raises
+        ValueError if 'n_processes' is negative.
+        """
+        if n_processes < 0:
+            raise ValueError("Can't have %d handshake processes." % n_processes)
+
+        self.n_processes = n_processes
+
+    def set_max_backlog(self, max_backlog):
+        """
+        Refuse new handshakes when 'max_backlog' of them are waiting.
+        Raises ValueError if 'max_backlog' is not a positive number.
+        """
+        if max_backlog < 1:
+            raise ValueError("The handshake backlog must be positive (not %d)." % max_backlog)
+
+        self.max_backlog = max_backlog
+
+    def is_running(self):
+        return self.processes is not None
+
+    def start(self):
+        """
+        Start our worker processes. They are forked, so this must be
+        called before the event loop (and its threads) starts.
+
+        The transports whose handshakes we compute call this from their
+        setup(), so that no processes are started for the others.
+        """
+        if not self.n_processes or self.is_running():
+            return
+
+        self.processes = multiprocessing.Pool(self.n_processes, _init_process)
+        reactor.addSystemEventTrigger('after', 'shutdown', self.stop)
+
+        log.debug("Started %d handshake process(es).", self.n_processes)
+
+    def stop(self):
+        if self.is_running():
+            self.processes.terminate()
+            self.processes = None
+
+    def submit(self, function, *args):
+        """
+        Compute function(*args) off the event loop, for a handshake.
+        'function' must be a module-level function (or class) and 'args'
+        must be picklable.
+
+        Return a Deferred that fires with the result. It fails with
+        HandshakeBacklogFull if there are too many handshakes waiting
+        already.
+        """
+        if self.backlog >= self.max_backlog:
+            self.rejected += 1
+            return defer.fail(HandshakeBacklogFull(
+                "%d handshakes are already waiting." % self.backlog))
+
+        self.backlog += 1
+        d = self.submit_background(function, *args)
+        d.addBoth(self._handshake_done, reactor.seconds())
+        return d
+
+    def _handshake_done(self, result, started):
+        self.backlog -= 1
+        self.latency.observe(reactor.seconds() - started)
+        return result
+
+    def submit_background(self, function, *args):
+        """
+        Like submit(), but for work that no handshake is waiting for
+        (like filling the UniformDH keypair pool). It's never refused
+        and isn't counted in the backlog.
+        """
+        if not self.is_running():
+            return threads.deferToThread(function, *args)
+
+        d = defer.Deferred()
+
+        def done(result):
+            # Called in a thread of the multiprocessing pool.
+            reactor.callFromThread(self._result_received, d, result)
+
+        self.processes.apply_async(_call, (function, args), callback=done)
+        return d
+
+    def _result_received(self, d, result):
+        success, value = result
+        if success:
+            d.callback(value)
+        else:
+            d.errback(value)
+
+""" Global variable that computes our handshakes. """
+executor = HandshakeExecutor()
+
+metrics.HANDSHAKE_BACKLOG.set_function(lambda: executor.backlog)
+metrics.HANDSHAKE_REJECTED.set_function(lambda: executor.rejected)
@@ -4,6 +4,8 @@ import datetime
 import socket # for socket.inet_pton()
 
 import obfsproxy.common.log as logging
+import obfsproxy.network.circuit_table as circuit_table
+import obfsproxy.transports.obfs3_dh as obfs3_dh
 
 log = logging.get_obfslogger()
 
@@ -99,11 +101,35 @@ class Heartbeat(object):
             log.debug("Resetting heartbeat.")
             self.reset_stats()
 
+    def say_dh_pool_stats(self):
+        """Log stats of the UniformDH keypair pool, if it's used."""
+
+        pool = obfs3_dh.pool
+        if not pool.size or not (pool.hits + pool.misses):
+            return
+
+        log.info("Heartbeat: %d of %d UniformDH keypair(s) came from the pool (%d%%)." \
+                 " The pool holds %d of %d keypair(s) and is refilled at %.1f keypair(s)/s." % \
+                     (pool.hits, pool.hits + pool.misses, round(100 * pool.get_hit_rate()),
+                      len(pool.keypairs), pool.size, pool.get_refill_rate()))
+
+    def say_circuit_stats(self):
+        """Log how many circuits there are in each state."""
+
+        stats = circuit_table.table.get_stats()
+        log.info("Heartbeat: %d circuit(s): %d connecting, %d handshaking, %d open" \
+                 " and %d closing, from %d address(es)." % \
+                     (len(circuit_table.table), stats[circuit_table.CONNECTING],
+                      stats[circuit_table.HANDSHAKING], stats[circuit_table.OPEN],
+                      stats[circuit_table.CLOSING], len(circuit_table.table.peers)))
+
     def talk(self):
         """Do a heartbeat."""
 
         self.say_uptime()
         self.say_stats()
+        self.say_circuit_stats()
+        self.say_dh_pool_stats()
 
 # A heartbeat singleton.
 heartbeat = Heartbeat()
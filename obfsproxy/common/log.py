@@ -4,6 +4,9 @@ import sys
 
 from twisted.python import log
 
+# Severity levels, for ObfsLogger.isEnabledFor().
+from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
+
 def get_obfslogger():
     """ Return the current ObfsLogger instance """
     return OBFSLOGGER
@@ -17,6 +20,12 @@ class ObfsLogger(object):
     safe_logging: Boolean value indicating if we should scrub addresses
                   before logging
     obfslogger: Our logging instance
+    min_level: The minimum severity we log. Cached so that messages
+               below it can be dropped without calling into 'logging'.
+
+    The logging methods take their format arguments separately (like
+    log.debug("%s: Writing %d bytes.", name, len(buf))), so that the
+    message is only formatted if it's actually logged.
     """
 
     def __init__(self):
@@ -33,6 +42,8 @@ class ObfsLogger(object):
         self.obfslogger.addHandler(self.default_handler)
         self.obfslogger.propagate = False
 
+        self.min_level = self.obfslogger.getEffectiveLevel()
+
     def set_formatter(self, handler):
         """Given a log handler, plug our custom formatter to it."""
 
@@ -57,12 +68,28 @@ class ObfsLogger(object):
         # Turn it into a numeric level that logging understands first.
         numeric_level = getattr(logging, sev_string.upper(), None)
         self.obfslogger.setLevel(numeric_level)
+        self.min_level = self.obfslogger.getEffectiveLevel()
 
 
     def disable_logs(self):
         """Disable all logging."""
 
         logging.disable(logging.CRITICAL)
+        self.min_level = logging.CRITICAL + 1
+
+    def disable_packet_logs(self):
+        """Disable the debug messages we log for every packet."""
+
+        self.debug_packet = _discard
+
+    def isEnabledFor(self, level):
+        """
+        Return True if a message of severity 'level' would be logged.
+        Use it to avoid doing expensive work for a log message that is
+        going to be dropped anyway.
+        """
+
+        return level >= self.min_level
 
 
     def set_no_safe_logging(self):
@@ -86,7 +113,18 @@ class ObfsLogger(object):
     def debug(self, msg, *args, **kwargs):
         """ Class wrapper around debug logging method """
 
-        self.obfslogger.debug(msg, *args, **kwargs)
+        if self.min_level <= logging.DEBUG:
+            self.obfslogger.debug(msg, *args, **kwargs)
+
+    def debug_packet(self, msg, *args, **kwargs):
+        """
+        Like debug(), but for the messages we log for every packet
+        (data received, data written, messages created). They can be
+        turned off completely with disable_packet_logs().
+        """
+
+        if self.min_level <= logging.DEBUG:
+            self.obfslogger.debug(msg, *args, **kwargs)
 
     def warning(self, msg, *args, **kwargs):
         """ Class wrapper around warning logging method """
@@ -96,7 +134,8 @@ class ObfsLogger(object):
     def info(self, msg, *args, **kwargs):
         """ Class wrapper around info logging method """
 
-        self.obfslogger.info(msg, *args, **kwargs)
+        if self.min_level <= logging.INFO:
+            self.obfslogger.info(msg, *args, **kwargs)
 
     def error(self, msg, *args, **kwargs):
         """ Class wrapper around error logging method """
@@ -113,5 +152,8 @@ class ObfsLogger(object):
 
         self.obfslogger.exception(msg, *args, **kwargs)
 
+def _discard(msg, *args, **kwargs):
+    """ Log method that drops everything. See disable_packet_logs(). """
+
 """ Global variable that will track our Obfslogger instance """
 OBFSLOGGER = ObfsLogger()
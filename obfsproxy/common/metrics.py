@@ -0,0 +1,330 @@
+"""
+obfsproxy metrics code.
+
+Keeps counters, gauges and histograms about what obfsproxy is doing
+(traffic, circuits and handshakes, per transport) and serves them in
+the Prometheus text exposition format on a local HTTP port.
+
+Updating a metric must be cheap, because some of them are updated for
+every packet. Code that updates a metric often should look up its
+labelled value once with labels() and keep it around: after that, an
+update is a single attribute increment.
+"""
+
+import bisect
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# Histogram buckets (in seconds) for handshake durations and
+# time-to-first-byte.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=''):
+    """Return the '{name="value",...}' part of a sample line."""
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Value(object):
+    """A single value of a counter or a gauge."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class FunctionValue(object):
+    """A value of a counter or a gauge that is computed when rendered."""
+
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function()
+
+class HistogramValue(object):
+    """A single histogram: how many observations fell in each bucket."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric(object):
+    """
+    A metric, with one value for every combination of label values
+    it has seen.
+
+    Attributes:
+    name: The name of the metric, as shown to Prometheus.
+    documentation: A one-line description of the metric.
+    labelnames: The names of the labels of the metric.
+    values: Maps tuples of label values to their Value.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def labels(self, *labelvalues):
+        """Return the value of the metric for 'labelvalues'."""
+        assert len(labelvalues) == len(self.labelnames)
+
+        try:
+            return self.values[labelvalues]
+        except KeyError:
+            value = self.values[labelvalues] = self.new_value()
+            return value
+
+    def new_value(self):
+        return Value()
+
+    def set_function(self, function, *labelvalues):
+        """
+        Make the value of the metric for 'labelvalues' whatever
+        'function' returns when the metric is rendered. Useful for
+        things that are already counted elsewhere.
+        """
+        assert len(labelvalues) == len(self.labelnames)
+        self.values[labelvalues] = FunctionValue(function)
+
+    def render(self):
+        """Return the lines that describe this metric to Prometheus."""
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+
+        for labelvalues, value in sorted(self.values.items()):
+            lines.extend(self.render_value(labelvalues, value))
+
+        return lines
+
+    def render_value(self, labelvalues, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, labelvalues),
+                             _format_value(value.value))]
+
+class Counter(Metric):
+    """A metric that only goes up."""
+    kind = 'counter'
+
+class Gauge(Metric):
+    """A metric that goes up and down."""
+    kind = 'gauge'
+
+class Histogram(Metric):
+    """A metric that counts observations in buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_value(self):
+        return HistogramValue(self.buckets)
+
+    def render_value(self, labelvalues, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value.counts):
+            cumulative += count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append('%s_bucket%s %d' % (self.name,
+                                              _format_labels(self.labelnames, labelvalues, le),
+                                              cumulative))
+
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append('%s_sum%s %s' % (self.name, labels, repr(value.sum)))
+        lines.append('%s_count%s %d' % (self.name, labels, value.count))
+
+        return lines
+
+class Registry(object):
+    """Keeps track of all our metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """Register and return 'metric'."""
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all our metrics in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+class MetricsResource(resource.Resource):
+    """Serves the metrics of a Registry over HTTP."""
+
+    isLeaf = True
+
+    def __init__(self, registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.registry.render()
+
+def listen(port, interface='127.0.0.1'):
+    """
+    Serve our metrics on 'interface':'port'.
+
+    Throws twisted.internet.error.CannotListenError if the listener
+    could not be set up.
+    """
+    site = server.Site(MetricsResource(registry))
+    site.noisy = False
+    listener = reactor.listenTCP(port, site, interface=interface)
+
+    log.info("Serving metrics at %s:%d." % (interface, listener.getHost().port))
+    return listener
+
+""" Global variable that will track our metrics. """
+registry = Registry()
+
+CIRCUITS = registry.register(Gauge(
+    'obfsproxy_circuits', 'Number of open circuits.', ['transport']))
+CIRCUITS_TOTAL = registry.register(Counter(
+    'obfsproxy_circuits_total', 'Number of circuits opened.', ['transport']))
+CIRCUIT_STATES = registry.register(Gauge(
+    'obfsproxy_circuit_states',
+    'Circuits in each lifecycle state: connecting, handshaking, open or closing.',
+    ['state']))
+CIRCUITS_REAPED = registry.register(Counter(
+    'obfsproxy_circuits_reaped_total',
+    'Circuits closed (or refused) because of a limit: handshake_timeout, idle_timeout, '
+    'buffer, max_circuits or max_circuits_per_peer.',
+    ['transport', 'reason']))
+RECEIVED_BYTES = registry.register(Counter(
+    'obfsproxy_received_bytes_total', 'Bytes received on each side of circuits.',
+    ['transport', 'side']))
+SENT_BYTES = registry.register(Counter(
+    'obfsproxy_sent_bytes_total', 'Bytes sent on each side of circuits.',
+    ['transport', 'side']))
+HANDSHAKES = registry.register(Counter(
+    'obfsproxy_handshakes_total', 'Transport handshakes, by result.',
+    ['transport', 'result']))
+HANDSHAKE_SECONDS = registry.register(Histogram(
+    'obfsproxy_handshake_duration_seconds',
+    'Time from circuit completion to the end of the transport handshake.',
+    ['transport']))
+TTFB_SECONDS = registry.register(Histogram(
+    'obfsproxy_time_to_first_byte_seconds',
+    'Time from circuit completion to the first byte sent upstream.',
+    ['transport']))
+IAT_DELAY_SECONDS = registry.register(Histogram(
+    'obfsproxy_iat_burst_delay_seconds',
+    'Time bursts of data were held back by inter-arrival time obfuscation.',
+    ['transport']))
+
+HANDSHAKE_BACKLOG = registry.register(Gauge(
+    'obfsproxy_handshake_compute_backlog',
+    'Handshake computations waiting for a result.'))
+HANDSHAKE_REJECTED = registry.register(Counter(
+    'obfsproxy_handshake_compute_rejected_total',
+    'Handshakes refused because too many computations were waiting.'))
+HANDSHAKE_COMPUTE_SECONDS = registry.register(Histogram(
+    'obfsproxy_handshake_compute_seconds',
+    'Time from queueing a handshake computation to getting its result.'))
+DH_POOL_SIZE = registry.register(Gauge(
+    'obfsproxy_dh_pool_keypairs', 'Pregenerated UniformDH keypairs ready to be used.'))
+DH_POOL_CAPACITY = registry.register(Gauge(
+    'obfsproxy_dh_pool_capacity', 'How many pregenerated UniformDH keypairs we keep around.'))
+DH_POOL_REQUESTS = registry.register(Counter(
+    'obfsproxy_dh_pool_requests_total',
+    'UniformDH keypairs taken from the pool (hit) or generated inline (miss).',
+    ['result']))
+DH_POOL_GENERATED = registry.register(Counter(
+    'obfsproxy_dh_pool_generated_total', 'UniformDH keypairs generated in the background.'))
+DH_POOL_GENERATE_SECONDS = registry.register(Counter(
+    'obfsproxy_dh_pool_generate_seconds_total',
+    'Time spent generating UniformDH keypairs in the background.'))
+PADDED_BYTES = registry.register(Counter(
+    'obfsproxy_padded_bytes_total',
+    'Bytes of the bursts whose packet lengths were morphed with padding.',
+    ['transport']))
+PADDING_BYTES = registry.register(Counter(
+    'obfsproxy_padding_bytes_total',
+    'Bytes of padding added to morph packet lengths.', ['transport']))
+PADDING_CAPPED = registry.register(Counter(
+    'obfsproxy_padding_capped_total',
+    'Bursts which got less padding because of the padding budget.',
+    ['transport']))
+PADDING_OVERHEAD = registry.register(Histogram(
+    'obfsproxy_padding_overhead_ratio',
+    'Padding bytes per byte of padded data, per closed circuit.',
+    ['transport'], buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)))
+SESSION_TICKET_LOOKUPS = registry.register(Counter(
+    'obfsproxy_session_ticket_lookups_total',
+    'Client connections that found a session ticket to redeem (hit), found none (miss) '
+    'or found only expired ones (expired).',
+    ['result']))
+
+class TransportMetrics(object):
+    """
+    The metrics of one transport, with their label values looked up,
+    ready to be updated by circuits.
+    """
+
+    def __init__(self, name):
+        self.circuits = CIRCUITS.labels(name)
+        self.circuits_total = CIRCUITS_TOTAL.labels(name)
+        self.received = {'upstream' : RECEIVED_BYTES.labels(name, 'upstream'),
+                         'downstream' : RECEIVED_BYTES.labels(name, 'downstream')}
+        self.sent = {'upstream' : SENT_BYTES.labels(name, 'upstream'),
+                     'downstream' : SENT_BYTES.labels(name, 'downstream')}
+        self.handshake_successes = HANDSHAKES.labels(name, 'success')
+        self.handshake_failures = HANDSHAKES.labels(name, 'failure')
+        self.handshake_seconds = HANDSHAKE_SECONDS.labels(name)
+        self.ttfb_seconds = TTFB_SECONDS.labels(name)
+
+_transport_metrics = {}
+
+def get_transport_metrics(name):
+    """Return the TransportMetrics of the transport called 'name'."""
+    try:
+        return _transport_metrics[name]
+    except KeyError:
+        metrics = _transport_metrics[name] = TransportMetrics(name)
+        return metrics
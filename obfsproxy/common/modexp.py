@@ -21,3 +21,56 @@ def powMod( x, y, mod ):
     y = mpz(y)
     mod = mpz(mod)
     return pow(x, y, mod)
+
+class FixedBase( object ):
+
+    """
+    Exponentiation of a fixed base modulo a fixed modulus.
+
+    The exponent is split into `window'-bit digits.  For every digit position
+    i, the table holds base^(d * 2^(window*i)) mod `mod' for all digit values
+    d, so an exponentiation costs one modular multiplication per digit and no
+    squarings at all.  With the default window of 6 bits, the table of a
+    1536-bit exponent has 256 rows of 64 numbers (about 3 MB).
+    """
+
+    def __init__( self, base, mod, bits, window=6 ):
+        """
+        Build the table for exponents of up to `bits' bits.
+        """
+
+        self.base = base
+        self.mod = mpz(mod)
+        self.bits = bits
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.rows = []
+
+        rowBase = mpz(base)
+        for _ in xrange((bits + window - 1) // window):
+            row = [mpz(1)]
+            for _ in xrange(self.mask):
+                row.append(row[-1] * rowBase % self.mod)
+            self.rows.append(row)
+            rowBase = row[-1] * rowBase % self.mod
+
+    def powMod( self, exponent ):
+        """
+        Calculate and return the base to the power of `exponent' mod the
+        modulus.  The result is the same as powMod()'s.
+        """
+
+        if exponent >> self.bits:
+            return powMod(self.base, exponent, self.mod)
+
+        mod = self.mod
+        mask = self.mask
+        window = self.window
+        result = mpz(1)
+        for row in self.rows:
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % mod
+            exponent >>= window
+
+        return result
@@ -0,0 +1,205 @@
+"""
+A hashed timer wheel for the timers of circuits.
+
+Twisted keeps its delayed calls in a heap, and every call it schedules or
+cancels costs a heap operation and some bookkeeping. With inter-arrival
+time obfuscation, every circuit schedules a call every few milliseconds,
+so with many circuits, that adds up.
+
+A TimerWheel keeps its timers in a ring of buckets instead, one bucket
+per tick of RESOLUTION seconds (by default). Scheduling a timer appends
+it to the bucket of the tick it's due in, and cancelling it only marks
+it as cancelled, so both take constant time. A single reactor call runs the
+wheel in the next tick that has timers.
+
+Timers fire in the first tick that starts at or after the time they
+were scheduled for, so they are up to a tick late. Timeouts of circuits
+don't need to be any more precise than a second, and run on a wheel
+with one second ticks, which the reactor only has to wake up for once a
+second.
+"""
+
+import math
+
+from twisted.internet import reactor
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# The default length of a tick in seconds.
+RESOLUTION = 0.001
+# The number of buckets. Timers which are due more than SLOTS ticks
+# ahead wait in their bucket until their round comes.
+SLOTS = 1024
+
+class Timer(object):
+    """
+    A call scheduled on a TimerWheel.
+
+    Attributes:
+    tick: the tick in which the timer fires.
+    function, args: what to call, and with which arguments.
+    wheel: the TimerWheel of the timer, or None once it fired or was
+           cancelled.
+    """
+
+    __slots__ = ('tick', 'function', 'args', 'wheel')
+
+    def __init__(self, wheel, tick, function, args):
+        self.wheel = wheel
+        self.tick = tick
+        self.function = function
+        self.args = args
+
+    def active(self):
+        """Return True if the timer has neither fired nor been cancelled."""
+        return self.wheel is not None
+
+    def cancel(self):
+        """
+        Cancel the timer. Cancelling a timer which already fired or was
+        cancelled does nothing.
+        """
+        if self.wheel is None:
+            return
+
+        # The timer stays in its bucket until the wheel gets there.
+        self.wheel.pending -= 1
+        self.wheel = None
+        self.function = self.args = None
+
+class TimerWheel(object):
+    """
+    Schedules calls with a resolution of 'resolution' seconds.
+
+    Attributes:
+    clock: the reactor (or twisted.internet.task.Clock) that drives the
+           wheel.
+    resolution: the length of a tick in seconds.
+    epoch: when tick 0 started.
+    buckets: the timers of every tick, by tick modulo SLOTS.
+    current: the last tick the wheel ran.
+    pending: the number of timers that are neither fired nor cancelled.
+    call: the reactor call that runs the wheel, or None if the wheel
+          has no timers.
+    next_tick: the tick 'call' runs the wheel in.
+    running: True while the wheel fires timers.
+    """
+
+    def __init__(self, clock=reactor, resolution=RESOLUTION):
+        self.clock = clock
+        self.resolution = resolution
+        self.epoch = clock.seconds()
+        self.buckets = [[] for _ in xrange(SLOTS)]
+        self.current = 0
+        self.pending = 0
+        self.call = None
+        self.next_tick = None
+        self.running = False
+
+    def now(self):
+        """Return the current tick."""
+        # Don't let rounding errors put the start of a tick into the
+        # previous one (or a timer into the next one, see call_later()).
+        return int((self.clock.seconds() - self.epoch) / self.resolution + 1e-3)
+
+    def call_later(self, delay, function, *args):
+        """
+        Call 'function(*args)' in 'delay' seconds and return its Timer.
+        """
+        idle = (self.call is None) and not self.running
+        if idle:
+            # The wheel has no timers to catch up on.
+            self.current = self.now()
+
+        due = int(math.ceil((self.clock.seconds() - self.epoch + delay) / self.resolution - 1e-3))
+        tick = max(due, self.current + 1)
+
+        timer = Timer(self, tick, function, args)
+        self.buckets[tick % SLOTS].append(timer)
+        self.pending += 1
+
+        # Once it's done, a running wheel looks for its next tick anyway.
+        if idle or (not self.running and tick < self.next_tick):
+            self.schedule(tick)
+
+        return timer
+
+    def schedule(self, tick):
+        """Run the wheel in 'tick'."""
+        delay = max(self.epoch + tick * self.resolution - self.clock.seconds(), 0)
+        if self.call is None:
+            self.call = self.clock.callLater(delay, self.run)
+        else:
+            self.call.reset(delay)
+        self.next_tick = tick
+
+    def run(self):
+        """
+        Fire the timers that are due, and run again in the next tick if
+        there are timers left.
+        """
+        self.call = None
+
+        now = self.now()
+        first = self.current + 1
+        # If we are more than a whole round late, every bucket is looked
+        # at once.
+        if now - first >= SLOTS:
+            first = now - SLOTS + 1
+
+        self.running = True
+        try:
+            for tick in xrange(first, now + 1):
+                self.current = tick
+                self.fire(tick)
+        finally:
+            self.running = False
+
+        self.current = now
+
+        # Run again in the next tick whose bucket has timers.
+        if self.pending:
+            for tick in xrange(now + 1, now + SLOTS + 1):
+                if self.buckets[tick % SLOTS]:
+                    self.schedule(tick)
+                    break
+
+    def fire(self, tick):
+        """Fire the timers in the bucket of 'tick' that are due."""
+        index = tick % SLOTS
+        bucket = self.buckets[index]
+        if not bucket:
+            return
+
+        # Timers scheduled by the callbacks go into a new bucket.
+        self.buckets[index] = []
+        later = []
+
+        for timer in bucket:
+            if timer.wheel is None:
+                continue
+            if timer.tick > tick:
+                later.append(timer)
+                continue
+
+            function, args = timer.function, timer.args
+            timer.wheel = None
+            timer.function = timer.args = None
+            self.pending -= 1
+
+            try:
+                function(*args)
+            except Exception:
+                log.exception("Timer callback %r failed." % function)
+
+        if later:
+            later.extend(self.buckets[index])
+            self.buckets[index] = later
+
+""" Global variable that holds the timer wheel of the process. """
+wheel = TimerWheel()
+
+""" Global variable that holds the timer wheel for the timeouts of circuits. """
+timeouts = TimerWheel(resolution=1.0)
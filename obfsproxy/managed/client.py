@@ -4,6 +4,7 @@
 from twisted.internet import reactor, error
 
 import obfsproxy.network.launch_transport as launch_transport
+import obfsproxy.network.workers as workers
 import obfsproxy.network.network as network
 import obfsproxy.transports.transports as transports
 import obfsproxy.transports.base as base
@@ -82,6 +83,7 @@ def do_managed_client():
 
     if should_start_event_loop:
         log.info("Starting up the event loop.")
+        workers.pool.start(managed=True)
         reactor.run()
     else:
         log.info("No transports launched. Nothing to do.")
@@ -9,6 +9,7 @@ from pyptlib.config import EnvError
 import obfsproxy.transports.transports as transports
 import obfsproxy.transports.base as base
 import obfsproxy.network.launch_transport as launch_transport
+import obfsproxy.network.workers as workers
 import obfsproxy.common.log as logging
 import obfsproxy.common.transport_config as transport_config
 
@@ -116,6 +117,7 @@ def do_managed_server():
 
     if should_start_event_loop:
         log.info("Starting up the event loop.")
+        workers.pool.start(managed=True)
         reactor.run()
     else:
         log.info("No transports launched. Nothing to do.")
@@ -1,14 +1,26 @@
+from collections import deque
+
 class Buffer(object):
     """
     A Buffer is a simple FIFO buffer. You write() stuff to it, and you
     read() them back. You can also peek() or drain() data.
+
+    Internally, the buffer is a queue of the chunks that were written
+    to it, plus a read offset into the first chunk. Writing appends a
+    chunk, and reading or draining only touches the chunks (and the
+    bytes) that are consumed, so neither operation copies the rest of
+    the buffer.
     """
 
     def __init__(self, data=''):
         """
         Initialize a buffer with 'data'.
         """
-        self.buffer = bytes(data)
+        self.chunks = deque()
+        self.offset = 0 # Read offset into the first chunk.
+        self.length = 0 # Total number of unread bytes.
+
+        self.write(data)
 
     def read(self, n=-1):
         """
@@ -19,20 +31,22 @@ class Buffer(object):
         the whole buffer.
         """
 
-        if (n < 0) or (n > len(self.buffer)):
-            the_whole_buffer = self.buffer
-            self.buffer = bytes('')
-            return the_whole_buffer
+        if (n < 0) or (n > self.length):
+            n = self.length
 
-        data = self.buffer[:n]
-        self.buffer = self.buffer[n:]
+        data = self.peek(n)
+        self.drain(n)
         return data
 
     def write(self, data):
         """
         Append 'data' to the buffer.
         """
-        self.buffer = self.buffer + data
+        if not data:
+            return
+
+        self.chunks.append(bytes(data))
+        self.length += len(data)
 
     def peek(self, n=-1):
         """
@@ -43,10 +57,35 @@ class Buffer(object):
         buffer.
         """
 
-        if (n < 0) or (n > len(self.buffer)):
-            return self.buffer
+        if (n < 0) or (n > self.length):
+            n = self.length
+
+        if n == 0:
+            return bytes('')
+
+        chunk = self._coalesce(n)
+        if (self.offset == 0) and (len(chunk) == n):
+            return chunk
+
+        return chunk[self.offset:self.offset + n]
+
+    def peek_view(self, n=-1):
+        """
+        Like peek(), but return a read-only memoryview of the first
+        'n' bytes of the buffer instead of a copy of them.
+
+        The view is only valid until the next write(), read() or
+        drain() on the buffer.
+        """
+
+        if (n < 0) or (n > self.length):
+            n = self.length
 
-        return self.buffer[:n]
+        if n == 0:
+            return memoryview(bytes(''))
+
+        chunk = self._coalesce(n)
+        return memoryview(chunk)[self.offset:self.offset + n]
 
     def drain(self, n=-1):
         """
@@ -56,20 +95,60 @@ class Buffer(object):
         If 'n' is larger than the size of the buffer, drain the whole
         buffer.
         """
-        if (n < 0) or (n > len(self.buffer)):
-            self.buffer = bytes('')
+        if (n < 0) or (n >= self.length):
+            self.chunks.clear()
+            self.offset = 0
+            self.length = 0
             return
 
-        self.buffer = self.buffer[n:]
+        self.length -= n
+        while n > 0:
+            available = len(self.chunks[0]) - self.offset
+            if available > n:
+                self.offset += n
+                return
+
+            self.chunks.popleft()
+            self.offset = 0
+            n -= available
+
         return
 
+    def _coalesce(self, n):
+        """
+        Make sure that the first 'n' unread bytes of the buffer live in
+        the first chunk, and return that chunk.
+
+        Only the chunks that are needed to cover 'n' bytes are merged,
+        so peeking at the head of a long buffer stays cheap.
+        """
+
+        chunk = self.chunks[0]
+        if len(chunk) - self.offset >= n:
+            return chunk
+
+        pieces = [chunk[self.offset:]]
+        self.chunks.popleft()
+        needed = n - len(pieces[0])
+
+        while needed > 0:
+            chunk = self.chunks.popleft()
+            pieces.append(chunk)
+            needed -= len(chunk)
+
+        chunk = bytes('').join(pieces)
+        self.chunks.appendleft(chunk)
+        self.offset = 0
+
+        return chunk
+
     def __len__(self):
         """Returns length of buffer. Used in len()."""
-        return len(self.buffer)
+        return self.length
 
     def __nonzero__(self):
         """
         Returns True if the buffer is non-empty.
         Used in truth-value testing.
         """
-        return True if len(self.buffer) else False
+        return True if self.length else False
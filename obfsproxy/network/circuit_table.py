@@ -0,0 +1,148 @@
+"""
+The table of the circuits of the process.
+
+Circuits are otherwise only known to their connections. The table
+keeps track of all of them, indexed by the lifecycle state they are in,
+by the name of their pluggable transport and by the host of the peer
+whose connection created them, so that limits, metrics and the like can
+look circuits up and count them without going through all of them.
+
+A circuit is added to the table when it's created, moves through the
+states below as it goes, and leaves the table once it's closed and
+its connections are gone.
+"""
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+# Lifecycle states of circuits.
+CONNECTING = 'connecting' # Waiting for its connections.
+HANDSHAKING = 'handshaking' # Waiting for its transport to do the handshake.
+OPEN = 'open' # Carrying application data.
+CLOSING = 'closing' # Closed, waiting for its connections to go away.
+
+STATES = (CONNECTING, HANDSHAKING, OPEN, CLOSING)
+
+class CircuitTable(object):
+    """
+    Circuits, indexed by state, transport and peer.
+
+    The sets that the lookup methods return are those of the table, and
+    change as circuits come, go and change state. Copy them before doing
+    anything that might close circuits.
+
+    Attributes:
+    circuits: the circuits in the table.
+    states: the circuits in each state, by state.
+    transports: the circuits of each transport, by transport name.
+    peers: the circuits of each peer, by host.
+    """
+
+    def __init__(self):
+        self.circuits = set()
+        self.states = dict((state, set()) for state in STATES)
+        self.transports = {}
+        self.peers = {}
+
+    def __len__(self):
+        return len(self.circuits)
+
+    def __contains__(self, circuit):
+        return circuit in self.circuits
+
+    def add(self, circuit):
+        """
+        Add 'circuit' to the table, in the state 'circuit.state'.
+        """
+        assert circuit not in self.circuits
+
+        self.circuits.add(circuit)
+        self.states[circuit.state].add(circuit)
+        _add(self.transports, circuit.transport_name, circuit)
+        if circuit.peer is not None:
+            _add(self.peers, circuit.peer, circuit)
+
+    def remove(self, circuit):
+        """
+        Remove 'circuit' from the table. Removing a circuit which is
+        not in the table does nothing.
+        """
+        if circuit not in self.circuits:
+            return
+
+        self.circuits.discard(circuit)
+        self.states[circuit.state].discard(circuit)
+        _discard(self.transports, circuit.transport_name, circuit)
+        if circuit.peer is not None:
+            _discard(self.peers, circuit.peer, circuit)
+
+    def set_state(self, circuit, state):
+        """
+        Move 'circuit' to 'state'.
+        """
+        if circuit in self.circuits:
+            self.states[circuit.state].discard(circuit)
+            self.states[state].add(circuit)
+
+        circuit.state = state
+
+    def in_state(self, state):
+        """Return the set of circuits in 'state'."""
+        return self.states[state]
+
+    def of_transport(self, name):
+        """Return the set of circuits of the transport called 'name'."""
+        return self.transports.get(name, _EMPTY)
+
+    def of_peer(self, host):
+        """Return the set of circuits of the peer 'host'."""
+        return self.peers.get(host, _EMPTY)
+
+    def close(self, circuits):
+        """
+        Close the circuits in 'circuits', e.g. of_transport('obfs2'),
+        and return how many were closed.
+        """
+        circuits = [circuit for circuit in circuits if not circuit.closed]
+        for circuit in circuits:
+            circuit.close()
+
+        return len(circuits)
+
+    def get_stats(self):
+        """
+        Return a dictionary with the number of circuits in each state.
+        """
+        return dict((state, len(circuits)) for state, circuits in self.states.items())
+
+_EMPTY = frozenset()
+
+def _add(index, key, circuit):
+    """Add 'circuit' to the set of 'key' in 'index'."""
+    circuits = index.get(key)
+    if circuits is None:
+        circuits = index[key] = set()
+
+    circuits.add(circuit)
+
+def _discard(index, key, circuit):
+    """
+    Remove 'circuit' from the set of 'key' in 'index', and forget about
+    'key' once its set is empty (peers come and go).
+    """
+    circuits = index.get(key)
+    if circuits is None:
+        return
+
+    circuits.discard(circuit)
+    if not circuits:
+        del index[key]
+
+""" Global variable that holds the circuit table. """
+table = CircuitTable()
+
+for _state in STATES:
+    metrics.CIRCUIT_STATES.set_function(
+        lambda state=_state: len(table.states[state]), _state)
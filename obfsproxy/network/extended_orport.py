@@ -115,7 +115,10 @@ class ExtORPortProtocol(network.GenericProtocol):
         network.GenericProtocol.__init__(self, circuit)
 
     def connectionMade(self):
-        pass
+        # Our circuit might have been closed while we were connecting.
+        if self.circuit.closed:
+            log.debug("%s: connectionMade: Circuit is closed. Closing." % self.name)
+            self.close()
 
     def dataReceived(self, data_rcvd):
         """
@@ -125,6 +128,12 @@ class ExtORPortProtocol(network.GenericProtocol):
             log.debug("%s: ExtORPort dataReceived called while closed. Ignoring.", self.name)
             return
 
+        # Our circuit might have been closed while we were authenticating.
+        if self.circuit.closed:
+            log.debug("%s: ExtORPort dataReceived called on a closed circuit. Closing.", self.name)
+            self.close()
+            return
+
         self.buffer.write(data_rcvd)
 
         if self.state == STATE_WAIT_FOR_AUTH_TYPES:
@@ -372,13 +381,17 @@ class ExtORPortServerFactory(network.StaticDestinationClientFactory):
     def buildProtocol(self, addr):
         log.debug("%s: New connection from %s:%d." % (self.name, log.safe_addr_str(addr.host), addr.port))
 
-        circuit = network.Circuit(self.transport_class())
+        if network.refuse_circuit(self.transport_class, addr.host):
+            return None
+
+        circuit = network.Circuit(self.transport_class(), addr.host)
 
         # XXX instantiates a new factory for each client
         clientFactory = ExtORPortClientFactory(circuit, self.cookie_file, addr, self.transport_name)
         reactor.connectTCP(self.ext_or_host, self.ext_or_port, clientFactory)
 
-        return network.StaticDestinationProtocol(circuit, 'server', addr)
+        circuit.accepted = network.StaticDestinationProtocol(circuit, 'server', addr)
+        return circuit.accepted
 
 # XXX Exceptions need more thought and work. Most of these can be generalized.
 class RcvdInvalidAuth(Exception): pass
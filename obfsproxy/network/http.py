@@ -82,7 +82,7 @@ class HTTPConnectClient(HTTPClient):
             self.onConnectionError(ConnectError("Proxy returned status: %s" % status))
 
     def rawDataReceived(self, data):
-        log.debug("HTTPConnectClient: Received %d bytes of proxied data", len(data))
+        log.debug_packet("HTTPConnectClient: Received %d bytes of proxied data", len(data))
         if self.instance:
             self.instance.dataReceived(data)
         else:
@@ -2,8 +2,7 @@ import obfsproxy.network.network as network
 import obfsproxy.transports.transports as transports
 import obfsproxy.network.socks as socks
 import obfsproxy.network.extended_orport as extended_orport
-
-from twisted.internet import reactor
+import obfsproxy.network.workers as workers
 
 def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_config, ext_or_cookie_file=None):
     """
@@ -21,6 +20,9 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
     ORPort Authentication cookie is stored. It's only used in
     'ext_server' mode.
 
+    In worker mode (see obfsproxy.network.workers), the supervisor only
+    reserves the address, and its workers all listen on it.
+
     Return a tuple (addr, port) representing where we managed to bind.
 
     Throws obfsproxy.transports.transports.TransportNotFound if the
@@ -43,6 +45,4 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
         assert(remote_addrport)
         factory = network.StaticDestinationServerFactory(remote_addrport, role, transport_class, pt_config)
 
-    addrport = reactor.listenTCP(listen_port, factory, interface=listen_host)
-
-    return (addrport.getHost().host, addrport.getHost().port)
+    return workers.pool.listen(transport, role, listen_host, listen_port, factory)
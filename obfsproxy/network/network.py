@@ -1,11 +1,18 @@
+import time
+
 from twisted.internet import reactor
+from twisted.internet.interfaces import IConsumer
 from twisted.internet.protocol import Protocol, Factory
 
 import obfsproxy.common.log as logging
 import obfsproxy.common.heartbeat as heartbeat
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.timerwheel as timerwheel
 
 import obfsproxy.network.buffer as obfs_buf
+import obfsproxy.network.circuit_table as circuit_table
 import obfsproxy.transports.base as base
+import obfsproxy.transports.transports as transports
 
 log = logging.get_obfslogger()
 
@@ -59,9 +66,129 @@ There are two kinds of client listeners: a 'simple' client listener
 always connects to the same remote peer every time it needs to
 initiate a downstream connection; a 'socks' client listener can be
 told to connect to an arbitrary remote peer using the SOCKS protocol.
+
+Flow control:
+
+Each connection of a complete circuit is registered as the streaming
+producer of the other connection's transport, so Twisted stops reading
+from one side when the write buffer of the other side grows past the
+high-water mark, and starts again once that write buffer is flushed.
+
+Data can also pile up inside obfsproxy itself: in the connection
+buffers while the circuit is not complete yet, or inside the pluggable
+transport while it is handshaking (see
+BaseTransport.upstreamBacklog()). The circuit keeps an eye on that
+backlog and stops reading from the connection that produced it when it
+grows past the high-water mark, until it drops below the low-water
+mark again.
+
+Limits:
+
+Circuits that never finish their handshake or that stay idle, e.g.
+because of scanners and probes, would hold their connections and
+buffers until TCP gives up on them. A circuit that has not finished its
+handshake (including the SOCKS negotiation and connecting to the other
+side) HANDSHAKE_TIMEOUT seconds after it was accepted, or that has not
+carried any data for IDLE_TIMEOUT seconds, gets closed. So does a
+circuit which, flow control notwithstanding, buffers more than
+MAX_CIRCUIT_BUFFER bytes. Listeners refuse connections while
+MAX_CIRCUITS circuits are open (or still closing), or while the peer
+that connects has MAX_CIRCUITS_PER_PEER of them. See
+set_circuit_limits().
+
+All circuits are in the circuit table (see
+obfsproxy.network.circuit_table) until they are closed and their
+connections are gone.
 """
 
-class Circuit(Protocol):
+# Default flow control watermarks in bytes. See set_buffer_watermarks().
+HIGH_WATER_MARK = 256 * 1024
+LOW_WATER_MARK = 64 * 1024
+
+def set_buffer_watermarks(high, low):
+    """
+    Set the flow control watermarks of all circuits to 'high' and 'low'
+    bytes.
+
+    Raises ValueError if the watermarks don't make sense.
+    """
+    global HIGH_WATER_MARK, LOW_WATER_MARK
+
+    if low < 0 or high <= low:
+        raise ValueError("The high-water mark (%d) must be larger than the "
+                         "low-water mark (%d)." % (high, low))
+
+    HIGH_WATER_MARK = high
+    LOW_WATER_MARK = low
+
+# Default circuit limits; 0 disables a limit. See set_circuit_limits().
+HANDSHAKE_TIMEOUT = 60
+IDLE_TIMEOUT = 30 * 60
+MAX_CIRCUIT_BUFFER = 4 * 1024 * 1024
+MAX_CIRCUITS = 0
+MAX_CIRCUITS_PER_PEER = 0
+
+def set_circuit_limits(handshake_timeout, idle_timeout, max_buffer, max_circuits,
+                       max_per_peer=0):
+    """
+    Close circuits that didn't finish their handshake within
+    'handshake_timeout' seconds, that have been idle for 'idle_timeout'
+    seconds or that buffer more than 'max_buffer' bytes, and refuse new
+    circuits while 'max_circuits' are open, or while 'max_per_peer' of
+    them belong to the peer that connects. 0 disables a limit.
+
+    Must be called after set_buffer_watermarks(). Raises ValueError if
+    the limits don't make sense.
+    """
+    global HANDSHAKE_TIMEOUT, IDLE_TIMEOUT, MAX_CIRCUIT_BUFFER, MAX_CIRCUITS
+    global MAX_CIRCUITS_PER_PEER
+
+    if min(handshake_timeout, idle_timeout, max_buffer, max_circuits, max_per_peer) < 0:
+        raise ValueError("Circuit limits can't be negative.")
+    if max_buffer and max_buffer <= HIGH_WATER_MARK:
+        raise ValueError("The buffer limit (%d) must be larger than the "
+                         "high-water mark (%d)." % (max_buffer, HIGH_WATER_MARK))
+
+    HANDSHAKE_TIMEOUT = handshake_timeout
+    IDLE_TIMEOUT = idle_timeout
+    MAX_CIRCUIT_BUFFER = max_buffer
+    MAX_CIRCUITS = max_circuits
+    MAX_CIRCUITS_PER_PEER = max_per_peer
+
+# Reasons for which a circuit might be closed by a limit.
+REAPED_HANDSHAKE_TIMEOUT = 'handshake_timeout'
+REAPED_IDLE_TIMEOUT = 'idle_timeout'
+REAPED_BUFFER = 'buffer'
+REAPED_MAX_CIRCUITS = 'max_circuits' # The circuit was refused, in fact.
+REAPED_MAX_CIRCUITS_PER_PEER = 'max_circuits_per_peer' # Refused as well.
+
+def refuse_circuit(transport_class, peer):
+    """
+    Return True if a listener of 'transport_class' has to refuse a new
+    circuit for the peer 'peer' (a host) because of MAX_CIRCUITS or
+    MAX_CIRCUITS_PER_PEER.
+    """
+    table = circuit_table.table
+
+    if MAX_CIRCUITS and len(table) >= MAX_CIRCUITS:
+        reason = REAPED_MAX_CIRCUITS
+        message = "%d circuits are open" % len(table)
+    elif MAX_CIRCUITS_PER_PEER and len(table.of_peer(peer)) >= MAX_CIRCUITS_PER_PEER:
+        reason = REAPED_MAX_CIRCUITS_PER_PEER
+        message = "%s has %d circuits" % (log.safe_addr_str(peer), len(table.of_peer(peer)))
+    else:
+        return False
+
+    name = transports.get_transport_name(transport_class)
+    log.info("%s. Refusing a new %s circuit." % (message, name))
+    metrics.CIRCUITS_REAPED.labels(name, reason).inc()
+    return True
+
+# Reasons for which a connection might stop being read from.
+PAUSED_BY_CONSUMER = 'consumer' # The other side's write buffer is full.
+PAUSED_BY_BACKLOG = 'backlog' # Too much of our data is buffered internally.
+
+class Circuit(Protocol, object):
     """
     A Circuit holds a pair of connections. The upstream connection and
     the downstream. The circuit proxies data from one connection to
@@ -73,15 +200,66 @@ class Circuit(Protocol):
 
     downstream: the downstream connection
     upstream: the upstream connection
+    accepted: the connection our listener accepted, which might not be
+              our upstream or downstream connection yet.
+    peer: the host of the peer of that connection, or None.
+
+    state: where we are in our lifecycle (one of the states of
+           obfsproxy.network.circuit_table).
+    lingering: once we are closed, the connections that are not gone
+               yet. We stay in the circuit table until they are.
+
+    backlogged: the connections we stopped reading from because too
+                much of their data is buffered in obfsproxy.
+    peak_backlog: the largest backlog we have seen for data coming
+                  from each side ('upstream' and 'downstream').
+
+    metrics: the TransportMetrics of our pluggable transport.
+    bytes_received, bytes_sent: how much data went through each side
+                                of the circuit.
+    completed_at: when the circuit was completed, or None.
+    handshake_done: True if our transport finished its handshake.
+    first_byte_pending: True until we send data upstream for the
+                        first time after the circuit was completed.
+
+    transport_name: the name of our pluggable transport.
+    timer: the Timer of our handshake or idle timeout, or None.
+    last_active: when data last went through the circuit, once the
+                 handshake is done.
     """
 
-    def __init__(self, transport):
+    def __init__(self, transport, peer=None):
         self.transport = transport # takes a transport
         self.downstream = None # takes a connection
         self.upstream = None # takes a connection
+        self.accepted = None # takes a connection
+        self.peer = peer
 
         self.closed = False # True if the circuit is closed.
 
+        self.backlogged = set()
+        self.peak_backlog = {'upstream' : 0, 'downstream' : 0}
+
+        self.transport_name = transports.get_transport_name(transport.__class__)
+        self.metrics = metrics.get_transport_metrics(self.transport_name)
+        self.metrics.circuits.inc()
+        self.metrics.circuits_total.inc()
+        self.bytes_received = {'upstream' : 0, 'downstream' : 0}
+        self.bytes_sent = {'upstream' : 0, 'downstream' : 0}
+        self.completed_at = None
+        self.handshake_done = False
+        self.first_byte_pending = False
+
+        self.state = circuit_table.CONNECTING
+        self.lingering = set()
+        circuit_table.table.add(self)
+
+        self.timer = None
+        self.last_active = None
+        if HANDSHAKE_TIMEOUT:
+            self.timer = timerwheel.timeouts.call_later(HANDSHAKE_TIMEOUT,
+                                                        self.handshakeTimedOut)
+
         self.name = "circ_%s" % hex(id(self))
 
     def setDownstreamConnection(self, conn):
@@ -126,20 +304,32 @@ class Circuit(Protocol):
 
         log.debug("%s: Circuit completed." % self.name)
 
+        circuit_table.table.set_state(self, circuit_table.HANDSHAKING)
+
         # Set us as the circuit of our pluggable transport instance.
         self.transport.circuit = self
 
+        self.completed_at = time.time()
+        self.first_byte_pending = True
+
+        # Each side of the circuit produces the data that the other
+        # side consumes.
+        self.upstream.setProducer(self.downstream)
+        self.downstream.setProducer(self.upstream)
+
         # Call the transport-specific circuitConnected method since
         # this is a good time to perform a handshake.
         self.transport.circuitConnected()
+        if not self.transport.has_handshake:
+            self.handshakeCompleted()
 
         # Do a dummy dataReceived on the initiating connection in case
         # it has any buffered data that must be flushed to the network.
         #
-        # (We use callLater because we want to return back to the
-        # event loop so that any messages we send in circuitConnected get sent
-        # to the network immediately.)
-        reactor.callLater(0.01, conn_to_flush.dataReceived, '')
+        # (There is no need to return to the event loop first: whatever
+        # circuitConnected() sent is already queued on the transport,
+        # and Twisted writes queued data out in order.)
+        conn_to_flush.dataReceived('')
 
     def dataReceived(self, data, conn):
         """
@@ -155,16 +345,164 @@ class Circuit(Protocol):
         assert(self.downstream and self.upstream)
         assert((conn is self.downstream) or (conn is self.upstream))
 
+        side = 'downstream' if conn is self.downstream else 'upstream'
+        received = len(data)
+        self.last_active = timerwheel.timeouts.clock.seconds()
+
         try:
             if conn is self.downstream:
-                log.debug("%s: downstream: Received %d bytes." % (self.name, len(data)))
+                log.debug_packet("%s: downstream: Received %d bytes.", self.name, len(data))
                 self.transport.receivedDownstream(data)
             else:
-                log.debug("%s: upstream: Received %d bytes." % (self.name, len(data)))
+                log.debug_packet("%s: upstream: Received %d bytes.", self.name, len(data))
                 self.transport.receivedUpstream(data)
         except base.PluggableTransportError, err: # Our transport didn't like that data.
             log.info("%s: %s: Closing circuit." % (self.name, str(err)))
             self.close()
+            return
+
+        # Count the bytes our transport consumed. Whatever it left in
+        # the buffer gets counted when it's consumed.
+        received -= len(data)
+        self.bytes_received[side] += received
+        self.metrics.received[side].value += received
+
+        self.updateFlowControl()
+
+    def dataSent(self, conn, length):
+        """
+        'length' bytes were just written to 'conn'. Keep count.
+
+        Connections that are not attached to the circuit (yet) don't
+        count, like the Extended ORPort connection while it authenticates.
+        """
+        if conn is self.upstream:
+            side = 'upstream'
+            if self.first_byte_pending:
+                self.first_byte_pending = False
+                self.metrics.ttfb_seconds.observe(time.time() - self.completed_at)
+        elif conn is self.downstream:
+            side = 'downstream'
+        else:
+            return
+
+        self.last_active = timerwheel.timeouts.clock.seconds()
+        self.bytes_sent[side] += length
+        self.metrics.sent[side].value += length
+
+    def handshakeCompleted(self):
+        """
+        Our transport finished its handshake: the circuit is ready to
+        carry application data.
+        """
+        if self.handshake_done or self.closed:
+            return
+
+        self.handshake_done = True
+        circuit_table.table.set_state(self, circuit_table.OPEN)
+        self.metrics.handshake_successes.inc()
+        self.metrics.handshake_seconds.observe(time.time() - self.completed_at)
+
+        # From now on, only idling counts.
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        self.last_active = timerwheel.timeouts.clock.seconds()
+        if IDLE_TIMEOUT:
+            self.timer = timerwheel.timeouts.call_later(IDLE_TIMEOUT, self.checkIdle)
+
+    def handshakeTimedOut(self):
+        """
+        HANDSHAKE_TIMEOUT seconds went by, and we are still not done
+        with our handshake.
+        """
+        self.timer = None
+        self.reap(REAPED_HANDSHAKE_TIMEOUT,
+                  "Handshake not done after %d seconds" % HANDSHAKE_TIMEOUT)
+
+    def checkIdle(self):
+        """
+        IDLE_TIMEOUT seconds went by since we last checked. Close the
+        circuit if no data went through it in the meantime, or check
+        again once IDLE_TIMEOUT seconds went by since it last did.
+        """
+        self.timer = None
+
+        remaining = self.last_active + IDLE_TIMEOUT - timerwheel.timeouts.clock.seconds()
+        if remaining > 0:
+            self.timer = timerwheel.timeouts.call_later(remaining, self.checkIdle)
+        else:
+            self.reap(REAPED_IDLE_TIMEOUT, "Idle for %d seconds" % IDLE_TIMEOUT)
+
+    def reap(self, reason, message):
+        """
+        Close the circuit because it hit the limit 'reason' (one of the
+        REAPED_* constants). 'message' says what happened.
+        """
+        if self.closed:
+            return
+
+        log.info("%s: %s. Closing circuit." % (self.name, message))
+        metrics.CIRCUITS_REAPED.labels(self.transport_name, reason).inc()
+        self.close()
+
+    def updateFlowControl(self):
+        """
+        Look at how much data coming from each of our connections is
+        still buffered inside obfsproxy, and stop or resume reading
+        from the connections accordingly.
+
+        Can be called before the circuit is complete.
+        """
+        if self.closed:
+            return
+
+        if self.upstream:
+            backlog = len(self.upstream.buffer)
+            if self.transport.circuit is self:
+                backlog += self.transport.upstreamBacklog()
+            self._checkBacklog(self.upstream, 'upstream', backlog)
+
+        if self.downstream and not self.closed:
+            self._checkBacklog(self.downstream, 'downstream', len(self.downstream.buffer))
+
+    def _checkBacklog(self, conn, side, backlog):
+        """
+        'backlog' bytes that we received on 'conn' (our 'side'
+        connection) are still waiting to be sent. Pause 'conn' if
+        that's too much, or resume it if it's paused and the backlog
+        went down enough.
+        """
+        if backlog > self.peak_backlog[side]:
+            self.peak_backlog[side] = backlog
+
+        if MAX_CIRCUIT_BUFFER and backlog > MAX_CIRCUIT_BUFFER:
+            self.reap(REAPED_BUFFER, "%s backlog is %d bytes" % (side, backlog))
+            return
+
+        if backlog > HIGH_WATER_MARK and conn not in self.backlogged:
+            log.debug("%s: %s backlog is %d bytes. Pausing it.", self.name, side, backlog)
+            self.backlogged.add(conn)
+            conn.pauseReading(PAUSED_BY_BACKLOG)
+        elif backlog <= LOW_WATER_MARK and conn in self.backlogged:
+            log.debug("%s: %s backlog is %d bytes. Resuming it.", self.name, side, backlog)
+            self.backlogged.discard(conn)
+            conn.resumeReading(PAUSED_BY_BACKLOG)
+
+    def getBufferStats(self):
+        """
+        Return a dictionary with the buffering statistics of this
+        circuit: the peak backlog of each side, and the number of times
+        each side had to be paused.
+        """
+        stats = {}
+        for side in ('upstream', 'downstream'):
+            conn = getattr(self, side)
+            stats['peak_%s_backlog' % side] = self.peak_backlog[side]
+            stats['%s_pauses' % side] = conn.n_pauses if conn else 0
+
+        return stats
 
     def close(self, reason=None, side=None):
         """
@@ -176,16 +514,47 @@ class Circuit(Protocol):
             return # NOP if already closed
 
         log.debug("%s: Tearing down circuit." % self.name)
+        log.debug("%s: Buffer stats: %s", self.name, self.getBufferStats())
+        log.debug("%s: Received %s and sent %s bytes.", self.name,
+                  self.bytes_received, self.bytes_sent)
 
         self.closed = True
 
+        # Stay in the circuit table until our connections are gone.
+        circuit_table.table.set_state(self, circuit_table.CLOSING)
+        self.lingering = set(conn for conn in (self.downstream, self.upstream, self.accepted)
+                             if conn and conn.transport and not conn.lost)
+
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        self.metrics.circuits.dec()
+        if self.completed_at and not self.handshake_done:
+            self.metrics.handshake_failures.inc()
+
         if self.downstream:
             self.downstream.close()
         if self.upstream:
             self.upstream.close()
+        if self.accepted:
+            self.accepted.close()
 
         self.transport.circuitDestroyed(reason, side)
 
+        if not self.lingering:
+            circuit_table.table.remove(self)
+
+    def connectionGone(self, conn):
+        """
+        The network connection of 'conn', one of our connections, is
+        gone. Leave the circuit table if we are closed and it was the
+        last one.
+        """
+        self.lingering.discard(conn)
+        if self.closed and not self.lingering:
+            circuit_table.table.remove(self)
+
 class GenericProtocol(Protocol, object):
     """
     Generic obfsproxy connection. Contains useful methods and attributes.
@@ -196,15 +565,32 @@ class GenericProtocol(Protocol, object):
             away. This can happen because the circuit is not yet
             complete, or because the pluggable transport needs more
             data before deciding what to do.
+    producer: The connection (on the other side of the circuit) whose
+              data we are writing, registered as the streaming producer
+              of our transport.
+    paused_by: The reasons why we are currently not reading from our
+               transport. See pauseReading().
+    n_pauses: How many times we stopped reading from our transport.
+    lost: True once our network connection is gone.
+
+    A GenericProtocol is also an IPushProducer: the transport of the
+    other connection of the circuit pauses and resumes us.
     """
     def __init__(self, circuit):
         self.circuit = circuit
         self.buffer = obfs_buf.Buffer()
         self.closed = False # True if connection is closed.
+        self.lost = False
+
+        self.producer = None
+        self.paused_by = set()
+        self.n_pauses = 0
 
     def connectionLost(self, reason):
         log.debug("%s: Connection was lost (%s)." % (self.name, reason.getErrorMessage()))
+        self.lost = True
         self.close()
+        self.circuit.connectionGone(self)
 
     def connectionFailed(self, reason):
         log.debug("%s: Connection failed to connect (%s)." % (self.name, reason.getErrorMessage()))
@@ -218,9 +604,98 @@ class GenericProtocol(Protocol, object):
             log.debug("%s: Calling write() while connection is closed. Ignoring.", self.name)
             return
 
-        log.debug("%s: Writing %d bytes." % (self.name, len(buf)))
+        log.debug_packet("%s: Writing %d bytes.", self.name, len(buf))
 
         self.transport.write(buf)
+        self.dataWritten(len(buf))
+
+    def writeSequence(self, bufs):
+        """
+        Write the strings in 'bufs' to the underlying transport, one
+        after the other, without joining them first.
+        """
+        if self.closed:
+            log.debug("%s: Calling writeSequence() while connection is closed. Ignoring.", self.name)
+            return
+
+        length = sum(map(len, bufs))
+        log.debug_packet("%s: Writing %d bytes in %d pieces.", self.name, length, len(bufs))
+
+        self.transport.writeSequence(bufs)
+        self.dataWritten(length)
+
+    def dataWritten(self, length):
+        """
+        'length' bytes were just written to the underlying transport.
+        """
+        self.circuit.dataSent(self, length)
+
+        # The transport might just have flushed data it was holding
+        # back; see if we can resume reading from paused connections.
+        if self.circuit.backlogged:
+            self.circuit.updateFlowControl()
+
+    def setProducer(self, producer):
+        """
+        Register the connection 'producer' as the streaming producer of
+        our transport, so that it gets paused when we can't write our
+        data out fast enough.
+        """
+        if not IConsumer.providedBy(self.transport):
+            log.debug("%s: Transport is not a consumer. No flow control.", self.name)
+            return
+
+        # Twisted pauses the producer when more than 'bufferSize' bytes
+        # are waiting to be written, and resumes it when they are all
+        # written.
+        self.transport.bufferSize = HIGH_WATER_MARK
+        self.transport.registerProducer(producer, True)
+        self.producer = producer
+
+    def pauseReading(self, reason):
+        """
+        Stop reading from our transport because of 'reason'.
+        """
+        if self.closed or reason in self.paused_by:
+            return
+
+        if not self.paused_by:
+            self.n_pauses += 1
+            self.transport.pauseProducing()
+
+        self.paused_by.add(reason)
+
+    def resumeReading(self, reason):
+        """
+        'reason' no longer stops us from reading from our transport.
+        Resume reading if nothing else does.
+        """
+        if self.closed or reason not in self.paused_by:
+            return
+
+        self.paused_by.discard(reason)
+
+        if not self.paused_by:
+            self.transport.resumeProducing()
+
+    def pauseProducing(self):
+        """
+        IPushProducer: The other side of the circuit can't keep up with
+        our data.
+        """
+        self.pauseReading(PAUSED_BY_CONSUMER)
+
+    def resumeProducing(self):
+        """
+        IPushProducer: The other side of the circuit flushed our data.
+        """
+        self.resumeReading(PAUSED_BY_CONSUMER)
+
+    def stopProducing(self):
+        """
+        IPushProducer: The other side of the circuit is gone. The
+        circuit takes care of closing us.
+        """
 
     def close(self, also_close_circuit=True):
         """
@@ -233,6 +708,12 @@ class GenericProtocol(Protocol, object):
 
         self.closed = True
 
+        # Twisted doesn't close a connection with a registered
+        # producer until the producer is unregistered.
+        if self.producer:
+            self.transport.unregisterProducer()
+            self.producer = None
+
         self.transport.loseConnection()
         if also_close_circuit:
             self.circuit.close()
@@ -268,6 +749,12 @@ class StaticDestinationProtocol(GenericProtocol):
         it in our circuit.
         """
 
+        # Our circuit might have been closed while we were connecting.
+        if self.circuit.closed:
+            log.debug("%s: connectionMade: Circuit is closed. Closing." % self.name)
+            self.close()
+            return
+
         # Find the connection's direction and register it in the circuit.
         if self.mode == 'client' and not self.circuit.upstream:
             log.debug("%s: connectionMade (client): " \
@@ -314,7 +801,8 @@ class StaticDestinationProtocol(GenericProtocol):
 
         # Circuit is not fully connected yet, nothing to do here.
         if not self.circuit.circuitIsReady():
-            log.debug("%s: Incomplete circuit; cached %d bytes." % (self.name, len(data)))
+            log.debug_packet("%s: Incomplete circuit; cached %d bytes.", self.name, len(data))
+            self.circuit.updateFlowControl()
             return
 
         self.circuit.dataReceived(self.buffer, self)
@@ -377,7 +865,10 @@ class StaticDestinationServerFactory(Factory):
     def buildProtocol(self, addr):
         log.debug("%s: New connection from %s:%d." % (self.name, log.safe_addr_str(addr.host), addr.port))
 
-        circuit = Circuit(self.transport_class())
+        if refuse_circuit(self.transport_class, addr.host):
+            return None
+
+        circuit = Circuit(self.transport_class(), addr.host)
 
         # XXX instantiates a new factory for each client
         clientFactory = StaticDestinationClientFactory(circuit, self.mode)
@@ -389,7 +880,8 @@ class StaticDestinationServerFactory(Factory):
         else:
             reactor.connectTCP(self.remote_host, self.remote_port, clientFactory)
 
-        return StaticDestinationProtocol(circuit, self.mode, addr)
+        circuit.accepted = StaticDestinationProtocol(circuit, self.mode, addr)
+        return circuit.accepted
 
 def create_proxy_client(host, port, proxy_spec, instance):
     """
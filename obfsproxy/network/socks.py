@@ -51,6 +51,12 @@ class OBFSSOCKSv5Outgoing(socks5.SOCKSv5Outgoing, network.GenericProtocol):
         return super(OBFSSOCKSv5Outgoing, self).__init__(socksProtocol)
 
     def connectionMade(self):
+        # Our circuit might have been closed while we were connecting.
+        if self.circuit.closed:
+            log.debug("%s: connectionMade: Circuit is closed. Closing." % self.name)
+            self.close()
+            return
+
         self.socks.set_up_circuit(self)
 
         # XXX: The transport should be doing this after handshaking since it
@@ -58,8 +64,13 @@ class OBFSSOCKSv5Outgoing(socks5.SOCKSv5Outgoing, network.GenericProtocol):
         # reply back set self.socks.otherConn here.
         super(OBFSSOCKSv5Outgoing, self).connectionMade()
 
+    def connectionLost(self, reason):
+        self.lost = True
+        super(OBFSSOCKSv5Outgoing, self).connectionLost(reason)
+        self.circuit.connectionGone(self)
+
     def dataReceived(self, data):
-        log.debug("%s: Recived %d bytes." % (self.name, len(data)))
+        log.debug_packet("%s: Recived %d bytes.", self.name, len(data))
 
         assert self.circuit.circuitIsReady()
         self.buffer.write(data)
@@ -179,6 +190,10 @@ class OBFSSOCKSv5Factory(protocol.Factory):
     def buildProtocol(self, addr):
         log.debug("%s: New connection." % self.name)
 
-        circuit = network.Circuit(self.transport_class())
+        if network.refuse_circuit(self.transport_class, addr.host):
+            return None
+
+        circuit = network.Circuit(self.transport_class(), addr.host)
 
-        return OBFSSOCKSv5Protocol(circuit, self.pt_config)
+        circuit.accepted = OBFSSOCKSv5Protocol(circuit, self.pt_config)
+        return circuit.accepted
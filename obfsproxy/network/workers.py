@@ -0,0 +1,278 @@
+"""
+Multi-process worker mode.
+
+A single Twisted reactor can only use one CPU core. With '--workers N',
+obfsproxy starts as a supervisor that sets up everything like it
+normally would (including talking to tor over the managed-proxy
+protocol), but instead of listening on its transport addresses it only
+reserves them. It then re-executes itself N times as worker processes.
+Every worker binds the reserved addresses with SO_REUSEPORT, so the
+kernel spreads incoming connections over the workers.
+
+Workers are re-executed instead of forked because the reactor already
+exists by the time we know what to listen on, and a reactor can't be
+shared with a forked child.
+
+The supervisor restarts workers that die, and workers exit when their
+supervisor goes away.
+"""
+
+import os
+import socket
+import sys
+
+from twisted.internet import reactor, defer, error, protocol, task
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# Environment variables the supervisor passes to its workers.
+WORKER_ID_ENV = 'OBFSPROXY_WORKER_ID'
+WORKER_PORTS_ENV = 'OBFSPROXY_WORKER_PORTS'
+
+# Linux value of SO_REUSEPORT, for Pythons that don't know about it.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# How many pending connections each worker's listener can have.
+LISTEN_BACKLOG = 50
+
+# Restart delays (in seconds) of workers that keep dying.
+MIN_RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+# A worker that ran this long (in seconds) did not crash on startup.
+STABLE_UPTIME = 60
+# How long (in seconds) we wait for our workers to exit when shutting down.
+SHUTDOWN_TIMEOUT = 5
+
+def _listener_key(transport, role):
+    return "%s:%s" % (transport, role)
+
+def _socket_family(host):
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+def _reuseport_socket(host, port):
+    """
+    Return a socket bound to 'host':'port' with SO_REUSEPORT set.
+
+    Throws twisted.internet.error.CannotListenError if that's not
+    possible.
+    """
+    sock = socket.socket(_socket_family(host), socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.bind((host, port))
+    except socket.error, err:
+        sock.close()
+        raise error.CannotListenError(host, port, err)
+
+    return sock
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """
+    Watches a worker process for its supervisor.
+
+    In external mode, the output of the worker is passed on to our
+    stdout. In managed mode, our stdout belongs to tor, so the output
+    of the worker is dropped.
+    """
+
+    def __init__(self, pool, worker_id, forward_output):
+        self.pool = pool
+        self.worker_id = worker_id
+        self.forward_output = forward_output
+        self.started = reactor.seconds()
+
+    def outReceived(self, data):
+        if self.forward_output:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+
+    def processEnded(self, reason):
+        self.pool.workerEnded(self, reason)
+
+class WorkerPool(object):
+    """
+    Keeps track of our workers, if we have any.
+
+    Attributes:
+    n_workers: The number of workers the supervisor runs. 1 means that
+               worker mode is off.
+    worker_id: Our worker number if we are a worker, or None.
+    ports: Maps listeners (see _listener_key()) to the ports the
+           supervisor reserved for them.
+    reserved: The sockets the supervisor holds to reserve its ports.
+    processes: Maps worker numbers to the WorkerProcessProtocol of each
+               running worker.
+    restart_delays: Maps worker numbers to the delay before their last
+                    restart, for backing off.
+    """
+
+    def __init__(self):
+        self.n_workers = 1
+        self.worker_id = None
+        self.ports = {}
+        self.reserved = {}
+        self.processes = {}
+        self.restart_delays = {}
+        self.managed = False
+        self.shutting_down = False
+        self.all_ended = None
+
+        if WORKER_ID_ENV in os.environ:
+            self.worker_id = int(os.environ[WORKER_ID_ENV])
+            for item in os.environ.get(WORKER_PORTS_ENV, '').split(','):
+                if item:
+                    key, port = item.rsplit(':', 1)
+                    self.ports[key] = int(port)
+
+    def setWorkerCount(self, n_workers):
+        """
+        Run 'n_workers' worker processes. Raises ValueError if
+        'n_workers' is not a positive number.
+        """
+        if n_workers < 1:
+            raise ValueError("Need at least one worker (not %d)." % n_workers)
+
+        self.n_workers = n_workers
+
+    def isWorker(self):
+        return self.worker_id is not None
+
+    def isSupervisor(self):
+        return (not self.isWorker()) and (self.n_workers > 1)
+
+    def listen(self, transport, role, host, port, factory):
+        """
+        Listen on 'host':'port' with 'factory' for the 'role' listener
+        of 'transport'. Return a tuple (addr, port) representing where
+        we managed to bind.
+
+        The supervisor only reserves the address, workers listen on the
+        address the supervisor reserved, and everyone else simply
+        listens.
+
+        Throws twisted.internet.error.CannotListenError if the listener
+        could not be set up.
+        """
+        key = _listener_key(transport, role)
+
+        if self.isSupervisor():
+            # Keep the socket bound but not listening: it holds the port
+            # for our workers without accepting any of its connections.
+            sock = _reuseport_socket(host, port)
+            self.reserved[key] = sock
+            bound_port = sock.getsockname()[1]
+            self.ports[key] = bound_port
+            return (host, bound_port)
+
+        if self.isWorker():
+            port = self.ports.get(key, port)
+            sock = _reuseport_socket(host, port)
+            try:
+                sock.listen(LISTEN_BACKLOG)
+                sock.setblocking(False)
+                listener = reactor.adoptStreamPort(sock.fileno(), _socket_family(host), factory)
+            finally:
+                sock.close() # adoptStreamPort() made its own copy.
+        else:
+            listener = reactor.listenTCP(port, factory, interface=host)
+
+        return (listener.getHost().host, listener.getHost().port)
+
+    def start(self, managed=False):
+        """
+        Called right before the event loop starts. The supervisor starts
+        its workers, and the workers start watching their supervisor.
+        """
+        if self.isWorker():
+            log.info("Worker %d started." % self.worker_id)
+            self.supervisor_pid = os.getppid()
+            self.watchdog = task.LoopingCall(self.checkSupervisor)
+            self.watchdog.start(1.0, now=False)
+            return
+
+        if not self.isSupervisor():
+            return
+
+        self.managed = managed
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+        for worker_id in xrange(self.n_workers):
+            self.spawnWorker(worker_id)
+
+    def spawnWorker(self, worker_id):
+        """Start worker 'worker_id' by running our command line again."""
+        env = dict(os.environ)
+        env[WORKER_ID_ENV] = str(worker_id)
+        env[WORKER_PORTS_ENV] = ','.join("%s:%d" % item for item in self.ports.items())
+
+        args = [sys.executable] + sys.argv
+        process = WorkerProcessProtocol(self, worker_id, not self.managed)
+        reactor.spawnProcess(process, sys.executable, args, env=env,
+                             childFDs={0: 'w', 1: 'r', 2: 2})
+
+        self.processes[worker_id] = process
+        log.debug("Started worker %d (pid %d).", worker_id, process.transport.pid)
+
+    def workerEnded(self, process, reason):
+        """A worker process exited. Restart it unless we are shutting down."""
+        worker_id = process.worker_id
+        del self.processes[worker_id]
+
+        if self.shutting_down:
+            if not self.processes and not self.all_ended.called:
+                self.all_ended.callback(None)
+            return
+
+        # Back off when a worker keeps dying right after starting.
+        if reactor.seconds() - process.started >= STABLE_UPTIME:
+            delay = MIN_RESTART_DELAY
+        else:
+            delay = min(self.restart_delays.get(worker_id, 0) * 2 or MIN_RESTART_DELAY,
+                        MAX_RESTART_DELAY)
+        self.restart_delays[worker_id] = delay
+
+        log.warning("Worker %d exited (%s). Restarting it in %d seconds." %
+                    (worker_id, reason.getErrorMessage(), delay))
+        reactor.callLater(delay, self.restartWorker, worker_id)
+
+    def restartWorker(self, worker_id):
+        if not self.shutting_down:
+            self.spawnWorker(worker_id)
+
+    def stop(self):
+        """
+        Our event loop is stopping. Take our workers down with us.
+
+        Return a Deferred that fires when they are all gone, so that the
+        reactor waits for them (but not longer than SHUTDOWN_TIMEOUT).
+        """
+        self.shutting_down = True
+        self.all_ended = defer.Deferred()
+
+        if not self.processes:
+            self.all_ended.callback(None)
+            return self.all_ended
+
+        for process in self.processes.values():
+            try:
+                process.transport.signalProcess('TERM')
+            except error.ProcessExitedAlready:
+                pass
+
+        timeout = reactor.callLater(SHUTDOWN_TIMEOUT, self.all_ended.callback, None)
+        self.all_ended.addCallback(lambda _: timeout.active() and timeout.cancel())
+
+        return self.all_ended
+
+    def checkSupervisor(self):
+        """Exit if our supervisor is gone (and we were adopted by init)."""
+        if os.getppid() != self.supervisor_pid:
+            log.warning("Worker %d: Supervisor is gone. Exiting." % self.worker_id)
+            self.watchdog.stop()
+            reactor.stop()
+
+""" Global variable that will track our workers. """
+pool = WorkerPool()
@@ -11,10 +11,15 @@ import sys
 
 import obfsproxy.network.launch_transport as launch_transport
 import obfsproxy.network.network as network
+import obfsproxy.network.workers as workers
 import obfsproxy.transports.transports as transports
+import obfsproxy.transports.obfs3_dh as obfs3_dh
 import obfsproxy.common.log as logging
 import obfsproxy.common.argparser as argparser
 import obfsproxy.common.heartbeat as heartbeat
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.executor as executor
+import obfsproxy.common.crypto_backend as crypto_backend
 import obfsproxy.common.transport_config as transport_config
 import obfsproxy.managed.server as managed_server
 import obfsproxy.managed.client as managed_client
@@ -28,6 +33,7 @@ from pyptlib.config import checkClientMode
 from pyptlib.client_config import parseProxyURI
 
 from twisted.internet import task # for LoopingCall
+from twisted.internet import error
 
 log = logging.get_obfslogger()
 
@@ -47,6 +53,8 @@ def set_up_cli_parsing():
                         help='set minimum logging severity (default: %(default)s)')
     parser.add_argument('--no-log', action='store_true', default=False,
                         help='disable logging')
+    parser.add_argument('--no-packet-log', action='store_true', default=False,
+                        help='disable the debug messages logged for every packet')
     parser.add_argument('--no-safe-logging', action='store_true',
                         default=False,
                         help='disable safe (scrubbed address) logging')
@@ -56,6 +64,45 @@ def set_up_cli_parsing():
     parser.add_argument('--proxy', action='store', dest='proxy',
                         help='Outgoing proxy (<proxy_type>://[<user_name>][:<password>][@]<ip>:<port>)')
 
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the listeners (default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve metrics in the Prometheus format on this port of '
+                        '127.0.0.1 (worker N uses this port plus N)')
+    parser.add_argument('--dh-pool-size', type=int, default=obfs3_dh.DEFAULT_POOL_SIZE,
+                        help='number of UniformDH keypairs (obfs3 and ScrambleSuit) to '
+                        'generate ahead of time; 0 disables the pool (default: %(default)s)')
+    parser.add_argument('--crypto-backend', choices=crypto_backend.get_available_backends(),
+                        default=crypto_backend.backend.name,
+                        help='implementation of AES-CTR to use (default: %(default)s)')
+    parser.add_argument('--handshake-processes', type=int, default=executor.DEFAULT_PROCESSES,
+                        help='number of processes computing obfs3 and ScrambleSuit handshakes; '
+                        '0 computes them in threads (default: %(default)s)')
+    parser.add_argument('--max-handshake-backlog', type=int, default=executor.DEFAULT_MAX_BACKLOG,
+                        help='refuse new handshakes while this many are waiting to be computed '
+                        '(default: %(default)s)')
+    parser.add_argument('--high-water-mark', type=int, default=network.HIGH_WATER_MARK,
+                        help='stop reading from a connection when this many bytes of its data '
+                        'are waiting to be sent (default: %(default)s)')
+    parser.add_argument('--low-water-mark', type=int, default=network.LOW_WATER_MARK,
+                        help='resume reading from a connection when this many bytes of its data '
+                        'are waiting to be sent (default: %(default)s)')
+    parser.add_argument('--handshake-timeout', type=int, default=network.HANDSHAKE_TIMEOUT,
+                        help='close circuits that did not finish their handshake after this many '
+                        'seconds; 0 disables the timeout (default: %(default)s)')
+    parser.add_argument('--idle-timeout', type=int, default=network.IDLE_TIMEOUT,
+                        help='close circuits that carried no data for this many seconds; '
+                        '0 disables the timeout (default: %(default)s)')
+    parser.add_argument('--max-circuit-buffer', type=int, default=network.MAX_CIRCUIT_BUFFER,
+                        help='close circuits that buffer more than this many bytes; '
+                        '0 disables the limit (default: %(default)s)')
+    parser.add_argument('--max-circuits', type=int, default=network.MAX_CIRCUITS,
+                        help='refuse new connections while this many circuits are open; '
+                        '0 disables the limit (default: %(default)s)')
+    parser.add_argument('--max-circuits-per-ip', type=int, default=network.MAX_CIRCUITS_PER_PEER,
+                        help='refuse new connections from an address while it has this many '
+                        'circuits; 0 disables the limit (default: %(default)s)')
+
     # Managed mode is a subparser for now because there are no
     # optional subparsers: bugs.python.org/issue9253
     subparsers.add_parser("managed", help="managed mode")
@@ -103,6 +150,7 @@ def do_external_mode(args):
     launch_transport.launch_transport_listener(args.name, args.listen_addr, args.mode, args.dest, pt_config, args.ext_cookie_file)
     log.info("Launched '%s' listener at '%s:%s' for transport '%s'." % \
                  (args.mode, log.safe_addr_str(args.listen_addr[0]), args.listen_addr[1], args.name))
+    workers.pool.start()
     reactor.run()
 
 def consider_cli_args(args):
@@ -114,6 +162,8 @@ def consider_cli_args(args):
         log.set_log_severity(args.log_min_severity)
     if args.no_log:
         log.disable_logs()
+    if args.no_packet_log:
+        log.disable_packet_logs()
     if args.no_safe_logging:
         log.set_no_safe_logging()
 
@@ -143,6 +193,41 @@ def consider_cli_args(args):
             log.error("Failed to parse proxy specifier: %s", e)
             sys.exit(1)
 
+    crypto_backend.set_backend(args.crypto_backend)
+
+    try:
+        workers.pool.setWorkerCount(args.workers)
+    except ValueError as e:
+        log.error("Bad number of workers: %s", e)
+        sys.exit(1)
+
+    try:
+        obfs3_dh.pool.set_size(args.dh_pool_size)
+    except ValueError as e:
+        log.error("Bad UniformDH keypair pool size: %s", e)
+        sys.exit(1)
+
+    try:
+        executor.executor.set_process_count(args.handshake_processes)
+        executor.executor.set_max_backlog(args.max_handshake_backlog)
+    except ValueError as e:
+        log.error("Bad handshake executor settings: %s", e)
+        sys.exit(1)
+
+    try:
+        network.set_buffer_watermarks(args.high_water_mark, args.low_water_mark)
+    except ValueError as e:
+        log.error("Bad buffer watermarks: %s", e)
+        sys.exit(1)
+
+    try:
+        network.set_circuit_limits(args.handshake_timeout, args.idle_timeout,
+                                   args.max_circuit_buffer, args.max_circuits,
+                                   args.max_circuits_per_ip)
+    except ValueError as e:
+        log.error("Bad circuit limits: %s", e)
+        sys.exit(1)
+
 def run_transport_setup(pt_config, transport_name):
     """Run the setup() method for our transports."""
     for transport, transport_class in transports.transports.items():
@@ -163,6 +248,7 @@ def pyobfsproxy():
     except Exception:
         pass
 
+    log.debug('Crypto backend: %s' % crypto_backend.backend.name)
     log.debug('argv: ' + str(sys.argv))
     log.debug('args: ' + str(args))
 
@@ -170,6 +256,16 @@ def pyobfsproxy():
     l = task.LoopingCall(heartbeat.heartbeat.talk)
     l.start(3600.0, now=False) # do heartbeat every hour
 
+    # Serve our metrics. The supervisor of worker processes doesn't
+    # carry any traffic itself: its workers serve their own metrics.
+    if args.metrics_port is not None and not workers.pool.isSupervisor():
+        metrics_port = args.metrics_port + (workers.pool.worker_id or 0)
+        try:
+            metrics.listen(metrics_port)
+        except error.CannotListenError, e:
+            log.error("Could not serve metrics on port %d (%s)." % (metrics_port, e.socketError))
+            sys.exit(1)
+
     # Initiate obfsproxy.
     if (args.name == 'managed'):
         do_managed_mode()
@@ -37,6 +37,39 @@ class testBuffer(twisted.trial.unittest.TestCase):
         self.assertEqual(self.buf.peek(-1), '.') # peek at last character
         self.assertEqual(len(self.buf), 1) # length must be 1
 
+    def test_chunked_writes(self):
+        """Read, peek and drain across the boundaries of many writes."""
+        buf = obfs_buf.Buffer()
+        for char in self.test_string:
+            buf.write(char)
+        self.assertEqual(len(buf), len(self.test_string))
+
+        self.assertEqual(buf.peek(6), self.test_string[:6])
+        self.assertEqual(buf.read(3), self.test_string[:3])
+        buf.drain(5)
+        self.assertEqual(len(buf), len(self.test_string) - 8)
+        self.assertEqual(buf.read(10), self.test_string[8:18])
+        self.assertEqual(buf.peek(), self.test_string[18:])
+        self.assertEqual(buf.read(), self.test_string[18:])
+        self.assertFalse(buf)
+
+    def test_write_empty(self):
+        buf = obfs_buf.Buffer()
+        buf.write('')
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.peek(), '')
+        self.assertEqual(buf.read(), '')
+
+    def test_peek_view(self):
+        self.buf.write(" And I am a scorpio.")
+        self.buf.drain(3)
+        view = self.buf.peek_view(10)
+        self.assertEqual(view.tobytes(), self.test_string[3:13])
+        self.assertEqual(len(self.buf), len(self.test_string) + 17)
+
+        view = self.buf.peek_view()
+        self.assertEqual(view.tobytes(), self.test_string[3:] + " And I am a scorpio.")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import obfsproxy.common.metrics as metrics
+import obfsproxy.network.circuit_table as circuit_table
+
+import twisted.trial.unittest
+
+class FakeCircuit(object):
+    def __init__(self, transport_name, peer):
+        self.transport_name = transport_name
+        self.peer = peer
+        self.state = circuit_table.CONNECTING
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class testCircuitTable(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.table = circuit_table.CircuitTable()
+        self.a = FakeCircuit('obfs3', '192.0.2.1')
+        self.b = FakeCircuit('obfs3', '192.0.2.2')
+        self.c = FakeCircuit('scramblesuit', '192.0.2.1')
+        for circuit in (self.a, self.b, self.c):
+            self.table.add(circuit)
+
+    def test_indexes(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.of_transport('obfs3'), set([self.a, self.b]))
+        self.assertEqual(self.table.of_peer('192.0.2.1'), set([self.a, self.c]))
+        self.assertEqual(self.table.of_peer('192.0.2.3'), set())
+        self.assertEqual(self.table.in_state(circuit_table.CONNECTING),
+                         set([self.a, self.b, self.c]))
+
+    def test_set_state(self):
+        self.table.set_state(self.a, circuit_table.OPEN)
+        self.assertEqual(self.a.state, circuit_table.OPEN)
+        self.assertEqual(self.table.in_state(circuit_table.OPEN), set([self.a]))
+        self.assertEqual(self.table.get_stats(), {'connecting' : 2, 'handshaking' : 0,
+                                                  'open' : 1, 'closing' : 0})
+
+    def test_remove(self):
+        self.table.remove(self.c)
+        self.table.remove(self.c)
+        self.assertNotIn(self.c, self.table)
+        self.assertNotIn('scramblesuit', self.table.transports)
+        self.assertEqual(self.table.of_peer('192.0.2.1'), set([self.a]))
+
+        # Peers that are gone are forgotten.
+        self.table.remove(self.a)
+        self.assertEqual(sorted(self.table.peers), ['192.0.2.2'])
+
+    def test_close(self):
+        self.b.closed = True
+        self.assertEqual(self.table.close(self.table.of_transport('obfs3')), 1)
+        self.assertTrue(self.a.closed)
+        self.assertFalse(self.c.closed)
+
+    def test_metrics(self):
+        gauge = metrics.CIRCUIT_STATES.labels(circuit_table.CONNECTING)
+        before = gauge.value
+        circuit_table.table.add(self.a)
+        try:
+            self.assertEqual(gauge.value, before + 1)
+        finally:
+            circuit_table.table.remove(self.a)
+
+if __name__ == '__main__':
+    unittest.main()
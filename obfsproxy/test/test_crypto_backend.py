@@ -0,0 +1,101 @@
+import os
+import unittest
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+import obfsproxy.common.crypto_backend as crypto_backend
+import obfsproxy.common.aes as aes
+import obfsproxy.common.hmac_sha256 as hmac_sha256
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+
+import twisted.trial.unittest
+
+# NIST SP 800-38A, F.5.1 (CTR-AES128.Encrypt).
+NIST_KEY = "2b7e151628aed2a6abf7158809cf4f3c".decode('hex')
+NIST_COUNTER = "f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff".decode('hex')
+NIST_PLAINTEXT = ("6bc1bee22e409f96e93d7e117393172a"
+                  "ae2d8a571e03ac9c9eb76fac45af8e51"
+                  "30c81c46a35ce411e5fbc1191a0a52ef"
+                  "f69f2445df4f9b17ad2b417be66c3710").decode('hex')
+NIST_CIPHERTEXT = ("874d6191b620e3261bef6864990db6ce"
+                   "9806f66b7970fdff8617187bb9fffdff"
+                   "5ae4df3edbd5d35e5b4f09020db03eab"
+                   "1e031dda2fbe03d1792170a0f3009cee").decode('hex')
+
+class testCryptoBackends(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.original = crypto_backend.backend.name
+
+    def tearDown(self):
+        crypto_backend.set_backend(self.original)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, crypto_backend.set_backend, 'rot13')
+
+    def test_nist(self):
+        for name in crypto_backend.get_available_backends():
+            crypto_backend.set_backend(name)
+            cipher = aes.AES_CTR_128(NIST_KEY, NIST_COUNTER)
+
+            # Feed it in odd-sized pieces, to cross block boundaries.
+            ciphertext = cipher.crypt(NIST_PLAINTEXT[:7]) + cipher.crypt(NIST_PLAINTEXT[7:40]) + \
+                         cipher.crypt(NIST_PLAINTEXT[40:])
+            self.assertEqual(ciphertext, NIST_CIPHERTEXT, name)
+
+    def test_wraparound(self):
+        key = os.urandom(16)
+        outputs = []
+        for name in crypto_backend.get_available_backends():
+            crypto_backend.set_backend(name)
+            cipher = aes.AES_CTR_128(key, '\xff' * 16, counter_wraparound=True)
+            outputs.append(cipher.crypt('\x00' * 48))
+
+        # The second block is encrypted with the counter wrapped around to 0.
+        reference = aes.AES_CTR_128(key, '\x00' * 16).crypt('\x00' * 16)
+        for output in outputs:
+            self.assertEqual(output[16:32], reference)
+
+    def test_scramblesuit(self):
+        """
+        ScrambleSuit's counter is the 64-bit IV followed by a 64-bit
+        counter that starts at 1, like PyCrypto's
+        Counter.new(64, prefix=iv, initial_value=1) that it used to use.
+        """
+        key = "".join(chr(i) for i in xrange(32))
+        iv = "f0f1f2f3f4f5f6f7".decode('hex')
+        keystream = ("715896cfbf80df8c10223beeb74b78b9"
+                     "4c24bd3f13a40dc2019e85ba46a35c00"
+                     "41d30079bbd4378c70dc6920cc218db1").decode('hex')
+
+        for name in crypto_backend.get_available_backends():
+            crypto_backend.set_backend(name)
+            crypter = mycrypto.PayloadCrypter()
+            crypter.setSessionKey(key, iv)
+            self.assertEqual(crypter.encrypt('\x00' * 7) + crypter.encrypt('\x00' * 41),
+                             keystream, name)
+
+    def test_scramblesuit_legacy_counter(self):
+        key = os.urandom(32)
+        iv = os.urandom(8)
+        data = os.urandom(5000)
+
+        legacy = AES.new(key, AES.MODE_CTR,
+                         counter=Counter.new(64, prefix=iv, initial_value=1))
+        expected = legacy.encrypt(data)
+
+        for name in crypto_backend.get_available_backends():
+            crypto_backend.set_backend(name)
+            crypter = mycrypto.PayloadCrypter()
+            crypter.setSessionKey(key, iv)
+            self.assertEqual(crypter.encrypt(data[:1448]) + crypter.encrypt(data[1448:]),
+                             expected, name)
+
+    def test_hmac_sha256(self):
+        # RFC 4231, test case 2.
+        self.assertEqual(hmac_sha256.hmac_sha256_digest("Jefe", "what do ya want for nothing?"),
+                         "5bdcc146bf60754e6a042426089575c7"
+                         "5a003f089d2739839dec58b964ec3843".decode('hex'))
+
+if __name__ == '__main__':
+    unittest.main()
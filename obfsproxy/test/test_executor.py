@@ -0,0 +1,96 @@
+import unittest
+
+import obfsproxy.common.executor as executor
+import obfsproxy.network.workers as workers
+import obfsproxy.transports.dummy as dummy
+import obfsproxy.transports.obfs3 as obfs3
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+import twisted.trial.unittest
+from twisted.internet import defer
+
+def fail(message):
+    raise ValueError(message)
+
+class testHandshakeExecutor(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.executor = executor.HandshakeExecutor()
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_settings(self):
+        self.assertRaises(ValueError, self.executor.set_process_count, -1)
+        self.assertRaises(ValueError, self.executor.set_max_backlog, 0)
+
+        # No processes: nothing to start.
+        self.executor.start()
+        self.assertFalse(self.executor.is_running())
+
+    @defer.inlineCallbacks
+    def test_threads(self):
+        dh_x = obfs3_dh.UniformDH()
+        dh_y = obfs3_dh.UniformDH()
+        observed = self.executor.latency.count
+
+        secret = yield self.executor.submit(obfs3_dh.compute_secret, dh_x.priv, dh_y.get_public())
+        self.assertEqual(secret, dh_y.get_secret(dh_x.get_public()))
+        self.assertEqual(self.executor.backlog, 0)
+        self.assertEqual(self.executor.latency.count, observed + 1)
+
+    @defer.inlineCallbacks
+    def test_processes(self):
+        self.executor.set_process_count(1)
+        self.executor.start()
+        self.assertTrue(self.executor.is_running())
+
+        dh_x = yield self.executor.submit_background(obfs3_dh.UniformDH)
+        dh_y = obfs3_dh.UniformDH()
+
+        secret = yield self.executor.submit(obfs3_dh.compute_secret, dh_x.priv, dh_y.get_public())
+        self.assertEqual(secret, dh_y.get_secret(dh_x.get_public()))
+
+        d = self.executor.submit(fail, "oops")
+        yield self.assertFailure(d, ValueError)
+        self.assertEqual(self.executor.backlog, 0)
+
+    @defer.inlineCallbacks
+    def test_backlog_full(self):
+        self.executor.set_max_backlog(1)
+
+        first = self.executor.submit(pow, 2, 10)
+        yield self.assertFailure(self.executor.submit(pow, 2, 10),
+                                 executor.HandshakeBacklogFull)
+        self.assertEqual(self.executor.rejected, 1)
+
+        result = yield first
+        self.assertEqual(result, 1024)
+        self.assertEqual(self.executor.submit(pow, 2, 10).called, False)
+
+    def test_started_by_transports(self):
+        self.patch(executor, 'executor', self.executor)
+        self.patch(obfs3_dh, 'pool', obfs3_dh.KeypairPool())
+        obfs3_dh.pool.set_size(0)
+        self.executor.set_process_count(1)
+
+        # Only the transports whose handshakes we compute start it.
+        dummy.DummyServer.setup(None)
+        self.assertFalse(self.executor.is_running())
+        obfs3.Obfs3Server.setup(None)
+        self.assertTrue(self.executor.is_running())
+
+    def test_not_started_by_supervisor(self):
+        self.patch(executor, 'executor', self.executor)
+        self.patch(obfs3_dh, 'pool', obfs3_dh.KeypairPool())
+        self.patch(workers, 'pool', workers.WorkerPool())
+        workers.pool.setWorkerCount(2)
+        self.executor.set_process_count(1)
+        obfs3_dh.pool.set_size(1)
+
+        # No handshake processes and no keypairs for the supervisor.
+        obfs3.Obfs3Server.setup(None)
+        self.assertFalse(self.executor.is_running())
+        self.assertEqual(obfs3_dh.pool.refilling, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import obfsproxy.common.metrics as metrics
+
+import twisted.trial.unittest
+
+class testMetrics(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(metrics.Counter('test_total', 'A counter.', ['transport']))
+        counter.labels('obfs3').inc()
+        counter.labels('obfs3').inc(41)
+        counter.labels('dummy').inc()
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP test_total A counter.\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{transport="dummy"} 1\n'
+                         'test_total{transport="obfs3"} 42\n')
+
+    def test_labels_are_cached(self):
+        gauge = metrics.Gauge('test', 'A gauge.', ['a', 'b'])
+        self.assertIs(gauge.labels('x', 'y'), gauge.labels('x', 'y'))
+        self.assertIsNot(gauge.labels('x', 'y'), gauge.labels('y', 'x'))
+
+    def test_label_escaping(self):
+        gauge = self.registry.register(metrics.Gauge('test', 'A gauge.', ['name']))
+        gauge.labels('say "hi"\\').set(3)
+        self.assertIn('test{name="say \\"hi\\"\\\\"} 3\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.register(metrics.Histogram('test_seconds', 'A histogram.',
+                                                             buckets=(0.1, 1.0)))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.labels().observe(value)
+
+        self.assertEqual(self.registry.render().splitlines()[2:],
+                         ['test_seconds_bucket{le="0.1"} 2',
+                          'test_seconds_bucket{le="1.0"} 3',
+                          'test_seconds_bucket{le="+Inf"} 4',
+                          'test_seconds_sum 2.65',
+                          'test_seconds_count 4'])
+
+    def test_function(self):
+        things = []
+        gauge = self.registry.register(metrics.Gauge('test', 'A gauge.'))
+        gauge.set_function(lambda: len(things))
+        things.extend('abc')
+        self.assertEqual(self.registry.render().splitlines()[2], 'test 3')
+
+    def test_transport_metrics(self):
+        self.assertIs(metrics.get_transport_metrics('obfs3'),
+                      metrics.get_transport_metrics('obfs3'))
+        self.assertIs(metrics.get_transport_metrics('obfs3').sent['upstream'],
+                      metrics.SENT_BYTES.labels('obfs3', 'upstream'))
+
+if __name__ == '__main__':
+    unittest.main()
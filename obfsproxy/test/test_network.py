@@ -0,0 +1,299 @@
+import unittest
+
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.timerwheel as timerwheel
+import obfsproxy.network.circuit_table as circuit_table
+import obfsproxy.network.network as network
+import obfsproxy.transports.dummy as dummy
+
+import twisted.trial.unittest
+from twisted.internet import task
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+class BackloggedTransport(dummy.DummyClient):
+    """A dummy transport that pretends to hold back upstream data."""
+    def __init__(self):
+        dummy.DummyClient.__init__(self)
+        self.backlog = 0
+
+    def upstreamBacklog(self):
+        return self.backlog
+
+class testCircuit(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.old_watermarks = (network.HIGH_WATER_MARK, network.LOW_WATER_MARK)
+        network.set_buffer_watermarks(1000, 100)
+        self.old_limits = (network.HANDSHAKE_TIMEOUT, network.IDLE_TIMEOUT,
+                           network.MAX_CIRCUIT_BUFFER, network.MAX_CIRCUITS,
+                           network.MAX_CIRCUITS_PER_PEER)
+        network.set_circuit_limits(60, 600, 5000, 0)
+
+        self.clock = task.Clock()
+        self.timeouts = timerwheel.timeouts
+        timerwheel.timeouts = timerwheel.TimerWheel(self.clock, 1.0)
+
+        self.table = circuit_table.table
+        circuit_table.table = circuit_table.CircuitTable()
+
+        self.pt = BackloggedTransport()
+        self.circuit = network.Circuit(self.pt, '192.0.2.1')
+        self.pt.circuit = self.circuit
+
+        self.upstream = network.StaticDestinationProtocol(self.circuit, 'client', None)
+        self.upstream.transport = proto_helpers.StringTransport()
+        self.circuit.upstream = self.upstream
+
+        self.downstream = network.StaticDestinationProtocol(self.circuit, 'client', None)
+        self.downstream.transport = proto_helpers.StringTransport()
+
+    def tearDown(self):
+        network.set_circuit_limits(*self.old_limits)
+        network.set_buffer_watermarks(*self.old_watermarks)
+        timerwheel.timeouts = self.timeouts
+        circuit_table.table = self.table
+
+    def complete(self):
+        self.circuit.downstream = self.downstream
+        self.circuit.circuitCompleted(self.upstream)
+
+    def test_producer_registration(self):
+        self.complete()
+        self.assertIs(self.upstream.transport.producer, self.downstream)
+        self.assertIs(self.downstream.transport.producer, self.upstream)
+        self.assertTrue(self.upstream.transport.streaming)
+        self.assertEqual(self.upstream.transport.bufferSize, 1000)
+
+    def test_consumer_pause(self):
+        """The other side's transport pauses and resumes us."""
+        self.complete()
+        self.downstream.transport.producer.pauseProducing()
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+        self.downstream.transport.producer.resumeProducing()
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+        self.assertEqual(self.upstream.n_pauses, 1)
+
+    def test_incomplete_circuit_backlog(self):
+        """Data piling up before the circuit is complete pauses us."""
+        self.upstream.dataReceived('A' * 999)
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+        self.upstream.dataReceived('A' * 2)
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+
+        # Once the circuit is complete, the buffer gets flushed.
+        self.complete()
+        self.upstream.dataReceived('')
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+        self.assertEqual(len(self.downstream.transport.value()), 1001)
+        self.assertEqual(self.circuit.getBufferStats()['peak_upstream_backlog'], 1001)
+
+    def test_transport_backlog(self):
+        """Data held back by the pluggable transport pauses us."""
+        self.complete()
+        self.pt.backlog = 5000
+        self.upstream.dataReceived('A')
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+
+        # Above the low-water mark: stay paused.
+        self.pt.backlog = 500
+        self.upstream.write('B')
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+
+        # Writing while paused is enough to notice that the backlog is gone.
+        self.pt.backlog = 0
+        self.downstream.write('C')
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+
+    def test_write_sequence(self):
+        self.complete()
+        self.downstream.writeSequence(['AB', 'C', ''])
+        self.assertEqual(self.downstream.transport.value(), 'ABC')
+        self.assertEqual(self.circuit.bytes_sent['downstream'], 3)
+
+    def test_pause_reasons(self):
+        """We only resume once nothing else keeps us paused."""
+        self.complete()
+        self.pt.backlog = 5000
+        self.upstream.dataReceived('A')
+        self.upstream.pauseProducing()
+        self.assertEqual(self.upstream.n_pauses, 1)
+
+        self.pt.backlog = 0
+        self.circuit.updateFlowControl()
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+        self.upstream.resumeProducing()
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+
+    def test_close_unregisters_producer(self):
+        self.complete()
+        self.circuit.close()
+        self.assertIsNone(self.upstream.transport.producer)
+        self.assertIsNone(self.downstream.transport.producer)
+        self.assertTrue(self.upstream.transport.disconnecting)
+
+    def test_traffic_counters(self):
+        self.complete()
+        self.upstream.dataReceived('A' * 10)
+        self.downstream.dataReceived('B' * 3)
+
+        self.assertEqual(self.circuit.bytes_received, {'upstream' : 10, 'downstream' : 3})
+        self.assertEqual(self.circuit.bytes_sent, {'upstream' : 3, 'downstream' : 10})
+
+    def test_unattached_writes(self):
+        """Writes of a connection that isn't attached yet are not counted."""
+        sent = self.circuit.metrics.sent['downstream'].value
+        ext_orport = network.StaticDestinationProtocol(self.circuit, 'server', None)
+        ext_orport.transport = proto_helpers.StringTransport()
+        ext_orport.write('AUTH')
+
+        self.assertEqual(self.circuit.bytes_sent, {'upstream' : 0, 'downstream' : 0})
+        self.assertEqual(self.circuit.metrics.sent['downstream'].value, sent)
+
+    def test_handshake_metrics(self):
+        stats = self.circuit.metrics
+        successes = stats.handshake_successes.value
+        failures = stats.handshake_failures.value
+        first_bytes = stats.ttfb_seconds.count
+        circuits = stats.circuits.value
+
+        # dummy has no handshake: it's done as soon as we are connected.
+        self.complete()
+        self.assertTrue(self.circuit.handshake_done)
+        self.assertEqual(stats.handshake_successes.value, successes + 1)
+
+        self.downstream.dataReceived('A')
+        self.downstream.dataReceived('B')
+        self.assertEqual(stats.ttfb_seconds.count, first_bytes + 1)
+
+        self.circuit.close()
+        self.assertEqual(stats.handshake_failures.value, failures)
+        self.assertEqual(stats.circuits.value, circuits - 1)
+
+    def test_handshake_failure(self):
+        failures = self.circuit.metrics.handshake_failures.value
+        self.pt.has_handshake = True
+        self.complete()
+        self.circuit.close()
+        self.assertEqual(self.circuit.metrics.handshake_failures.value, failures + 1)
+
+    def reaped(self, reason):
+        return metrics.CIRCUITS_REAPED.labels('dummy', reason).value
+
+    def test_handshake_timeout(self):
+        reaped = self.reaped(network.REAPED_HANDSHAKE_TIMEOUT)
+        self.circuit.accepted = self.upstream
+        self.pt.has_handshake = True
+
+        self.clock.advance(30)
+        self.complete()
+        self.clock.advance(29)
+        self.assertFalse(self.circuit.closed)
+
+        # The accepted connection gets closed even if it's not part of
+        # the circuit yet.
+        self.clock.advance(2)
+        self.assertTrue(self.circuit.closed)
+        self.assertTrue(self.upstream.transport.disconnecting)
+        self.assertEqual(self.reaped(network.REAPED_HANDSHAKE_TIMEOUT), reaped + 1)
+        self.assertEqual(timerwheel.timeouts.pending, 0)
+
+    def test_idle_timeout(self):
+        reaped = self.reaped(network.REAPED_IDLE_TIMEOUT)
+
+        # dummy has no handshake: the idle timeout starts right away.
+        self.complete()
+        self.clock.advance(500)
+        self.downstream.dataReceived('A')
+        self.clock.advance(500)
+        self.assertFalse(self.circuit.closed)
+
+        self.clock.advance(101)
+        self.assertTrue(self.circuit.closed)
+        self.assertEqual(self.reaped(network.REAPED_IDLE_TIMEOUT), reaped + 1)
+
+    def test_buffer_limit(self):
+        reaped = self.reaped(network.REAPED_BUFFER)
+        self.complete()
+        self.pt.backlog = 5000
+        self.upstream.dataReceived('A')
+        self.assertFalse(self.circuit.closed)
+
+        self.pt.backlog = 5001
+        self.upstream.dataReceived('A')
+        self.assertTrue(self.circuit.closed)
+        self.assertEqual(self.reaped(network.REAPED_BUFFER), reaped + 1)
+
+    def test_max_circuits(self):
+        refused = self.reaped(network.REAPED_MAX_CIRCUITS)
+        network.set_circuit_limits(60, 600, 5000, 2)
+        self.assertFalse(network.refuse_circuit(dummy.DummyClient, '192.0.2.2'))
+
+        other = network.Circuit(dummy.DummyClient(), '192.0.2.2')
+        self.assertTrue(network.refuse_circuit(dummy.DummyClient, '192.0.2.3'))
+        self.assertEqual(self.reaped(network.REAPED_MAX_CIRCUITS), refused + 1)
+
+        other.close()
+        self.assertFalse(network.refuse_circuit(dummy.DummyClient, '192.0.2.3'))
+
+    def test_max_circuits_per_peer(self):
+        refused = self.reaped(network.REAPED_MAX_CIRCUITS_PER_PEER)
+        network.set_circuit_limits(60, 600, 5000, 0, 2)
+        self.assertFalse(network.refuse_circuit(dummy.DummyClient, '192.0.2.1'))
+
+        network.Circuit(dummy.DummyClient(), '192.0.2.1')
+        self.assertTrue(network.refuse_circuit(dummy.DummyClient, '192.0.2.1'))
+        self.assertFalse(network.refuse_circuit(dummy.DummyClient, '192.0.2.2'))
+        self.assertEqual(self.reaped(network.REAPED_MAX_CIRCUITS_PER_PEER), refused + 1)
+
+    def test_circuit_table(self):
+        """The circuit table follows the circuit through its lifecycle."""
+        table = circuit_table.table
+        self.assertEqual(table.in_state(circuit_table.CONNECTING), set([self.circuit]))
+        self.assertEqual(table.of_peer('192.0.2.1'), set([self.circuit]))
+        self.assertEqual(table.of_transport('dummy'), set([self.circuit]))
+
+        self.pt.has_handshake = True
+        self.complete()
+        self.assertEqual(self.circuit.state, circuit_table.HANDSHAKING)
+        self.assertEqual(table.in_state(circuit_table.HANDSHAKING), set([self.circuit]))
+
+        self.circuit.handshakeCompleted()
+        self.assertEqual(table.get_stats(), {'connecting' : 0, 'handshaking' : 0,
+                                             'open' : 1, 'closing' : 0})
+
+        # Closed circuits stay in the table until their connections are gone.
+        self.circuit.close()
+        self.assertEqual(table.in_state(circuit_table.CLOSING), set([self.circuit]))
+        self.upstream.connectionLost(failure.Failure(Exception("Gone.")))
+        self.assertIn(self.circuit, table)
+        self.downstream.connectionLost(failure.Failure(Exception("Gone.")))
+        self.assertNotIn(self.circuit, table)
+        self.assertEqual(table.peers, {})
+
+    def test_circuit_table_lost_connection(self):
+        """A circuit whose connection is lost leaves the table once closed."""
+        self.complete()
+        self.downstream.connectionLost(failure.Failure(Exception("Gone.")))
+        self.assertTrue(self.circuit.closed)
+        self.assertEqual(self.circuit.lingering, set([self.upstream]))
+
+        self.upstream.connectionLost(failure.Failure(Exception("Gone.")))
+        self.assertEqual(len(circuit_table.table), 0)
+
+    def test_no_limits(self):
+        network.set_circuit_limits(0, 0, 0, 0)
+        circuit = network.Circuit(dummy.DummyClient())
+        self.assertIsNone(circuit.timer)
+        circuit.close()
+
+    def test_bad_limits(self):
+        self.assertRaises(ValueError, network.set_circuit_limits, -1, 600, 5000, 0)
+        self.assertRaises(ValueError, network.set_circuit_limits, 60, 600, 1000, 0)
+        self.assertRaises(ValueError, network.set_circuit_limits, 60, 600, 5000, 0, -1)
+
+    def test_bad_watermarks(self):
+        self.assertRaises(ValueError, network.set_buffer_watermarks, 100, 100)
+        self.assertRaises(ValueError, network.set_buffer_watermarks, 100, -1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import time
 
 import obfsproxy.transports.obfs3_dh as obfs3_dh
+import obfsproxy.common.modexp as modexp
 import twisted.trial.unittest
 from twisted.python import log
 
@@ -118,6 +119,25 @@ class testUniformDH_KAT(twisted.trial.unittest.TestCase):
         self.assertEqual(self._xYyX_str,  xY)
         self.assertEqual(self._xYyX_str,  yX)
 
+class testFixedBase(twisted.trial.unittest.TestCase):
+    def test_same_as_powMod(self):
+        mod = obfs3_dh.UniformDH.mod
+        table = obfs3_dh.get_generator_table()
+        for exponent in (0, 1, 2, 63, 64, mod - 1, (1L << 1536) - 1, 1L << 1536):
+            self.assertEqual(table.powMod(exponent), modexp.powMod(2, exponent, mod))
+
+        for i in range(20):
+            dh = obfs3_dh.UniformDH()
+            pub = modexp.powMod(2, dh.priv, mod)
+            if ord(dh.priv_str[-1]) % 2:
+                pub = mod - pub
+            self.assertEqual(dh.pub, pub)
+
+    def test_int_to_bytes(self):
+        self.assertEqual(obfs3_dh.int_to_bytes(0x0102, 4), '\x00\x00\x01\x02')
+        self.assertEqual(obfs3_dh.int_to_bytes(0x010203, 2), '\x02\x03')
+        self.assertEqual(obfs3_dh.bytes_to_int('\x00\x01\x02'), 0x0102)
+
 class testUniformDH_Benchmark(twisted.trial.unittest.TestCase):
     def test_benchmark(self):
         start = time.clock()
@@ -131,5 +151,40 @@ class testUniformDH_Benchmark(twisted.trial.unittest.TestCase):
         taken = (end - start) / 1000 / 2
         log.msg("Generate + Exchange: %f sec" % taken)
 
+class testKeypairPool(twisted.trial.unittest.TestCase):
+    def test_empty_pool(self):
+        """An empty pool generates keypairs inline."""
+        pool = obfs3_dh.KeypairPool()
+        dh = pool.get()
+        self.assertEqual(len(dh.get_public()), obfs3_dh.UniformDH.group_len)
+        self.assertEqual((pool.hits, pool.misses), (0, 1))
+        self.assertEqual(pool.refill(), None)
+
+    def test_keypairs_are_used_once(self):
+        pool = obfs3_dh.KeypairPool(2)
+        pool.fill()
+        self.assertEqual(len(pool.keypairs), 2)
+        self.assertEqual(pool.generated, 2)
+
+        dh_x = pool.get()
+        dh_y = pool.get()
+        self.assertNotEqual(dh_x.get_public(), dh_y.get_public())
+        self.assertEqual(dh_x.get_secret(dh_y.get_public()),
+                         dh_y.get_secret(dh_x.get_public()))
+        self.assertEqual((pool.hits, pool.misses), (2, 0))
+        self.assertEqual(pool.get_hit_rate(), 1.0)
+
+        # Taking keypairs out refilled the pool in the background.
+        self.assertNotEqual(pool.refilling, None)
+        return pool.refilling.addCallback(
+            lambda _: self.assertEqual(len(pool.keypairs), 2))
+
+    def test_set_size(self):
+        pool = obfs3_dh.KeypairPool(3)
+        pool.fill()
+        pool.set_size(1)
+        self.assertEqual(len(pool.keypairs), 1)
+        self.assertRaises(ValueError, pool.set_size, -1)
+
 if __name__ == '__main__':
     unittest.main()
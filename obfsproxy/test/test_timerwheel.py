@@ -0,0 +1,103 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+import obfsproxy.common.timerwheel as timerwheel
+
+class testTimerWheel(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.wheel = timerwheel.TimerWheel(self.clock)
+        self.fired = []
+
+    def advance(self, seconds):
+        """Advance the clock 'seconds' seconds, in steps of a millisecond."""
+        start = self.clock.seconds()
+        for i in xrange(1, int(round(seconds / timerwheel.RESOLUTION)) + 1):
+            self.clock.advance(start + i * timerwheel.RESOLUTION - self.clock.seconds())
+
+    def fire(self, name):
+        self.fired.append((name, self.clock.seconds()))
+
+    def test_order(self):
+        """Timers fire in order, never early and at most a tick late."""
+        for name, delay in (('c', 0.0105), ('a', 0.001), ('b', 0.005), ('d', 2.5)):
+            self.wheel.call_later(delay, self.fire, name)
+
+        self.advance(3)
+        self.assertEqual([name for name, _ in self.fired], ['a', 'b', 'c', 'd'])
+        for (name, when), delay in zip(self.fired, (0.001, 0.005, 0.0105, 2.5)):
+            self.assertTrue(1000 + delay - 1e-9 <= when <= 1000 + delay + timerwheel.RESOLUTION)
+
+        self.assertEqual(self.wheel.pending, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_one_reactor_call(self):
+        """Many timers share a single reactor call."""
+        for i in xrange(1000):
+            self.wheel.call_later(i * 0.0001, self.fire, i)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.advance(0.2)
+        self.assertEqual([name for name, _ in self.fired], range(1000))
+
+    def test_cancel(self):
+        timer = self.wheel.call_later(0.01, self.fire, 'cancelled')
+        self.wheel.call_later(0.02, self.fire, 'kept')
+        self.assertTrue(timer.active())
+
+        timer.cancel()
+        timer.cancel()
+        self.assertFalse(timer.active())
+        self.assertEqual(self.wheel.pending, 1)
+
+        self.advance(0.1)
+        self.assertEqual([name for name, _ in self.fired], ['kept'])
+
+    def test_reschedule_from_callback(self):
+        """Callbacks can schedule timers, even for the current tick."""
+        def again(count):
+            self.fire(count)
+            if count:
+                self.wheel.call_later(0, again, count - 1)
+        self.wheel.call_later(0.005, again, 3)
+
+        self.advance(0.1)
+        self.assertEqual([name for name, _ in self.fired], [3, 2, 1, 0])
+
+    def test_late_reactor(self):
+        """A reactor that is late (by more than a round) catches up."""
+        self.wheel.call_later(0.5, self.fire, 'a')
+        self.wheel.call_later(1.5, self.fire, 'b')
+        self.wheel.call_later(5, self.fire, 'c')
+
+        # Timers which are that late don't fire in order.
+        self.clock.advance(3)
+        self.assertEqual(sorted([name for name, _ in self.fired]), ['a', 'b'])
+
+        self.clock.advance(3)
+        self.assertEqual(sorted([name for name, _ in self.fired]), ['a', 'b', 'c'])
+
+    def test_resolution(self):
+        """Coarse wheels only wake the reactor up once a tick."""
+        wheel = timerwheel.TimerWheel(self.clock, 1.0)
+        wheel.call_later(0.2, self.fire, 'a')
+        wheel.call_later(0.7, self.fire, 'b')
+        wheel.call_later(600, self.fire, 'c')
+
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1001)
+        self.clock.advance(1)
+        self.assertEqual([name for name, _ in self.fired], ['a', 'b'])
+
+        self.clock.advance(599)
+        self.assertEqual([name for name, _ in self.fired], ['a', 'b', 'c'])
+
+    def test_failing_callback(self):
+        """A callback that raises doesn't stop the wheel."""
+        def fail():
+            raise RuntimeError("Boom.")
+        self.wheel.call_later(0.001, fail)
+        self.wheel.call_later(0.001, self.fire, 'after')
+
+        self.advance(0.01)
+        self.assertEqual([name for name, _ in self.fired], ['after'])
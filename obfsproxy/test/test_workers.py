@@ -0,0 +1,57 @@
+import os
+import socket
+import unittest
+
+import obfsproxy.network.workers as workers
+
+import twisted.trial.unittest
+from twisted.internet import protocol, reactor
+
+class testWorkerPool(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.pool = workers.WorkerPool()
+
+    def tearDown(self):
+        for sock in self.pool.reserved.values():
+            sock.close()
+
+    def test_worker_count(self):
+        self.assertFalse(self.pool.isSupervisor())
+        self.pool.setWorkerCount(4)
+        self.assertTrue(self.pool.isSupervisor())
+        self.assertRaises(ValueError, self.pool.setWorkerCount, 0)
+
+    def test_supervisor_reserves_port(self):
+        """The supervisor binds its address but does not accept connections."""
+        self.pool.setWorkerCount(2)
+        host, port = self.pool.listen('dummy', 'server', '127.0.0.1', 0, None)
+        self.assertNotEqual(port, 0)
+        self.assertEqual(self.pool.ports['dummy:server'], port)
+        self.assertRaises(socket.error, socket.create_connection, (host, port))
+
+    def test_worker_listens_on_reserved_port(self):
+        self.pool.setWorkerCount(2)
+        host, port = self.pool.listen('dummy', 'server', '127.0.0.1', 0, None)
+
+        os.environ[workers.WORKER_ID_ENV] = '1'
+        os.environ[workers.WORKER_PORTS_ENV] = 'dummy:server:%d' % port
+        try:
+            worker = workers.WorkerPool()
+        finally:
+            del os.environ[workers.WORKER_ID_ENV]
+            del os.environ[workers.WORKER_PORTS_ENV]
+
+        self.assertTrue(worker.isWorker())
+        self.assertFalse(worker.isSupervisor())
+
+        factory = protocol.ServerFactory()
+        factory.protocol = protocol.Protocol
+        self.assertEqual(worker.listen('dummy', 'server', '127.0.0.1', 0, factory),
+                         ('127.0.0.1', port))
+
+        for reader in reactor.getReaders():
+            if hasattr(reader, 'stopListening'):
+                self.addCleanup(reader.stopListening)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,23 @@ import unittest
 import os
 import base64
 import shutil
+import time
+import cPickle
+import random
 import tempfile
+import threading
+import multiprocessing
+
+import yaml
 
 import Crypto.Hash.SHA256
 import Crypto.Hash.HMAC
 
+import twisted.trial.unittest
+from twisted.internet import defer, reactor, task
+
 import obfsproxy.common.log as logging
+import obfsproxy.common.timerwheel as timerwheel
 import obfsproxy.network.buffer as obfs_buf
 import obfsproxy.common.transport_config as transport_config
 import obfsproxy.transports.base as base
@@ -24,6 +35,10 @@ import obfsproxy.transports.scramblesuit.state as state
 import obfsproxy.transports.scramblesuit.ticket as ticket
 import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
 import obfsproxy.transports.scramblesuit.probdist as probdist
+import obfsproxy.transports.scramblesuit.replay as replay
+import obfsproxy.transports.scramblesuit.journal as journal
+import obfsproxy.transports.scramblesuit.sharedstate as sharedstate
+import obfsproxy.transports.scramblesuit.ticketstore as ticketstore
 
 
 # Disable all logging as it would yield plenty of warning and error
@@ -132,6 +147,30 @@ class CryptoTest( unittest.TestCase ):
         self.failUnless(len(mycrypto.HMAC_SHA256_128("x" * \
                         const.SHARED_SECRET_LENGTH, "test")) == 16)
 
+    def test7_HMACContext( self ):
+        # RFC 4231, test case 2, truncated to 128 bits.  The key is padded
+        # to the shortest allowed key, which doesn't change the HMAC.
+        key = "Jefe" + "\0" * (const.SHARED_SECRET_LENGTH - 4)
+        msg = "what do ya want for nothing?"
+        context = mycrypto.HMACContext(key)
+
+        self.assertEqual(context.digest(msg),
+                         "5bdcc146bf60754e6a042426089575c7".decode('hex'))
+        # Contexts can be used many times, and wherever keys are expected.
+        self.assertEqual(context.digest(msg), mycrypto.HMAC_SHA256_128(key, msg))
+        self.assertEqual(mycrypto.HMAC_SHA256_128(context, msg),
+                         mycrypto.HMAC_SHA256_128(key, msg))
+
+        longKey = "K" * 100
+        self.assertEqual(mycrypto.HMACContext(longKey).digest(msg),
+                         mycrypto.HMAC_SHA256_128(longKey, msg))
+
+        # The HMACs of messages with a common prefix.
+        prefix = context.prefix(msg[:10])
+        self.assertEqual(context.finish(prefix, msg[10:]), context.digest(msg))
+        self.assertEqual(context.finish(prefix, "x"),
+                         context.digest(msg[:10] + "x"))
+
 
 class UniformDHTest( unittest.TestCase ):
 
@@ -194,16 +233,44 @@ class UniformDHTest( unittest.TestCase ):
             else:
                 self.assertTrue(udh.extractPublicKey(buf))
 
+    def test5_extractPublicKeyInSegments( self ):
+        sharedSecret = "A" * const.SHARED_SECRET_LENGTH
+        authMsg = uniformdh.new(sharedSecret, False).createHandshake()
+
+        # The handshake is only accepted once its last byte arrived.
+        udh = uniformdh.new(sharedSecret, True)
+        buf = obfs_buf.Buffer()
+        for i in xrange(len(authMsg) - 1):
+            buf.write(authMsg[i])
+            self.assertFalse(udh.extractPublicKey(buf))
+        buf.write(authMsg[-1] + "payload")
+        self.assertEqual(udh.extractPublicKey(buf),
+                         authMsg[:const.PUBLIC_KEY_LENGTH])
+        self.assertEqual(buf.read(), "payload")
+
+        # Data without a mark is given up on once the mark can't follow.
+        udh = uniformdh.new(sharedSecret, True)
+        buf = obfs_buf.Buffer()
+        for i in xrange(0, const.MAX_HANDSHAKE_LENGTH, 100):
+            self.assertFalse(udh.parser.excluded)
+            buf.write("X" * 100)
+            self.assertFalse(udh.extractPublicKey(buf))
+        self.assertTrue(udh.parser.excluded)
+
+        # So is a handshake with an invalid HMAC.
+        udh = uniformdh.new(sharedSecret, True)
+        buf = obfs_buf.Buffer(authMsg[:-1] + chr(ord(authMsg[-1]) ^ 1))
+        self.assertFalse(udh.extractPublicKey(buf))
+        self.assertTrue(udh.parser.excluded)
+
 
 class UtilTest( unittest.TestCase ):
 
     def test1_isValidHMAC( self ):
         self.failIf(util.isValidHMAC("A" * const.HMAC_SHA256_128_LENGTH,
-                                     "B" * const.HMAC_SHA256_128_LENGTH,
-                                     "X" * const.SHA256_LENGTH) == True)
+                                     "B" * const.HMAC_SHA256_128_LENGTH) == True)
         self.failIf(util.isValidHMAC("A" * const.HMAC_SHA256_128_LENGTH,
-                                     "A" * const.HMAC_SHA256_128_LENGTH,
-                                     "X" * const.SHA256_LENGTH) == False)
+                                     "A" * const.HMAC_SHA256_128_LENGTH) == False)
 
     def test2_locateMark( self ):
         self.failIf(util.locateMark("D", "ABC") != None)
@@ -292,6 +359,285 @@ class StateTest( unittest.TestCase ):
 
         __builtin__.open = real_open
 
+class FakeClock( object ):
+    def __init__( self, now ):
+        self.now = now
+
+    def time( self ):
+        return self.now
+
+class ReplayTest( unittest.TestCase ):
+    def setUp( self ):
+        self.clock = FakeClock(1000000)
+        replay.time = self.clock
+
+    def tearDown( self ):
+        replay.time = time
+
+    def test1_Tracker( self ):
+        tracker = replay.Tracker()
+        tracker.addElement("A")
+        self.clock.now += const.REPLAY_BUCKET_LENGTH
+        tracker.addElement("B")
+
+        self.failUnless(tracker.isPresent("A"))
+        self.assertRaises(LookupError, tracker.addElement, "A")
+
+        # "A" expires to the second, even though its bucket is still there.
+        self.clock.now += const.EPOCH_GRANULARITY - const.REPLAY_BUCKET_LENGTH
+        self.failUnless(tracker.isPresent("A"))
+        self.clock.now += 1
+        self.failIf(tracker.isPresent("A"))
+        self.failUnless(tracker.isPresent("B"))
+
+        # Adding "A" again must survive the expiry of its old bucket.
+        tracker.addElement("A")
+        self.clock.now += const.REPLAY_BUCKET_LENGTH
+        self.failUnless(tracker.isPresent("A"))
+        self.failIf(tracker.isPresent("B"))
+        self.failUnless("A" in tracker.table)
+
+    def test2_oldTrackerState( self ):
+        # State files of older versions contain trackers without buckets.
+        tracker = replay.Tracker()
+        del tracker.buckets
+        tracker.table = {"A" : self.clock.now - const.EPOCH_GRANULARITY -
+                               const.REPLAY_BUCKET_LENGTH,
+                         "B" : self.clock.now}
+
+        tracker = cPickle.loads(cPickle.dumps(tracker))
+        self.failIf(tracker.isPresent("A"))
+        self.failUnless(tracker.isPresent("B"))
+        self.assertEqual(tracker.table.keys(), ["B"])
+
+    def test3_BloomTracker( self ):
+        tracker = replay.BloomTracker(1000)
+        for i in xrange(1000):
+            tracker.addElement(str(i))
+        self.assertRaises(LookupError, tracker.addElement, "0")
+
+        # The false positive rate is about one in a million.
+        self.failIf(any([tracker.isPresent(str(-i)) for i in xrange(1, 1000)]))
+
+        # Keys are remembered for one to two epochs.
+        self.clock.now += const.EPOCH_GRANULARITY + 1
+        self.failUnless(tracker.isPresent("0"))
+        tracker.addElement("new")
+        self.clock.now += const.EPOCH_GRANULARITY + 1
+        self.failIf(tracker.isPresent("0"))
+        self.failUnless(tracker.isPresent("new"))
+
+        tracker = cPickle.loads(cPickle.dumps(tracker))
+        self.failUnless(tracker.isPresent("new"))
+
+class JournalTest( twisted.trial.unittest.TestCase ):
+    def setUp( self ):
+        const.STATE_LOCATION = tempfile.mkdtemp()
+        self.journalFile = os.path.join(const.STATE_LOCATION,
+                                        const.REPLAY_JOURNAL_FILE)
+        self.hmacs = [chr(i) * const.HMAC_SHA256_128_LENGTH for i in xrange(3)]
+
+    def tearDown( self ):
+        state._state = None
+        shutil.rmtree(const.STATE_LOCATION)
+
+    @defer.inlineCallbacks
+    def test1_appendAndReplay( self ):
+        replayJournal = journal.ReplayJournal(self.journalFile)
+        replayJournal.append(self.hmacs[0], int(time.time()))
+        replayJournal.append(self.hmacs[1], int(time.time()))
+        yield replayJournal.commit()
+
+        # Expired records and partial records are skipped.
+        replayJournal.append(self.hmacs[2], int(time.time()) -
+                             const.EPOCH_GRANULARITY - 1)
+        yield replayJournal.commit()
+        with open(self.journalFile, "ab") as fd:
+            fd.write("xyz")
+
+        tracker = replay.Tracker()
+        journal.ReplayJournal(self.journalFile).replay(tracker)
+        self.assertEqual(sorted(tracker.table.keys()), self.hmacs[:2])
+
+    @defer.inlineCallbacks
+    def test2_loadStateAndJournal( self ):
+        srvState = state.load()
+        self.assertIs(state.load(), srvState)
+
+        # Registered HMACs go to the journal, not to the state file.
+        srvState.registerKey(self.hmacs[0])
+        yield srvState.journal.commit()
+        self.assertEqual(os.path.getsize(self.journalFile),
+                         journal.RECORD.size)
+
+        state._state = None
+        self.failUnless(state.load().isReplayed(self.hmacs[0]))
+
+        # Compacting writes a new state file and empties the journal.
+        srvState = state.load()
+        srvState.registerKey(self.hmacs[1])
+        yield srvState.writeState()
+        self.assertEqual(os.path.getsize(self.journalFile), 0)
+        self.assertIs(state.load(), srvState)
+
+        state._state = None
+        srvState = state.load()
+        self.failUnless(srvState.isReplayed(self.hmacs[0]))
+        self.failUnless(srvState.isReplayed(self.hmacs[1]))
+
+    @defer.inlineCallbacks
+    def test3_reloadInPlace( self ):
+        srvState = state.load()
+        yield srvState.writeState()
+
+        # Another process writes a new state file, with an HMAC we don't know.
+        with open(srvState.stateFile, "rb") as fd:
+            other = cPickle.load(fd)
+        other.replayTracker.insert(self.hmacs[0], int(time.time()))
+        journal.writeFile(srvState.stateFile, cPickle.dumps(other), False)
+        journal.writeFile(self.journalFile, "", False)
+
+        # The new state is loaded into the state object our connections hold,
+        # without losing the HMAC which waits for the next group commit.
+        srvState.registerKey(self.hmacs[1])
+        self.assertIs(state.load(), srvState)
+        self.failUnless(srvState.isReplayed(self.hmacs[0]))
+        self.failUnless(srvState.isReplayed(self.hmacs[1]))
+        yield srvState.journal.commit()
+
+    @defer.inlineCallbacks
+    def test4_flushDuringSnapshot( self ):
+        replayJournal = journal.ReplayJournal(self.journalFile)
+        stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+
+        # Keep the snapshot in progress until we shut down.
+        shutdown = threading.Event()
+        writeSnapshot = replayJournal.writeSnapshot
+        def slowSnapshot( *args ):
+            shutdown.wait()
+            return writeSnapshot(*args)
+        replayJournal.writeSnapshot = slowSnapshot
+
+        snapshot = replayJournal.snapshot(stateFile, "state")
+        replayJournal.append(self.hmacs[0], int(time.time()))
+        flushed = replayJournal.flush()
+        shutdown.set()
+        yield flushed
+
+        # The record went to the journal started by the snapshot.
+        self.failUnless(snapshot.called)
+        tracker = replay.Tracker()
+        journal.ReplayJournal(self.journalFile).replay(tracker)
+        self.assertEqual(tracker.table.keys(), self.hmacs[:1])
+
+def insertShared( fileName, hmacs, queue ):
+    shared = sharedstate.SharedState(fileName, None)
+    queue.put([hmac for hmac in hmacs if shared.addElement(hmac)])
+    shared.close()
+
+class SharedStateTest( unittest.TestCase ):
+    def setUp( self ):
+        const.STATE_LOCATION = tempfile.mkdtemp()
+        self.sharedFile = os.path.join(const.STATE_LOCATION,
+                                       const.SHARED_STATE_FILE)
+        self.slots = const.SHARED_REPLAY_SLOTS
+        const.SHARED_REPLAY_SLOTS = 1024
+
+        self.srvState = state.State()
+        self.srvState.genState()
+        self.hmacs = [mycrypto.strongRandom(const.HMAC_SHA256_128_LENGTH)
+                      for _ in xrange(200)]
+
+    def tearDown( self ):
+        const.SHARED_REPLAY_SLOTS = self.slots
+        state.setShared(False)
+        state._state = None
+        shutil.rmtree(const.STATE_LOCATION)
+
+    def test1_replayTable( self ):
+        first = sharedstate.SharedState(self.sharedFile, self.srvState)
+        second = sharedstate.SharedState(self.sharedFile, None)
+        self.assertEqual(second.prngSeed, self.srvState.prngSeed)
+
+        self.failUnless(first.addElement(self.hmacs[0]))
+        self.failUnless(second.isPresent(self.hmacs[0]))
+        self.failIf(second.addElement(self.hmacs[0]))
+        self.failIf(first.isPresent(self.hmacs[1]))
+
+        # Expired HMACs make room for new ones.
+        offset = first.slots(self.hmacs[0])[0]
+        sharedstate.SLOT.pack_into(first.mm, offset, self.hmacs[0],
+                int(time.time()) - const.EPOCH_GRANULARITY - 1)
+        self.failIf(second.isPresent(self.hmacs[0]))
+        self.failUnless(second.addElement(self.hmacs[0]))
+
+        first.close()
+        second.close()
+
+        # When all slots of an HMAC are taken, the oldest one is evicted.
+        full = sharedstate.SharedState(self.sharedFile + "-full",
+                                       self.srvState,
+                                       const.SHARED_REPLAY_PROBES)
+        for hmac in self.hmacs[:const.SHARED_REPLAY_PROBES + 1]:
+            self.failUnless(full.addElement(hmac))
+        self.assertEqual([full.isPresent(hmac) for hmac in
+                          self.hmacs[:const.SHARED_REPLAY_PROBES + 1]].count(
+                          False), 1)
+        self.failUnless(full.isPresent(self.hmacs[const.SHARED_REPLAY_PROBES]))
+        full.close()
+
+    def test2_concurrentInserts( self ):
+        sharedstate.SharedState(self.sharedFile, self.srvState).close()
+
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=insertShared,
+                     args=(self.sharedFile, self.hmacs, queue))
+                     for _ in xrange(4)]
+        for process in processes:
+            process.start()
+        inserted = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        # Every HMAC was added by exactly one of the processes.
+        self.assertEqual(sorted(sum(inserted, [])), sorted(self.hmacs))
+
+    def test3_sharedKeys( self ):
+        srvState = state.load()
+        self.failUnless(srvState.shared is None)
+
+        # A state which was loaded before the state was shared is shared, too.
+        state.setShared(True)
+        self.assertIs(state.load(), srvState)
+        self.failIf(srvState.shared is None)
+
+        # Another process with a different state adopts the shared one.
+        other = state.State()
+        other.genState()
+        other.openSharedState()
+        self.assertEqual(other.prngSeed, srvState.prngSeed)
+        self.assertEqual(other.closingThreshold, srvState.closingThreshold)
+        self.assertEqual(other.aesKey, srvState.aesKey)
+
+        self.failUnless(srvState.registerKey(self.hmacs[0]))
+        self.failIf(other.registerKey(self.hmacs[0]))
+        self.failUnless(other.isReplayed(self.hmacs[0]))
+
+        # Keys are rotated once, and the other process picks up the new keys.
+        srvState.keyCreation -= const.KEY_ROTATION_TIME + 1
+        srvState.shared.writeHeader(srvState.shared.salt,
+                srvState.shared.nSlots, srvState.keyCreation, srvState.aesKey,
+                srvState.hmacKey, None, None, srvState.prngSeed)
+        aesKey = srvState.aesKey
+        ticket.checkKeys(srvState)
+        self.assertEqual(srvState.oldAesKey, aesKey)
+        self.assertNotEqual(srvState.aesKey, aesKey)
+
+        ticket.checkKeys(other)
+        self.assertEqual(other.aesKey, srvState.aesKey)
+        self.assertEqual(other.oldAesKey, aesKey)
+        self.assertEqual(other.keyCreation, srvState.keyCreation)
+
 class MockArgs( object ):
     uniformDHSecret = sharedSecret = ext_cookie_file = dest = None
     mode = 'socks'
@@ -346,10 +692,215 @@ class ScrambleSuitTransportTest( unittest.TestCase ):
         options = scramblesuit.ScrambleSuitTransport.get_public_server_options("")
         self.failUnless("password" in options)
 
-        d = { "password": "3X5BIA2MIHLZ55UV4VAEGKZIQPPZ4QT3" }
+        d = { "password": "3X5BIA2MIHLZ55UV4VAEGKZIQPPZ4QT3",
+              "iat-mode": "adaptive" }
         options = scramblesuit.ScrambleSuitTransport.get_public_server_options(d)
         self.failUnless("password" in options)
         self.failUnless(options["password"] == "3X5BIA2MIHLZ55UV4VAEGKZIQPPZ4QT3")
+        self.failIf("iat-mode" in options)
+
+    def test4_iatOptions( self ):
+        self.assertEqual(util.parseIATOptions({}, "off", 1), ("off", 1))
+        self.assertEqual(util.parseIATOptions({"iat-mode": "adaptive",
+                                               "iat-min-rate": "2048"},
+                                              "off", 1), ("adaptive", 2048))
+        for options in ({"iat-mode": "fast"}, {"iat-min-rate": "x"},
+                        {"iat-min-rate": "0"}):
+            self.assertRaises(ValueError, util.parseIATOptions, options,
+                              "off", 1)
+
+        self.args.uniformDHSecret = self.validSecret
+        self.args.iatMode = "adaptive"
+        self.args.iatMinRate = 4096
+        try:
+            self.suit.validate_external_mode_cli(self.args)
+            self.assertEqual(self.suit.iatMode, "adaptive")
+            self.assertEqual(self.suit.iatMinRate, 4096)
+        finally:
+            self.suit.iatMode = const.IAT_MODE
+            self.suit.iatMinRate = const.IAT_MIN_RATE
+
+    def test6_paddingBudget( self ):
+        self.assertEqual(util.parsePaddingBudget({}, None), None)
+        self.assertEqual(util.parsePaddingBudget({"padding-budget": "0.25"},
+                                                 None), 0.25)
+        self.assertEqual(util.parsePaddingBudget({"padding-budget": "off"},
+                                                 0.25), None)
+        for value in ("x", "-1", "nan"):
+            self.assertRaises(ValueError, util.parsePaddingBudget,
+                              {"padding-budget": value}, None)
+
+        ss = self.suit()
+        ss.handle_socks_args(["password=" + self.validSecret,
+                              "padding-budget=0.5"])
+        self.assertEqual(ss.pktMorpher.budget.fraction, 0.5)
+        self.assertRaises(base.SOCKSArgsError, ss.handle_socks_args,
+                          ["password=" + self.validSecret,
+                           "padding-budget=lots"])
+
+    def test5_handleSocksArgs( self ):
+        ss = self.suit()
+        ss.handle_socks_args(["password=" + self.validSecret,
+                              "iat-mode=full"])
+        self.assertEqual(ss.uniformDHSecret, "A" * const.SHARED_SECRET_LENGTH)
+        self.assertEqual(ss.iatMode, "full")
+        self.assertEqual(self.suit.iatMode, const.IAT_MODE)
+
+        for args in (["iat-mode=full"],
+                     ["password=" + self.validSecret, "iat-mode=fast"],
+                     ["password=" + self.validSecret, "colour=blue"]):
+            self.assertRaises(base.SOCKSArgsError, ss.handle_socks_args, args)
+
+class FakeDownstream( object ):
+    def __init__( self ):
+        self.data = []
+
+    def write( self, data ):
+        self.data.append(data)
+
+    def writeSequence( self, data ):
+        self.data.append("".join(data))
+
+class FakeCircuit( object ):
+    def __init__( self ):
+        self.downstream = FakeDownstream()
+
+class IATTest( unittest.TestCase ):
+    def setUp( self ):
+        self.clock = task.Clock()
+        self.reactor = scramblesuit.reactor
+        scramblesuit.reactor = self.clock
+        self.wheel = timerwheel.wheel
+        timerwheel.wheel = timerwheel.TimerWheel(self.clock)
+
+        masterKey = "M" * const.MASTER_KEY_LENGTH
+        suit = scramblesuit.ScrambleSuitTransport
+        suit.weAreServer, suit.weAreClient, suit.weAreExternal = \
+            False, True, False
+        self.sender = scramblesuit.ScrambleSuitTransport()
+        self.sender.circuit = FakeCircuit()
+        self.sender.deriveSecrets(masterKey)
+
+        self.receiver = scramblesuit.ScrambleSuitTransport()
+        self.receiver.weAreServer = True
+        self.receiver.deriveSecrets(masterKey)
+
+    def tearDown( self ):
+        scramblesuit.reactor = self.reactor
+        timerwheel.wheel = self.wheel
+
+    def send( self, data ):
+        self.sender.sendRemote(data)
+        while self.clock.getDelayedCalls():
+            self.clock.advance(const.MAX_PACKET_DELAY)
+
+        writes = self.sender.circuit.downstream.data
+        msgs = self.receiver.protoMsg.extract("".join(writes),
+                                              self.receiver.recvCrypter,
+                                              self.receiver.recvHMAC)
+        self.assertEqual("".join([msg.payload for msg in msgs
+                                  if msg.flags == const.FLAG_PAYLOAD]), data)
+
+        return writes
+
+    def test1_full( self ):
+        self.sender.iatMode = const.IAT_MODE_FULL
+        writes = self.send("X" * 100000)
+
+        # Every write but the last one is one MTU.
+        self.assertEqual(set(map(len, writes[:-1])), set([const.MTU]))
+
+    def test2_adaptive( self ):
+        self.sender.iatMode = const.IAT_MODE_ADAPTIVE
+        self.sender.iatMinRate = const.MTU * 1000
+
+        # At a high minimum rate, writes are larger and hence fewer.
+        writes = self.send("X" * 100000)
+        self.failUnless(len(writes) < (100000 / const.MTU) / 2)
+
+    def test3_backlog( self ):
+        self.sender.iatMode = const.IAT_MODE_ADAPTIVE
+        self.sender.iatMinRate = 1
+
+        # Only `IAT_MAX_BACKLOG' bytes are sent in MTU-sized chunks.
+        writes = self.send("X" * (const.IAT_MAX_BACKLOG * 2))
+        self.failUnless(len(writes[0]) >= const.IAT_MAX_BACKLOG)
+        self.assertEqual(set(map(len, writes[1:-1])), set([const.MTU]))
+
+    def test4_circuitDestroyed( self ):
+        self.sender.iatMode = const.IAT_MODE_FULL
+        self.sender.sendRemote("X" * 10000)
+        self.clock.advance(const.MAX_PACKET_DELAY)
+        self.failUnless(self.sender.flushCall.active())
+
+        # The pending flush is cancelled along with the circuit.
+        self.sender.circuitDestroyed(None, None)
+        self.assertEqual(self.sender.flushCall, None)
+        self.assertEqual(timerwheel.wheel.pending, 0)
+
+class FakeUniformDH( object ):
+    def __init__( self, deferred ):
+        self.deferred = deferred
+
+    def extractPublicKey( self, data, srvState=None ):
+        return "K" * const.PUBLIC_KEY_LENGTH
+
+    def computeMasterKey( self, remotePublicKey ):
+        return self.deferred
+
+class KeyExchangeCircuit( FakeCircuit ):
+    def __init__( self ):
+        FakeCircuit.__init__(self)
+        self.closed = False
+        self.completed = False
+
+    def handshakeCompleted( self ):
+        self.completed = True
+
+    def close( self ):
+        self.closed = True
+
+class KeyExchangeTest( twisted.trial.unittest.TestCase ):
+    def setUp( self ):
+        suit = scramblesuit.ScrambleSuitTransport
+        suit.weAreServer, suit.weAreClient, suit.weAreExternal = \
+            False, True, False
+        self.client = scramblesuit.ScrambleSuitTransport()
+        self.client.circuit = KeyExchangeCircuit()
+        self.deferred = defer.Deferred()
+        self.client.uniformdh = FakeUniformDH(self.deferred)
+
+    def startKeyExchange( self, data="" ):
+        buf = obfs_buf.Buffer()
+        buf.write(data)
+        self.failUnless(self.client.startKeyExchange(buf))
+        self.assertEqual(self.client.protoState, const.ST_WAIT_FOR_DH)
+
+    def test1_success( self ):
+        self.startKeyExchange()
+        self.deferred.callback("M" * const.MASTER_KEY_LENGTH)
+        self.assertEqual(self.client.protoState, const.ST_CONNECTED)
+        self.failUnless(self.client.circuit.completed)
+        self.failIf(self.client.circuit.closed)
+
+    def test2_badHMAC( self ):
+        masterKey = "M" * const.MASTER_KEY_LENGTH
+        server = scramblesuit.ScrambleSuitTransport()
+        server.weAreServer = True
+        server.deriveSecrets(masterKey)
+        data = message.ProtocolMessage("A" * 100).encryptAndHMAC(
+                   server.sendCrypter, server.sendHMAC)
+
+        # The data which arrived during the key exchange is forged.
+        self.startKeyExchange(data[:50] + chr(ord(data[50]) ^ 1) + data[51:])
+        self.deferred.callback(masterKey)
+        self.failUnless(self.client.circuit.closed)
+
+    def test3_executorFailure( self ):
+        self.startKeyExchange()
+        self.deferred.errback(RuntimeError("worker died"))
+        self.failUnless(self.client.circuit.closed)
+        self.failIf(self.client.circuit.completed)
 
 class MessageTest( unittest.TestCase ):
 
@@ -389,6 +940,89 @@ class MessageTest( unittest.TestCase ):
         self.assertRaises(base.PluggableTransportError,
                           message.ProtocolMessage, "1", paddingLen=const.MPU)
 
+    def _extractorSetup( self ):
+        sessionKey, iv = os.urandom(32), os.urandom(8)
+        hmacKey = os.urandom(const.SHARED_SECRET_LENGTH)
+
+        self.sendCrypter = mycrypto.PayloadCrypter()
+        self.sendCrypter.setSessionKey(sessionKey, iv)
+        self.recvCrypter = mycrypto.PayloadCrypter()
+        self.recvCrypter.setSessionKey(sessionKey, iv)
+        self.sendHMAC = mycrypto.HMACContext(hmacKey)
+        self.recvHMAC = mycrypto.HMACContext(hmacKey)
+
+    def test5_MessageExtractor( self ):
+        self._extractorSetup()
+
+        # Messages of all sizes, with and without padding.
+        sent = [message.ProtocolMessage("A" * 100),
+                message.ProtocolMessage("", paddingLen=20,
+                                        flags=const.FLAG_NEW_TICKET),
+                message.ProtocolMessage("B" * const.MPU),
+                message.ProtocolMessage("C" * 10, paddingLen=500),
+                message.ProtocolMessage("")]
+        wire = "".join([msg.encryptAndHMAC(self.sendCrypter, self.sendHMAC)
+                        for msg in sent])
+
+        # Cut the stream into chunks of many sizes, including chunks which
+        # end in the middle of headers and which hold many messages.
+        extractor = message.MessageExtractor()
+        received = []
+        offset = 0
+        for size in [1, 7, 20, 150, 3, 2000] * 10:
+            received += extractor.extract(wire[offset:offset + size],
+                                          self.recvCrypter, self.recvHMAC)
+            offset += size
+
+        self.assertEqual(offset > len(wire), True)
+        self.assertEqual(len(extractor.recvBuf), 0)
+        self.assertEqual([(msg.payload, msg.flags) for msg in received],
+                         [(msg.payload, msg.flags) for msg in sent])
+
+        # Raw keys work as well.
+        self._extractorSetup()
+        msg = message.ProtocolMessage("D" * 20)
+        data = msg.encryptAndHMAC(self.sendCrypter, self.sendHMAC.key)
+        received = message.MessageExtractor().extract(data, self.recvCrypter,
+                                                      self.recvHMAC.key)
+        self.assertEqual(received[0].payload, "D" * 20)
+
+    def test6_MessageExtractorInvalid( self ):
+        self._extractorSetup()
+        data = message.ProtocolMessage("A" * 100).encryptAndHMAC(
+                   self.sendCrypter, self.sendHMAC)
+
+        # Flip a bit of the encrypted payload.
+        forged = data[:50] + chr(ord(data[50]) ^ 1) + data[51:]
+        self.assertRaises(base.PluggableTransportError,
+                          message.MessageExtractor().extract, forged,
+                          self.recvCrypter, self.recvHMAC)
+
+        # A header which claims an overly long message.
+        self._extractorSetup()
+        self.assertRaises(base.PluggableTransportError,
+                          message.MessageExtractor().extract, "\xff" * 100,
+                          self.recvCrypter, self.recvHMAC)
+
+    def test7_encryptFrames( self ):
+        self._extractorSetup()
+        frameCrypter, frameHMAC = self.recvCrypter, self.recvHMAC
+
+        for dataLen in (0, 1, const.MPU, const.MPU + 1, 3 * const.MPU + 17):
+            data = os.urandom(dataLen)
+            frames = message.createFrames(data, flags=const.FLAG_NEW_TICKET)
+            frames.append(message.createPaddingFrame(100))
+            messages = message.createProtocolMessages(data,
+                                                      flags=const.FLAG_NEW_TICKET)
+            messages.append(message.new("", paddingLen=100))
+
+            self.assertEqual(len(frames), len(messages))
+            self.assertEqual("".join(message.encryptFrames(frameCrypter,
+                                                           frameHMAC, frames)),
+                             "".join([msg.encryptAndHMAC(self.sendCrypter,
+                                                         self.sendHMAC)
+                                      for msg in messages]))
+
 class TicketTest( unittest.TestCase ):
     def setUp( self ):
         const.STATE_LOCATION = tempfile.mkdtemp()
@@ -430,6 +1064,129 @@ class TicketTest( unittest.TestCase ):
             else:
                 self.assertTrue(ss.receiveTicket(buf))
 
+    def test2_extraTickets( self ):
+        ss = scramblesuit.ScrambleSuitTransport()
+        ss.srvState = self.state
+        sent = []
+        ss.sendRemote = lambda data, flags: sent.append((data, flags))
+
+        # Servers issue no more than `MAX_EXTRA_TICKETS' extra tickets.
+        ss.sendExtraTickets(3)
+        ss.sendExtraTickets(100)
+        ss.sendExtraTickets(1)
+        self.assertEqual(len(sent), const.MAX_EXTRA_TICKETS)
+        for data, flags in sent:
+            self.assertEqual(flags, const.FLAG_NEW_TICKET)
+            self.assertEqual(len(data), const.MASTER_KEY_LENGTH +
+                                        const.TICKET_LENGTH)
+
+class TicketStoreTest( twisted.trial.unittest.TestCase ):
+    def setUp( self ):
+        const.STATE_LOCATION = tempfile.mkdtemp() + "/"
+        self.ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_STORE_FILE
+        self.masterKey = "M" * const.MASTER_KEY_LENGTH
+        self.ticket = "T" * const.TICKET_LENGTH
+
+    def tearDown( self ):
+        ticketstore._store = None
+        shutil.rmtree(const.STATE_LOCATION)
+
+    def test1_packAndUnpack( self ):
+        tickets = {"127.0.0.1:1234": [(1, self.masterKey, self.ticket),
+                                      (3, self.masterKey, self.ticket)],
+                   "": [(2, self.masterKey, self.ticket)]}
+        self.assertEqual(ticketstore.unpack(ticketstore.pack(tickets)),
+                         tickets)
+        self.assertRaises(ValueError, ticketstore.unpack, "garbage")
+        self.assertRaises(ValueError, ticketstore.unpack,
+                          ticketstore.pack(tickets)[:-1])
+
+    def test2_storeAndFind( self ):
+        ticket.storeNewTicket(self.masterKey, self.ticket, "bridge1")
+        ticket.storeNewTicket(self.masterKey, self.ticket, "bridge2")
+        store = ticketstore.get()
+        self.assertIs(ticketstore.get(), store)
+
+        # A new process finds the tickets in the file, and each only once.
+        ticketstore._store = None
+        self.assertEqual(ticket.findStoredTicket("bridge1"),
+                         (self.masterKey, self.ticket))
+        self.assertEqual(ticket.findStoredTicket("bridge1"), None)
+
+        ticketstore._store = None
+        self.assertEqual(ticket.findStoredTicket("bridge1"), None)
+        self.assertEqual(ticket.findStoredTicket("bridge2"),
+                         (self.masterKey, self.ticket))
+
+    def test3_expiredAndReplaced( self ):
+        store = ticketstore.get()
+        store.add("bridge", int(time.time()) -
+                  const.SESSION_TICKET_LIFETIME - 1, self.masterKey,
+                  self.ticket)
+        self.assertEqual(ticket.findStoredTicket("bridge"), None)
+
+        # The file was replaced by another process.
+        time.sleep(0.01)
+        with open(self.ticketFile, "wb") as fd:
+            fd.write(ticketstore.pack({"other": [(int(time.time()),
+                                       self.masterKey, self.ticket)]}))
+        self.assertEqual(ticket.findStoredTicket("other"),
+                         (self.masterKey, self.ticket))
+
+    def test4_importYAML( self ):
+        with open(const.STATE_LOCATION + const.CLIENT_TICKET_FILE, "w") as fd:
+            fd.write(yaml.dump({"bridge": [int(time.time()), self.masterKey,
+                                           self.ticket]}))
+        self.assertEqual(ticket.findStoredTicket("bridge"),
+                         (self.masterKey, self.ticket))
+
+    def test5_ticketPool( self ):
+        lookups = dict(ticketstore.lookups)
+        masterKeys = [chr(i) * const.MASTER_KEY_LENGTH
+                      for i in xrange(const.TICKET_POOL_SIZE + 2)]
+        for masterKey in masterKeys:
+            ticket.storeNewTicket(masterKey, self.ticket, "bridge")
+        self.assertEqual(ticket.countStoredTickets("bridge"),
+                         const.TICKET_POOL_SIZE)
+
+        # Connections redeem the newest tickets, each a different one.
+        store = ticketstore.get()
+        store.tickets["bridge"].insert(0, (int(time.time()) -
+                                       const.SESSION_TICKET_LIFETIME - 1,
+                                       self.masterKey, self.ticket))
+        redeemed = [ticket.findStoredTicket("bridge")[0]
+                    for _ in xrange(const.TICKET_POOL_SIZE)]
+        self.assertEqual(redeemed, masterKeys[:1:-1])
+        self.assertEqual(ticket.findStoredTicket("bridge"), None)
+        self.assertEqual(ticket.findStoredTicket("bridge"), None)
+
+        self.assertEqual(ticketstore.lookups["hit"] - lookups["hit"],
+                         const.TICKET_POOL_SIZE)
+        self.assertEqual(ticketstore.lookups["expired"] -
+                         lookups["expired"], 1)
+        self.assertEqual(ticketstore.lookups["miss"] - lookups["miss"], 1)
+
+    def test6_sharedByProcesses( self ):
+        masterKeys = [chr(i) * const.MASTER_KEY_LENGTH for i in xrange(3)]
+        first = ticketstore.TicketStore(self.ticketFile)
+        first.load()
+        for masterKey in masterKeys[:2]:
+            first.add("bridge", int(time.time()), masterKey, self.ticket)
+
+        # Two processes which loaded the same tickets never redeem the same
+        # ticket, and neither puts back one the other redeemed.
+        second = ticketstore.TicketStore(self.ticketFile)
+        second.load()
+        self.assertEqual(first.pop("bridge")[1], masterKeys[1])
+        self.assertEqual(second.pop("bridge")[1], masterKeys[0])
+        first.add("bridge", int(time.time()), masterKeys[2], self.ticket)
+        self.assertEqual(second.pop("bridge")[1], masterKeys[2])
+        self.assertEqual(first.pop("bridge"), None)
+
+        third = ticketstore.TicketStore(self.ticketFile)
+        third.load()
+        self.assertEqual(third.tickets, {})
+
 class PacketMorpher( unittest.TestCase ):
 
     def test1_calcPadding( self ):
@@ -463,6 +1220,51 @@ class PacketMorpher( unittest.TestCase ):
             self.assertTrue(const.HDR_LENGTH <= padLen < const.MTU + \
                             const.HDR_LENGTH)
 
+    def test3_paddingBudget( self ):
+        # Tor cells need 814 bytes of padding to become 1400-byte packets
+        # but only 34 bytes to become 620-byte packets.
+        dist = probdist.new(lambda: 0)
+        dist.sampleList = [(0.9, 1400), (1.0, 620)]
+
+        pm = packetmorpher.new(dist, packetmorpher.PaddingBudget(0.1))
+        lengths = set()
+        for _ in xrange(1000):
+            lengths.add((586 + pm.calcPadding(586)) % const.MTU)
+
+        # The packets keep the distribution's lengths, but the padding stays
+        # within the budget.
+        self.assertEqual(lengths, set([1400, 620]))
+        self.assertTrue(pm.budget.overhead() <= 0.1)
+        self.assertTrue(pm.budget.cappedBursts > 0)
+        self.assertEqual(pm.budget.getStats()["padded_bytes"], 1000 * 586)
+
+        # If no length is cheap enough, the cheapest one is used.
+        pm = packetmorpher.new(dist, packetmorpher.PaddingBudget(0))
+        for _ in xrange(10):
+            self.assertEqual(pm.calcPadding(586), 34)
+
+        # Without a budget, padding is only counted.
+        pm = packetmorpher.new(dist)
+        for _ in xrange(1000):
+            pm.calcPadding(586)
+        self.assertEqual(pm.budget.cappedBursts, 0)
+        self.assertTrue(pm.budget.overhead() > 1)
+
+class ProbDistTest( unittest.TestCase ):
+
+    def test1_seededDistributions( self ):
+        seed = "A" * const.PRNG_SEED_LENGTH
+        pktDist, iatDist = probdist.seededDistributions(seed)
+        self.assertIs(probdist.seededDistributions(seed)[0], pktDist)
+
+        prng = random.Random(seed)
+        self.assertEqual(pktDist.sampleList, probdist.new(lambda:
+                         prng.randint(const.HDR_LENGTH, const.MTU),
+                         seed=seed).sampleList)
+        self.assertEqual(iatDist.sampleList, probdist.new(lambda:
+                         prng.random() % const.MAX_PACKET_DELAY,
+                         seed=seed).sampleList)
+
 
 if __name__ == '__main__':
     unittest.main()
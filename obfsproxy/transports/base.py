@@ -31,8 +31,14 @@ class BaseTransport(object):
 
     Attributes:
     circuit: Circuit object. This is set just before circuitConnected is called.
+    has_handshake: Set to True by transports that do a handshake. They
+                   must call circuit.handshakeCompleted() when it's done.
+                   Circuits of the other transports are ready to carry
+                   data as soon as they are connected.
     """
 
+    has_handshake = False
+
     def __init__(self):
         """
         Initialize transport. This is called right after TCP connect.
@@ -105,6 +111,16 @@ class BaseTransport(object):
         'data' is an obfsproxy.network.buffer.Buffer.
         """
 
+    def upstreamBacklog(self):
+        """
+        Return the number of bytes received from upstream that we are
+        holding back (for example, until our handshake is done).
+
+        The circuit uses this to stop reading from upstream when we
+        are holding back too much.
+        """
+        return 0
+
     def handle_socks_args(self, args):
         """
         'args' is a list of k=v strings that serve as configuration
@@ -51,6 +51,8 @@ class Obfs2Transport(base.BaseTransport):
     Obfs2Transport implements the obfs2 protocol.
     """
 
+    has_handshake = True
+
     def __init__(self):
         """Initialize the obfs2 pluggable transport."""
         super(Obfs2Transport, self).__init__()
@@ -183,7 +185,7 @@ class Obfs2Transport(base.BaseTransport):
             self.pending_data_to_send = True
             return
 
-        log.debug("obfs2 receivedUpstream: Transmitting %d bytes.", len(data))
+        log.debug_packet("obfs2 receivedUpstream: Transmitting %d bytes.", len(data))
         # Encrypt and proxy them.
         self.circuit.downstream.write(self.send_crypto.crypt(data.read()))
 
@@ -239,9 +241,12 @@ class Obfs2Transport(base.BaseTransport):
             log.debug("%s: Consumed %d bytes of padding, %d still to come (%d).",
                       log_prefix, n_to_drain, self.padding_left_to_read, len(data))
 
-        self.state = ST_OPEN
-        log.debug("%s: Processing %d bytes of application data.",
-                  log_prefix, len(data))
+        if self.state != ST_OPEN:
+            self.state = ST_OPEN
+            self.circuit.handshakeCompleted()
+
+        log.debug_packet("%s: Processing %d bytes of application data.",
+                         log_prefix, len(data))
 
         if self.pending_data_to_send:
             log.debug("%s: We got pending data to send and our crypto is ready. Pushing!" % log_prefix)
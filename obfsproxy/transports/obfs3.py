@@ -13,8 +13,8 @@ import obfsproxy.transports.obfs3_dh as obfs3_dh
 import obfsproxy.common.log as logging
 import obfsproxy.common.hmac_sha256 as hmac_sha256
 import obfsproxy.common.rand as rand
-
-from twisted.internet import threads
+import obfsproxy.common.executor as executor
+import obfsproxy.network.workers as workers
 
 log = logging.get_obfslogger()
 
@@ -34,6 +34,8 @@ class Obfs3Transport(base.BaseTransport):
     Obfs3Transport implements the obfs3 protocol.
     """
 
+    has_handshake = True
+
     def __init__(self):
         """Initialize the obfs3 pluggable transport."""
         super(Obfs3Transport, self).__init__()
@@ -42,7 +44,7 @@ class Obfs3Transport(base.BaseTransport):
         self.state = ST_WAIT_FOR_KEY
 
         # Uniform-DH object
-        self.dh = obfs3_dh.UniformDH()
+        self.dh = obfs3_dh.pool.get()
 
         # DH shared secret
         self.shared_secret = None
@@ -71,6 +73,17 @@ class Obfs3Transport(base.BaseTransport):
         self.recv_magic_const = None
         self.we_are_initiator = None
 
+    @classmethod
+    def setup(cls, pt_config):
+        """
+        Start the handshake executor that computes our UniformDH
+        handshakes, and have keypairs ready before the first connection.
+        """
+        # The supervisor of worker processes doesn't do handshakes.
+        if not workers.pool.isSupervisor():
+            executor.executor.start()
+            obfs3_dh.pool.refill()
+
     def circuitConnected(self):
         """
         Do the obfs3 handshake:
@@ -96,11 +109,17 @@ class Obfs3Transport(base.BaseTransport):
             return
 
         message = self.send_crypto.crypt(data.read())
-        log.debug("obfs3 receivedUpstream: Transmitting %d bytes.", len(message))
+        log.debug_packet("obfs3 receivedUpstream: Transmitting %d bytes.", len(message))
 
         # Proxy encrypted message.
         self.circuit.downstream.write(message)
 
+    def upstreamBacklog(self):
+        """
+        Upstream data is queued until the handshake is done.
+        """
+        return len(self.queued_data)
+
     def receivedDownstream(self, data):
         """
         Got data from downstream. We need to de-obfuscate them and
@@ -117,8 +136,8 @@ class Obfs3Transport(base.BaseTransport):
             self._scan_for_magic(data)
 
         if self.state == ST_OPEN: # Handshake is done. Just decrypt and read application data.
-            log.debug("obfs3 receivedDownstream: Processing %d bytes of application data." %
-                      len(data))
+            log.debug_packet("obfs3 receivedDownstream: Processing %d bytes of application data.",
+                             len(data))
             self.circuit.upstream.write(self.recv_crypto.crypt(data.read()))
 
     def _read_handshake(self, data):
@@ -139,7 +158,7 @@ class Obfs3Transport(base.BaseTransport):
         other_pubkey = data.read(PUBKEY_LEN)
 
         # Do the UniformDH handshake asynchronously
-        self.d = threads.deferToThread(self.dh.get_secret, other_pubkey)
+        self.d = self.dh.get_secret_deferred(other_pubkey)
         self.d.addCallback(self._read_handshake_post_dh, other_pubkey, data)
         self.d.addErrback(self._uniform_dh_errback, other_pubkey)
 
@@ -152,8 +171,11 @@ class Obfs3Transport(base.BaseTransport):
         """
 
         self.circuit.close()
-        e = failure.trap(ValueError)
-        log.warning("obfs3: Corrupted public key '%s'" % repr(other_pubkey))
+        e = failure.trap(ValueError, executor.HandshakeBacklogFull)
+        if e is executor.HandshakeBacklogFull:
+            log.info("obfs3: Refusing handshake (%s)" % failure.getErrorMessage())
+        else:
+            log.warning("obfs3: Corrupted public key '%s'" % repr(other_pubkey))
 
     def _read_handshake_post_dh(self, shared_secret, other_pubkey, data):
         """
@@ -212,6 +234,7 @@ class Obfs3Transport(base.BaseTransport):
         data.drain(index)
 
         self.state = ST_OPEN
+        self.circuit.handshakeCompleted()
         if len(data) > 0:
             log.debug("%s: Processing %d bytes of application data remaining after magic." % (log_prefix, len(data)))
             self.circuit.upstream.write(self.recv_crypto.crypt(data.read()))
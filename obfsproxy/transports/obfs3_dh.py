@@ -1,11 +1,51 @@
 import binascii
+import collections
+import time
+
+from twisted.internet import defer, reactor, threads
 
 import obfsproxy.common.rand as rand
 import obfsproxy.common.modexp as modexp
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.executor as executor
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# How many UniformDH keypairs obfsproxy generates ahead of time by
+# default (see KeypairPool).
+DEFAULT_POOL_SIZE = 16
+# The keypair pool is only refilled after no keypair was asked for
+# during this many seconds.
+REFILL_DELAY = 0.05
+
+# Maps byte widths to the format string and the mask int_to_bytes() uses.
+_int_formats = {}
 
 def int_to_bytes(lvalue, width):
-    fmt = '%%.%dx' % (2*width)
-    return binascii.unhexlify(fmt % (lvalue & ((1L<<8*width)-1)))
+    try:
+        fmt, mask = _int_formats[width]
+    except KeyError:
+        fmt, mask = _int_formats[width] = ('%%0%dx' % (2*width), (1L<<8*width)-1)
+    return binascii.unhexlify(fmt % (lvalue & mask))
+
+def bytes_to_int(bytes_):
+    return long(binascii.hexlify(bytes_), 16)
+
+# Fixed-base exponentiation table of the UniformDH generator. Built the
+# first time a keypair is generated, see get_generator_table().
+_generator_table = None
+
+def get_generator_table():
+    """
+    Return the modexp.FixedBase table that computes UniformDH public
+    keys. Building it takes a fraction of a second, so it's only done
+    once per process.
+    """
+    global _generator_table
+    if _generator_table is None:
+        _generator_table = modexp.FixedBase(UniformDH.g, UniformDH.mod, 8*UniformDH.group_len)
+    return _generator_table
 
 class UniformDH:
     """
@@ -50,7 +90,7 @@ class UniformDH:
             self.priv_str = private_key
         else:
             self.priv_str = rand.random_bytes(self.group_len)
-        self.priv = int(binascii.hexlify(self.priv_str), 16)
+        self.priv = bytes_to_int(self.priv_str)
 
         # Make the private key even
         flip = self.priv % 2
@@ -60,7 +100,7 @@ class UniformDH:
         #
         # Note: Always generate both valid public keys, and then pick to avoid
         # leaking timing information about which key was chosen.
-        pub = modexp.powMod(self.g, self.priv, self.mod)
+        pub = get_generator_table().powMod(self.priv)
         pub_p_sub_X = self.mod - pub
         if flip == 1:
             self.pub = pub_p_sub_X
@@ -81,8 +121,173 @@ class UniformDH:
         This might raise a ValueError since 'their_pub_str' is
         attacker controlled.
         """
-        their_pub = int(binascii.hexlify(their_pub_str), 16)
+        their_pub = bytes_to_int(their_pub_str)
 
         self.shared_secret = modexp.powMod(their_pub, self.priv, self.mod)
         return int_to_bytes(self.shared_secret, self.group_len)
 
+    def get_secret_deferred(self, their_pub_str):
+        """
+        Like get_secret(), but computed by the handshake executor.
+        Return a Deferred that fires with the shared secret.
+
+        The Deferred fails with ValueError if 'their_pub_str' was
+        corrupted, or with executor.HandshakeBacklogFull if we are
+        already busy with too many handshakes.
+        """
+        return executor.executor.submit(compute_secret, self.priv, their_pub_str)
+
+def compute_secret(priv, their_pub_str):
+    """
+    Return the shared secret of the private key 'priv' (an integer)
+    and the public key 'their_pub_str' (a string of bytes).
+
+    This is UniformDH.get_secret() as a module-level function, so that
+    it can run in the processes of the handshake executor.
+    """
+    their_pub = bytes_to_int(their_pub_str)
+    return int_to_bytes(modexp.powMod(their_pub, priv, UniformDH.mod), UniformDH.group_len)
+
+
+class KeypairPool(object):
+    """
+    A pool of UniformDH objects with freshly generated keypairs.
+
+    Generating a keypair costs a 1536-bit modular exponentiation. The
+    pool does that in a background thread while we are idle, so that a
+    new connection can start its handshake right away instead of
+    blocking the event loop. When the pool runs dry, keypairs are
+    generated inline like before.
+
+    Keypairs are generated by the processes of the handshake executor
+    if it runs any, or by a thread. Either way they compete with the
+    handshakes in progress for CPU time (and a thread for the GIL), so
+    the pool is only refilled when no keypair was asked for during the
+    last REFILL_DELAY seconds, one keypair at a time.
+
+    Every keypair in the pool is handed out exactly once.
+
+    Attributes:
+    size: How many keypairs we try to keep around. 0 disables the pool.
+    keypairs: The UniformDH objects waiting to be used.
+    hits: Keypairs handed out from the pool.
+    misses: Keypairs that had to be generated inline.
+    generated: Keypairs generated by the background thread.
+    generate_seconds: Time the background thread spent generating them.
+    last_get: When a keypair was last asked for.
+    refilling: A Deferred that fires when the pool is full again, or
+               None if we are not refilling it.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.keypairs = collections.deque()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generate_seconds = 0.0
+        self.last_get = 0
+        self.refilling = None
+
+    def set_size(self, size):
+        """
+        Keep up to 'size' keypairs around. Raises ValueError if 'size'
+        is negative.
+        """
+        if size < 0:
+            raise ValueError("The keypair pool can't have %d keypairs." % size)
+
+        self.size = size
+        while len(self.keypairs) > size:
+            self.keypairs.pop()
+
+    def get(self):
+        """Return a UniformDH object with a fresh keypair."""
+        try:
+            dh = self.keypairs.popleft()
+            self.hits += 1
+        except IndexError:
+            dh = UniformDH()
+            self.misses += 1
+
+        self.last_get = reactor.seconds()
+        self.refill()
+        return dh
+
+    def refill(self):
+        """
+        Start topping up the pool, unless it's full or already being
+        topped up. Return a Deferred that fires when the pool is full,
+        or None if there is nothing to do.
+        """
+        if self.refilling or len(self.keypairs) >= self.size:
+            return None
+
+        self.refilling = defer.Deferred()
+        self._refill_next()
+        return self.refilling
+
+    def _refill_next(self, _=None):
+        """Generate the next keypair of the pool once we are idle."""
+        if len(self.keypairs) >= self.size:
+            refilling, self.refilling = self.refilling, None
+            refilling.callback(None)
+            return
+
+        idle = reactor.seconds() - self.last_get
+        if idle < REFILL_DELAY:
+            reactor.callLater(REFILL_DELAY - idle, self._refill_next)
+            return
+
+        if executor.executor.is_running():
+            d = executor.executor.submit_background(UniformDH)
+            d.addCallback(self._keypair_received, reactor.seconds())
+        else:
+            d = threads.deferToThread(self.generate)
+        d.addCallbacks(self._refill_next, self._refill_failed)
+
+    def _keypair_received(self, dh, started):
+        self.generate_seconds += reactor.seconds() - started
+        self.generated += 1
+        self.keypairs.append(dh)
+
+    def _refill_failed(self, failure):
+        log.warning("Could not generate UniformDH keypairs: %s" % failure.getErrorMessage())
+        refilling, self.refilling = self.refilling, None
+        refilling.callback(None)
+
+    def generate(self):
+        """Generate a keypair and add it to the pool. Blocks."""
+        start = time.time()
+        dh = UniformDH()
+        self.generate_seconds += time.time() - start
+        self.generated += 1
+        self.keypairs.append(dh)
+
+    def fill(self):
+        """Generate keypairs until the pool is full. Blocks."""
+        while len(self.keypairs) < self.size:
+            self.generate()
+
+    def get_refill_rate(self):
+        """Return how many keypairs per second the background thread generates."""
+        if not self.generate_seconds:
+            return 0.0
+        return self.generated / self.generate_seconds
+
+    def get_hit_rate(self):
+        """Return the fraction of keypairs that came out of the pool."""
+        requests = self.hits + self.misses
+        if not requests:
+            return 0.0
+        return float(self.hits) / requests
+
+""" Global variable that holds our pregenerated keypairs. """
+pool = KeypairPool()
+
+metrics.DH_POOL_SIZE.set_function(lambda: len(pool.keypairs))
+metrics.DH_POOL_CAPACITY.set_function(lambda: pool.size)
+metrics.DH_POOL_REQUESTS.set_function(lambda: pool.hits, 'hit')
+metrics.DH_POOL_REQUESTS.set_function(lambda: pool.misses, 'miss')
+metrics.DH_POOL_GENERATED.set_function(lambda: pool.generated)
+metrics.DH_POOL_GENERATE_SECONDS.set_function(lambda: pool.generate_seconds)
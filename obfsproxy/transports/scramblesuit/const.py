@@ -26,6 +26,17 @@ PASSWORD_FILE = "server_password"
 # attacks.
 EPOCH_GRANULARITY = 3600
 
+# Replay table entries are expired in buckets which span this many seconds.
+# Entries are kept for up to `EPOCH_GRANULARITY' plus this many seconds.
+REPLAY_BUCKET_LENGTH = 300
+
+# If set, the replay table is a pair of rotating Bloom filters, each sized for
+# that many handshakes per epoch, instead of an exact table.  That bounds its
+# memory, but fresh handshakes are taken for replays with a probability of
+# about `REPLAY_BLOOM_ERROR_RATE' (more if there are more handshakes).
+REPLAY_BLOOM_CAPACITY = 0
+REPLAY_BLOOM_ERROR_RATE = 1e-6
+
 # Flags which can be set in a ScrambleSuit protocol message.
 FLAG_PAYLOAD =        (1 << 0)
 FLAG_NEW_TICKET =     (1 << 1)
@@ -42,6 +53,36 @@ HMAC_SHA256_128_LENGTH = 16
 # lot.
 USE_IAT_OBFUSCATION = False
 
+# Modes of inter-arrival time obfuscation.  `off' sends data right away.
+# `full' sends an MTU-sized chunk after every randomly sampled delay, which
+# limits circuits to about one MTU per delay.  `adaptive' samples the same
+# delays but sends enough data after each of them to keep up at least
+# `IAT_MIN_RATE', and never lets more than `IAT_MAX_BACKLOG' bytes wait.
+IAT_MODE_OFF = "off"
+IAT_MODE_FULL = "full"
+IAT_MODE_ADAPTIVE = "adaptive"
+IAT_MODES = (IAT_MODE_OFF, IAT_MODE_FULL, IAT_MODE_ADAPTIVE)
+
+# The inter-arrival time obfuscation mode unless the `iat-mode' transport
+# option says otherwise.
+IAT_MODE = IAT_MODE_FULL if USE_IAT_OBFUSCATION else IAT_MODE_OFF
+
+# Minimum bandwidth of a circuit in bytes per second in the `adaptive' mode,
+# unless the `iat-min-rate' transport option says otherwise.
+IAT_MIN_RATE = 1024 * 1024
+
+# Bytes which may wait for the next delay to pass in the `adaptive' mode.
+IAT_MAX_BACKLOG = 64 * 1024
+
+# The maximum amount of padding, as a fraction of the bursts it is added to,
+# unless the `padding-budget' transport option says otherwise.  `None' means
+# that bursts are always padded to a length drawn from the whole packet length
+# distribution.
+PADDING_BUDGET = None
+
+# The number of recent bursts over which the padding budget is kept.
+PADDING_WINDOW = 64
+
 # Key rotation time for session ticket keys in seconds.
 KEY_ROTATION_TIME = 60 * 60 * 24 * 7
 
@@ -78,6 +119,9 @@ MIN_BINS = 1
 # The maximum amount of distinct bins for probability distributions.
 MAX_BINS = 100
 
+# Number of PRNG seeds whose probability distributions clients keep around.
+MAX_CACHED_SEEDS = 64
+
 # Length of a UniformDH public key in bytes.
 PUBLIC_KEY_LENGTH = 192
 
@@ -87,6 +131,32 @@ PRNG_SEED_LENGTH = 32
 # File which holds the server's state information.
 SERVER_STATE_FILE = "server_state.cpickle"
 
+# File which holds the HMACs added to the replay table since the server's state
+# file was written.
+REPLAY_JOURNAL_FILE = "replay_journal"
+
+# Seconds between writes of new HMACs to the replay journal.  HMACs which were
+# not written yet are lost if obfsproxy crashes, and other processes sharing
+# the state directory only see them after they were written.
+JOURNAL_COMMIT_INTERVAL = 1
+
+# Whether to wait until the replay journal and the server's state file are on
+# disk (with fsync()) every time they are written.
+JOURNAL_FSYNC = True
+
+# The server's state file is rewritten and the replay journal started over
+# after this many HMACs were added to it.
+JOURNAL_COMPACTION_RECORDS = 100000
+
+# File which holds the state shared by server processes.
+SHARED_STATE_FILE = "shared_state"
+
+# Number of HMACs the shared replay table has room for.  Each takes 20 bytes.
+SHARED_REPLAY_SLOTS = 2 ** 20
+
+# Number of slots of the shared replay table an HMAC can be stored in.
+SHARED_REPLAY_PROBES = 32
+
 # Life time of session tickets in seconds.
 SESSION_TICKET_LIFETIME = KEY_ROTATION_TIME
 
@@ -102,10 +172,22 @@ SHARED_SECRET_LENGTH = 20
 ST_WAIT_FOR_AUTH = 0
 ST_AUTH_FAILED = 1
 ST_CONNECTED = 2
+ST_WAIT_FOR_DH = 3
 
 # File which holds the client's session tickets.
+CLIENT_TICKET_STORE_FILE = "session_tickets"
+
+# File which held the client's session tickets in older versions.
 CLIENT_TICKET_FILE = "session_ticket.yaml"
 
+# Number of unused session tickets a client keeps per bridge.  Clients ask the
+# server for more tickets until they have this many.
+TICKET_POOL_SIZE = 4
+
+# Number of extra session tickets a server issues per connection, on top of
+# the one it always issues.
+MAX_EXTRA_TICKETS = 8
+
 # Static validation string embedded in all tickets.  Must be a multiple of 16
 # bytes due to AES' block size.
 TICKET_IDENTIFIER = "ScrambleSuitTicket"
@@ -0,0 +1,126 @@
+"""
+This module locates and verifies the HMAC of ScrambleSuit handshakes.
+
+Session ticket handshakes as well as UniformDH handshakes consist of a header
+(the ticket or the public key), padding, a mark and an HMAC.  The mark is the
+HMAC of the header and the HMAC covers everything before it, plus the epoch.
+
+A server doesn't know which of the two handshakes a client sends, and it
+receives them in as many pieces as the network chooses.  A `HandshakeParser'
+remembers what it learnt about a handshake between these pieces: the mark is
+computed once, the search for it resumes where it stopped and a handshake
+which can no longer be valid is not looked at again.
+"""
+
+import const
+import util
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+
+class HandshakeParser( object ):
+
+    """
+    Incrementally locates and verifies the mark and HMAC of a handshake.
+    """
+
+    def __init__( self, headerLength ):
+        """
+        Initialise a parser for handshakes whose header is `headerLength'
+        bytes long.
+        """
+
+        self.headerLength = headerLength
+        self.reset()
+
+    def reset( self ):
+        """
+        Forget about the current handshake.
+        """
+
+        # The mark, once the header is complete.
+        self.mark = None
+
+        # Where to resume the search for the mark, and where it was found.
+        self.searched = 0
+        self.index = None
+
+        # `True' if the handshake can't be valid, no matter what follows.
+        self.excluded = False
+
+    def exclude( self ):
+        """
+        Give up on the current handshake.
+        """
+
+        self.excluded = True
+
+    def locateMark( self, handshake ):
+        """
+        Search the part of `handshake' which was not searched yet for the mark
+        and return its index, or `None' if it's not there (yet).
+        """
+
+        # The mark must start within `const.MAX_PADDING_LENGTH' bytes.
+        end = const.MAX_PADDING_LENGTH + const.MARK_LENGTH
+
+        index = handshake.find(self.mark, self.searched, end)
+        if index >= 0:
+            return index
+
+        if len(handshake) >= end:
+            log.debug("The mark is not where it should be.")
+            self.exclude()
+        else:
+            # The mark might start in the last bytes we have.
+            self.searched = max(0, len(handshake) - const.MARK_LENGTH + 1)
+
+        return None
+
+    def parse( self, key, handshake ):
+        """
+        Locate and verify the HMAC in the data `handshake' received so far.
+
+        The HMACContext `key' computes the mark and HMAC.  Return the tuple
+        (length, HMAC, epoch) of the handshake's length, its HMAC and the epoch
+        value it was created with if the HMAC is valid.  Return `None' if more
+        data is needed or if the handshake is invalid.
+        """
+
+        if self.excluded or (len(handshake) < (self.headerLength +
+                                               const.MARK_LENGTH +
+                                               const.HMAC_SHA256_128_LENGTH)):
+            return None
+
+        if self.mark is None:
+            self.mark = key.digest(handshake[:self.headerLength])
+
+        if self.index is None:
+            self.index = self.locateMark(handshake)
+            if self.index is None:
+                log.debug("Could not find the mark just yet.")
+                return None
+
+        hmacStart = self.index + const.MARK_LENGTH
+        length = hmacStart + const.HMAC_SHA256_128_LENGTH
+        if len(handshake) < length:
+            log.debug("Found the mark but the HMAC is still incomplete.")
+            return None
+
+        existingHMAC = handshake[hmacStart:length]
+
+        # All epoch values share everything up to the mark.
+        prefix = key.prefix(handshake[:hmacStart])
+        for epoch in util.expandedEpoch():
+            if util.isValidHMAC(key.finish(prefix, epoch), existingHMAC):
+                self.reset()
+                return (length, existingHMAC, epoch)
+
+            log.debug("HMAC invalid.  Trying next epoch value.")
+
+        log.warning("Could not verify the authentication message's HMAC.")
+        self.exclude()
+
+        return None
@@ -0,0 +1,306 @@
+"""
+This module implements a write-behind journal for the server's replay table.
+
+Rewriting the whole state file after every handshake is too slow once the
+replay table has grown.  Instead, the HMACs which are added to the replay table
+are appended to a journal file.  They are written in groups, every
+`const.JOURNAL_COMMIT_INTERVAL' seconds, and always in a thread, so the reactor
+never waits for the disk.  Once the journal holds
+`const.JOURNAL_COMPACTION_RECORDS' records, the state file is rewritten (again
+in a thread) and the journal starts over.
+
+The state is then loaded from the state file plus the records in the journal.
+"""
+
+import os
+import struct
+import time
+
+from twisted.internet import defer, reactor, threads
+
+import const
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# A journal record: the Unix timestamp of an HMAC and the HMAC itself.
+RECORD = struct.Struct("!L%ds" % const.HMAC_SHA256_128_LENGTH)
+
+
+def fileIdentity( fileName ):
+    """
+    Return a tuple which changes whenever `fileName' is replaced, or `None' if
+    the file doesn't exist.
+    """
+
+    try:
+        stat = os.stat(fileName)
+    except OSError:
+        return None
+
+    return (stat.st_dev, stat.st_ino, stat.st_mtime)
+
+
+def writeFile( fileName, data, sync ):
+    """
+    Atomically replace the file `fileName' by one containing `data'.
+
+    If `sync' is `True', the data is on disk when this function returns.
+    """
+
+    tmpName = fileName + ".tmp"
+
+    with open(tmpName, "wb") as fd:
+        fd.write(data)
+        if sync:
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    os.rename(tmpName, fileName)
+
+
+class ReplayJournal( object ):
+
+    """
+    Journal of the HMACs added to the replay table since the last snapshot.
+
+    All writes are done by a single thread at a time, in the order in which
+    they were requested, so that records never overtake the snapshots they
+    belong after.
+    """
+
+    def __init__( self, fileName ):
+        """
+        Initialise a journal which is kept in the file `fileName'.
+        """
+
+        self.fileName = fileName
+
+        # Records which wait for the next group commit.
+        self.pending = []
+        self.commitCall = None
+
+        # Writes which wait for their turn, and whether one is running.
+        self.jobs = []
+        self.writing = False
+
+        # Deferreds which fire once all writes are done.
+        self.idleWaiters = []
+        self.snapshotting = False
+
+        # How many records were appended since the last snapshot.
+        self.records = 0
+
+        # How much of which file `replay()' read already.
+        self.readIdentity = None
+        self.readOffset = 0
+
+        self.shutdownTrigger = None
+
+    def append( self, element, timestamp ):
+        """
+        Append a record for `element', added to the replay table at
+        `timestamp', with the next group commit.
+        """
+
+        assert len(element) == const.HMAC_SHA256_128_LENGTH
+
+        self.pending.append(RECORD.pack(timestamp, element))
+        self.records += 1
+
+        if self.commitCall is None:
+            self.commitCall = reactor.callLater(const.JOURNAL_COMMIT_INTERVAL,
+                                                self.commit)
+
+        # Don't lose the pending records when obfsproxy exits.
+        if self.shutdownTrigger is None:
+            self.shutdownTrigger = reactor.addSystemEventTrigger(
+                "before", "shutdown", self.flush)
+
+    def commit( self ):
+        """
+        Write the pending records to the journal, in a thread.  Returns a
+        `Deferred' which fires once they are written.
+        """
+
+        self.cancelCommit()
+
+        if not self.pending:
+            return defer.succeed(None)
+
+        data = "".join(self.pending)
+        self.pending = []
+
+        return self.submit(self.appendRecords, data)
+
+    def cancelCommit( self ):
+        """
+        Cancel the scheduled group commit, if any.
+        """
+
+        if self.commitCall is not None and self.commitCall.active():
+            self.commitCall.cancel()
+        self.commitCall = None
+
+    def snapshot( self, stateFile, data ):
+        """
+        Replace `stateFile' by `data' and start a new, empty journal.
+
+        The snapshot `data' must include all records which are pending, so
+        they are dropped.  Returns a `Deferred' which fires with the identity
+        of the new state file once it's written.
+        """
+
+        self.cancelCommit()
+
+        self.pending = []
+        self.records = 0
+        self.snapshotting = True
+
+        d = self.submit(self.writeSnapshot, stateFile, data)
+
+        def done( result ):
+            self.snapshotting = False
+            return result
+        d.addBoth(done)
+
+        return d
+
+    def submit( self, function, *args ):
+        """
+        Queue `function(*args)' to be called in a thread after all writes
+        which are already queued.  Returns a `Deferred' for its result.
+        """
+
+        d = defer.Deferred()
+        self.jobs.append((function, args, d))
+        self.runNextJob()
+
+        return d
+
+    def runNextJob( self ):
+        """
+        Start the next queued write if no write is running.
+        """
+
+        if self.writing:
+            return
+
+        if not self.jobs:
+            idleWaiters, self.idleWaiters = self.idleWaiters, []
+            for waiter in idleWaiters:
+                waiter.callback(None)
+            return
+
+        function, args, d = self.jobs.pop(0)
+        self.writing = True
+
+        def done( result ):
+            self.writing = False
+            self.runNextJob()
+            return result
+
+        def failed( failure ):
+            log.error("Error writing the replay journal: %s" %
+                      failure.getErrorMessage())
+            return None
+
+        job = threads.deferToThread(function, *args)
+        job.addBoth(done)
+        job.addErrback(failed)
+        job.chainDeferred(d)
+
+    def flush( self ):
+        """
+        Write the pending records and wait for all writes to finish.
+
+        Called before shutdown, which waits for the returned `Deferred' (or
+        doesn't wait if `None' is returned).  The pending records are written
+        after the write which is running, so a snapshot which is in progress
+        can't replace the journal they end up in.
+        """
+
+        self.commit()
+
+        # Submitting a write starts it right away unless one is running.
+        if not self.writing:
+            return None
+
+        d = defer.Deferred()
+        self.idleWaiters.append(d)
+
+        return d
+
+    def appendRecords( self, data ):
+        """
+        Append the packed records in `data' to the journal file.
+        """
+
+        with open(self.fileName, "ab") as fd:
+            fd.write(data)
+            if const.JOURNAL_FSYNC:
+                fd.flush()
+                os.fsync(fd.fileno())
+
+    def writeSnapshot( self, stateFile, data ):
+        """
+        Write the state file `stateFile' and start a new, empty journal.
+        """
+
+        writeFile(stateFile, data, const.JOURNAL_FSYNC)
+        writeFile(self.fileName, "", const.JOURNAL_FSYNC)
+
+        return fileIdentity(stateFile)
+
+    def replayPending( self, tracker ):
+        """
+        Add the records which wait for the next group commit to `tracker'.
+        """
+
+        for record in self.pending:
+            timestamp, element = RECORD.unpack(record)
+            tracker.insert(element, timestamp)
+
+    def replay( self, tracker ):
+        """
+        Add the records of the journal which weren't read yet to `tracker'.
+
+        Records which already expired and HMACs which are in `tracker' already
+        (like the ones we wrote ourselves) are skipped.
+        """
+
+        identity = fileIdentity(self.fileName)
+        if identity is None:
+            return
+
+        # A new journal was started since we last looked.
+        if identity[:2] != (self.readIdentity or (None, None))[:2]:
+            self.readOffset = 0
+        self.readIdentity = identity
+
+        try:
+            with open(self.fileName, "rb") as fd:
+                fd.seek(self.readOffset)
+                data = fd.read()
+        except IOError as err:
+            log.error("Error reading the replay journal `%s': %s" %
+                      (self.fileName, err))
+            return
+
+        # A partial record at the end is still being written.
+        data = data[:len(data) - (len(data) % RECORD.size)]
+        self.readOffset += len(data)
+
+        now = int(time.time())
+        added = 0
+        for offset in xrange(0, len(data), RECORD.size):
+            timestamp, element = RECORD.unpack_from(data, offset)
+            if (now - timestamp) > const.EPOCH_GRANULARITY:
+                continue
+            if not tracker.isPresent(element):
+                tracker.insert(element, timestamp)
+                added += 1
+
+        if added:
+            log.debug("Added %d HMACs from the replay journal.", added)
@@ -6,11 +6,14 @@ messages, check message headers for validity and create protocol messages out
 of application data.
 """
 
+import struct
+
 import obfsproxy.common.log as logging
 import obfsproxy.common.serialize as pack
 import obfsproxy.transports.base as base
 
 import mycrypto
+import util
 import const
 
 log = logging.get_obfslogger()
@@ -33,11 +36,86 @@ def createProtocolMessages( data, flags=const.FLAG_PAYLOAD ):
 
     messages.append(ProtocolMessage(data, flags=flags))
 
-    log.debug("Created %d protocol messages." % len(messages))
+    log.debug_packet("Created %d protocol messages.", len(messages))
 
     return messages
 
 
+def createFrames( data, flags=const.FLAG_PAYLOAD ):
+    """
+    Create the frames of the protocol messages which carry the given payload.
+
+    Like `createProtocolMessages()', the given `data' is cut into messages with
+    the given `flags' set which, if possible, fill the MTU.  No message objects
+    or copies of the payload are created, though.  Instead, every message is
+    described by a frame, i.e., a tuple (data, offset, payloadLen, paddingLen,
+    flags) which can be passed to `encryptFrames()'.
+    """
+
+    dataLen = len(data)
+
+    # There is always at least one (possibly empty) message.
+    frames = [(data, offset, min(const.MPU, dataLen - offset), 0, flags)
+              for offset in xrange(0, max(dataLen, 1), const.MPU)]
+
+    log.debug_packet("Created %d protocol message frames.", len(frames))
+
+    return frames
+
+
+def createPaddingFrame( paddingLen ):
+    """
+    Create the frame of a protocol message holding `paddingLen' bytes of
+    padding and no payload.
+    """
+
+    return ("", 0, 0, paddingLen, const.FLAG_PAYLOAD)
+
+
+def encryptFrames( crypter, hmacKey, frames ):
+    """
+    Encrypt and authenticate a burst of protocol messages.
+
+    The messages described by `frames' (see `createFrames()') are encrypted
+    using `crypter' and authenticated using `hmacKey'.  The result is the same
+    as calling `ProtocolMessage.encryptAndHMAC()' for every message, in order,
+    but it is returned as a list of strings which can be passed to
+    `writeSequence()'.
+
+    The encrypted parts of the messages (the header fields, payload and
+    padding) directly follow each other in the key stream.  They are laid out
+    back to back in a single buffer and encrypted in one go.  Then, every
+    message is authenticated.
+    """
+
+    encHdrLen = const.HDR_LENGTH - const.HMAC_SHA256_128_LENGTH
+
+    # Padding is all zeroes, so a fresh bytearray already contains it.
+    plain = bytearray(sum([encHdrLen + payloadLen + paddingLen for
+                           (_, _, payloadLen, paddingLen, _) in frames]))
+    offset = 0
+    for (data, start, payloadLen, paddingLen, flags) in frames:
+        struct.pack_into("!hhB", plain, offset, payloadLen + paddingLen,
+                         payloadLen, flags)
+        offset += encHdrLen
+        plain[offset:offset + payloadLen] = buffer(data, start, payloadLen)
+        offset += payloadLen + paddingLen
+
+    encrypted = crypter.encrypt(buffer(plain))
+
+    pieces = []
+    offset = 0
+    for (_, _, payloadLen, paddingLen, _) in frames:
+        end = offset + encHdrLen + payloadLen + paddingLen
+        pieces.append(mycrypto.HMAC_SHA256_128(hmacKey,
+                                               buffer(encrypted, offset,
+                                                      end - offset)))
+        pieces.append(encrypted[offset:end])
+        offset = end
+
+    return pieces
+
+
 def getFlagNames( flags ):
     """
     Return the flag name encoded in the integer `flags' as string.
@@ -75,8 +153,9 @@ def isSane( totalLen, payloadLen, flags ):
 
         return True if (0 <= length <= const.MPU) else False
 
-    log.debug("Message header: totalLen=%d, payloadLen=%d, flags"
-              "=%s" % (totalLen, payloadLen, getFlagNames(flags)))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug_packet("Message header: totalLen=%d, payloadLen=%d, flags"
+                         "=%s", totalLen, payloadLen, getFlagNames(flags))
 
     validFlags = [
         const.FLAG_PAYLOAD,
@@ -119,8 +198,9 @@ class ProtocolMessage( object ):
         Encrypt and authenticate this protocol message.
 
         This protocol message is encrypted using `crypter' and authenticated
-        using `hmacKey'.  Finally, the encrypted message prepended by a
-        HMAC-SHA256-128 is returned and ready to be sent over the wire.
+        using `hmacKey' (a key or a `HMACContext').  Finally, the encrypted
+        message prepended by a HMAC-SHA256-128 is returned and ready to be sent
+        over the wire.
         """
 
         encrypted = crypter.encrypt(pack.htons(self.totalLen) +
@@ -147,8 +227,8 @@ class ProtocolMessage( object ):
         if paddingLen == 0:
             return
 
-        log.debug("Adding %d bytes of padding to %d-byte message." %
-                  (paddingLen, const.HDR_LENGTH + self.totalLen))
+        log.debug_packet("Adding %d bytes of padding to %d-byte message.",
+                         paddingLen, const.HDR_LENGTH + self.totalLen)
         self.totalLen += paddingLen
 
     def __len__( self ):
@@ -165,6 +245,10 @@ class MessageExtractor( object ):
 
     """
     Extracts ScrambleSuit protocol messages out of an encrypted stream.
+
+    Received data is appended to a bytearray which is parsed in place, using a
+    read cursor.  Extracting a message therefore doesn't copy the rest of the
+    buffer; consumed messages are dropped once per call to `extract()'.
     """
 
     def __init__( self ):
@@ -172,55 +256,88 @@ class MessageExtractor( object ):
         Initialise a new MessageExtractor object.
         """
 
-        self.recvBuf = ""
+        self.recvBuf = bytearray()
         self.totalLen = None
         self.payloadLen = None
         self.flags = None
 
+    def parseHeader( self, header ):
+        """
+        Set the length fields and flags from the decrypted `header'.
+
+        The `header' holds the five encrypted bytes of a message header, i.e.,
+        the total length, the payload length and the flags.  If they don't
+        make sense, an exception is raised.
+        """
+
+        self.totalLen = pack.ntohs(header[0:2])
+        self.payloadLen = pack.ntohs(header[2:4])
+        self.flags = ord(header[4])
+
+        if not isSane(self.totalLen, self.payloadLen, self.flags):
+            raise base.PluggableTransportError("Invalid header.")
+
     def extract( self, data, aes, hmacKey ):
         """
         Extracts (i.e., decrypts and authenticates) protocol messages.
 
         The raw `data' coming directly from the wire is decrypted using `aes'
-        and authenticated using `hmacKey'.  The payload is then returned as
-        unencrypted protocol messages.  In case of invalid headers or HMACs, an
-        exception is raised.
+        and authenticated using `hmacKey' (a key or a `HMACContext').  The
+        payload is then returned as unencrypted protocol messages.  In case of
+        invalid headers or HMACs, an exception is raised.
         """
 
-        self.recvBuf += data
+        buf = self.recvBuf
+        buf += data
+        bufLen = len(buf)
+        cursor = 0
         msgs = []
 
-        # Keep trying to unpack as long as there is at least a header.
-        while len(self.recvBuf) >= const.HDR_LENGTH:
+        # If necessary, extract the header fields of the first message.
+        if self.totalLen is None:
+            if bufLen < const.HDR_LENGTH:
+                return msgs
+            self.parseHeader(aes.decrypt(buffer(buf, 16, 5)))
 
-            # If necessary, extract the header fields.
-            if self.totalLen == self.payloadLen == self.flags == None:
-                self.totalLen = pack.ntohs(aes.decrypt(self.recvBuf[16:18]))
-                self.payloadLen = pack.ntohs(aes.decrypt(self.recvBuf[18:20]))
-                self.flags = ord(aes.decrypt(self.recvBuf[20]))
+        while True:
 
-                if not isSane(self.totalLen, self.payloadLen, self.flags):
-                    raise base.PluggableTransportError("Invalid header.")
+            msgEnd = cursor + const.HDR_LENGTH + self.totalLen
 
             # Parts of the message are still on the wire; waiting.
-            if (len(self.recvBuf) - const.HDR_LENGTH) < self.totalLen:
+            if bufLen < msgEnd:
                 break
 
-            rcvdHMAC = self.recvBuf[0:const.HMAC_SHA256_128_LENGTH]
+            rcvdHMAC = str(buf[cursor:cursor + const.HMAC_SHA256_128_LENGTH])
             vrfyHMAC = mycrypto.HMAC_SHA256_128(hmacKey,
-                              self.recvBuf[const.HMAC_SHA256_128_LENGTH:
-                              (self.totalLen + const.HDR_LENGTH)])
+                              buffer(buf, cursor + const.HMAC_SHA256_128_LENGTH,
+                              msgEnd - cursor - const.HMAC_SHA256_128_LENGTH))
 
-            if rcvdHMAC != vrfyHMAC:
+            if not util.isValidHMAC(rcvdHMAC, vrfyHMAC):
                 raise base.PluggableTransportError("Invalid message HMAC.")
 
-            # Decrypt the message and remove it from the input buffer.
-            extracted = aes.decrypt(self.recvBuf[const.HDR_LENGTH:
-                         (self.totalLen + const.HDR_LENGTH)])[:self.payloadLen]
-            msgs.append(ProtocolMessage(payload=extracted, flags=self.flags))
-            self.recvBuf = self.recvBuf[const.HDR_LENGTH + self.totalLen:]
+            # In the key stream, the encrypted header fields of the next
+            # message directly follow the body of this one.  If the next
+            # header is there already, both are decrypted in one go.
+            body = buffer(buf, cursor + const.HDR_LENGTH, self.totalLen)
+            if bufLen >= msgEnd + const.HDR_LENGTH:
+                plain = aes.decrypt(body + buffer(buf, msgEnd + 16, 5))
+                header = plain[-5:]
+            else:
+                plain = aes.decrypt(body)
+                header = None
+
+            msgs.append(ProtocolMessage(payload=plain[:self.payloadLen],
+                                        flags=self.flags))
+            cursor = msgEnd
 
             # Protocol message processed; now reset length fields.
             self.totalLen = self.payloadLen = self.flags = None
 
+            if header is None:
+                break
+            self.parseHeader(header)
+
+        # Drop the messages we extracted from the input buffer.
+        del buf[:cursor]
+
         return msgs
@@ -5,16 +5,15 @@ The implemented algorithms include HKDF-SHA256, HMAC-SHA256-128, (CS)PRNGs and
 an interface for encryption and decryption using AES in counter mode.
 """
 
-import Crypto.Hash.SHA256
-import Crypto.Hash.HMAC
-import Crypto.Util.Counter
-import Crypto.Cipher.AES
-
 import obfsproxy.transports.base as base
+import obfsproxy.common.crypto_backend as crypto_backend
+import obfsproxy.common.hmac_sha256 as hmac_sha256
 import obfsproxy.common.log as logging
 
+import hashlib
 import math
 import os
+import struct
 
 import const
 
@@ -68,9 +67,8 @@ class HKDF_SHA256( object ):
                                                "be re-used by application.")
 
         while self.length > len(self.T):
-            tmp = Crypto.Hash.HMAC.new(self.prk, tmp + self.info +
-                                       chr(self.ctr),
-                                       Crypto.Hash.SHA256).digest()
+            tmp = hmac_sha256.hmac_sha256_digest(self.prk, tmp + self.info +
+                                                 chr(self.ctr))
             self.T += tmp
             self.ctr += 1
 
@@ -80,14 +78,89 @@ class HKDF_SHA256( object ):
 def HMAC_SHA256_128( key, msg ):
     """
     Return the HMAC-SHA256-128 of the given `msg' authenticated by `key'.
+
+    The `key' can also be a `HMACContext', which is faster if the same key is
+    used for many messages.
     """
 
-    assert(len(key) >= const.SHARED_SECRET_LENGTH)
+    if isinstance(key, HMACContext):
+        return key.digest(msg)
 
-    h = Crypto.Hash.HMAC.new(key, msg, Crypto.Hash.SHA256)
+    assert(len(key) >= const.SHARED_SECRET_LENGTH)
 
     # Return HMAC truncated to 128 out of 256 bits.
-    return h.digest()[:16]
+    return hmac_sha256.hmac_sha256_digest(key, msg)[:16]
+
+
+# Translation tables to XOR a key with HMAC's inner and outer pad.
+_TRANS_36 = "".join([chr(x ^ 0x36) for x in xrange(256)])
+_TRANS_5C = "".join([chr(x ^ 0x5C) for x in xrange(256)])
+
+class HMACContext( object ):
+
+    """
+    Computes HMAC-SHA256-128 under a fixed key.
+
+    An HMAC starts by hashing the key XORed with the inner and outer pads.
+    That key schedule is done once, when the context is created.  Every MAC is
+    then computed by copying the two precomputed SHA256 states, so a message
+    only costs hashing the message itself and the inner digest.
+    """
+
+    def __init__( self, key ):
+        """
+        Initialise a HMACContext object for `key'.
+        """
+
+        assert(len(key) >= const.SHARED_SECRET_LENGTH)
+
+        self.key = key
+
+        blockSize = hashlib.sha256().block_size
+        if len(key) > blockSize:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(blockSize, "\0")
+
+        self.inner = hashlib.sha256(key.translate(_TRANS_36))
+        self.outer = hashlib.sha256(key.translate(_TRANS_5C))
+
+    def digest( self, msg ):
+        """
+        Return the HMAC-SHA256-128 of the given `msg'.
+        """
+
+        inner = self.inner.copy()
+        inner.update(msg)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+
+        # Return HMAC truncated to 128 out of 256 bits.
+        return outer.digest()[:16]
+
+    def prefix( self, msg ):
+        """
+        Hash `msg' and return the resulting state, so that the HMACs of
+        several messages starting with `msg' can be computed by `finish()'
+        without hashing `msg' again.
+        """
+
+        inner = self.inner.copy()
+        inner.update(msg)
+
+        return inner
+
+    def finish( self, prefix, msg ):
+        """
+        Return the HMAC-SHA256-128 of the message `msg' appended to the one
+        which `prefix' was computed for.
+        """
+
+        inner = prefix.copy()
+        inner.update(msg)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+
+        return outer.digest()[:16]
 
 
 def strongRandom( size ):
@@ -116,7 +189,6 @@ class PayloadCrypter:
 
         self.sessionKey = None
         self.crypter = None
-        self.counter = None
 
     def setSessionKey( self, key, iv ):
         """
@@ -134,22 +206,16 @@ class PayloadCrypter:
         # Counter wrapping is not allowed which makes it possible to transfer
         # 2^64 * 16 bytes of data while avoiding counter reuse.  That amount is
         # effectively out of reach given today's networking performance.
-        log.debug("Setting IV for AES-CTR.")
-        self.counter = Crypto.Util.Counter.new(64,
-                                               prefix = iv,
-                                               initial_value = 1,
-                                               allow_wraparound = False)
-
-        log.debug("Setting session key for AES-CTR.")
-        self.crypter = Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_CTR,
-                                             counter=self.counter)
+        log.debug("Setting session key and IV for AES-CTR.")
+        self.crypter = crypto_backend.backend.aes_ctr(key,
+                                                      iv + struct.pack("!Q", 1))
 
     def encrypt( self, data ):
         """
         Encrypts the given `data' using AES in counter mode.
         """
 
-        return self.crypter.encrypt(data)
+        return self.crypter(data)
 
     # Encryption equals decryption in AES-CTR.
     decrypt = encrypt
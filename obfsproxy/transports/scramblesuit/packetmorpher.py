@@ -4,8 +4,14 @@ Provides code to morph a chunk of data to a given probability distribution.
 The class provides an interface to morph a network packet's length to a
 previously generated probability distribution.  The packet lengths of the
 morphed network data should then match the probability distribution.
+
+Padding can cost more than the data it is added to, e.g., for small interactive
+bursts.  A `PaddingBudget' can limit it to a fraction of the data of the most
+recent bursts.  Once the budget is used up, bursts are morphed to those lengths
+of the distribution which need less padding.
 """
 
+import collections
 import random
 
 import message
@@ -13,9 +19,125 @@ import probdist
 import const
 
 import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
 
 log = logging.get_obfslogger()
 
+transportName = const.TRANSPORT_NAME.lower()
+paddedBytes = metrics.PADDED_BYTES.labels(transportName)
+paddingBytes = metrics.PADDING_BYTES.labels(transportName)
+cappedBursts = metrics.PADDING_CAPPED.labels(transportName)
+
+
+def paddingLength( dataLen, sampleLen ):
+    """
+    Return the padding which morphs the last packet of a `dataLen'-byte burst
+    to `sampleLen' bytes.
+    """
+
+    # The `is' length of the burst's last packet.
+    dataLen = dataLen % const.MTU
+
+    # Now determine the padding length which is in {0..MTU-1}.
+    if sampleLen >= dataLen:
+        padLen = sampleLen - dataLen
+    else:
+        padLen = (const.MTU - dataLen) + sampleLen
+
+    if padLen < const.HDR_LENGTH:
+        padLen += const.MTU
+
+    return padLen
+
+
+class PaddingBudget( object ):
+
+    """
+    Keeps track of a circuit's padding and of how much padding it may add.
+
+    The padding of the last `const.PADDING_WINDOW' bursts should not exceed
+    `fraction' times their size.  If `fraction' is `None', padding is only
+    counted.
+    """
+
+    def __init__( self, fraction=None ):
+        """
+        Initialise a PaddingBudget object which allows padding of `fraction'
+        times the data.
+        """
+
+        self.fraction = fraction
+
+        # The (data, padding) bytes of the most recent bursts and their sums.
+        self.window = collections.deque()
+        self.windowData = 0
+        self.windowPadding = 0
+
+        # The bytes of data and padding of all bursts, and the number of bursts
+        # which got less padding because of the budget.
+        self.dataBytes = 0
+        self.paddingBytes = 0
+        self.cappedBursts = 0
+
+    def allowance( self, dataLen ):
+        """
+        Return how much padding a `dataLen'-byte burst may get, or `None' if
+        there is no limit.
+        """
+
+        if self.fraction is None:
+            return None
+
+        return (self.fraction * (self.windowData + dataLen)) - \
+               self.windowPadding
+
+    def spend( self, dataLen, padLen, capped=False ):
+        """
+        Account for a `dataLen'-byte burst which got `padLen' bytes of padding,
+        less than it would have without the budget if `capped' is `True'.
+        """
+
+        # Without a limit, there is no need to remember recent bursts.
+        if self.fraction is not None:
+            self.window.append((dataLen, padLen))
+            self.windowData += dataLen
+            self.windowPadding += padLen
+
+            if len(self.window) > const.PADDING_WINDOW:
+                oldData, oldPadding = self.window.popleft()
+                self.windowData -= oldData
+                self.windowPadding -= oldPadding
+
+        self.dataBytes += dataLen
+        self.paddingBytes += padLen
+        paddedBytes.value += dataLen
+        paddingBytes.value += padLen
+
+        if capped:
+            self.cappedBursts += 1
+            cappedBursts.value += 1
+
+    def overhead( self ):
+        """
+        Return the padding of all bursts as a fraction of their data.
+        """
+
+        if not self.dataBytes:
+            return 0.0
+
+        return float(self.paddingBytes) / self.dataBytes
+
+    def getStats( self ):
+        """
+        Return a dictionary with the padding statistics of the circuit.
+        """
+
+        return {"padded_bytes": self.dataBytes,
+                "padding_bytes": self.paddingBytes,
+                "capped_bursts": self.cappedBursts,
+                "overhead": round(self.overhead(), 3)}
+
+
 class PacketMorpher( object ):
 
     """
@@ -26,12 +148,13 @@ class PacketMorpher( object ):
     smaller than the MTU.
     """
 
-    def __init__( self, dist=None ):
+    def __init__( self, dist=None, budget=None ):
         """
         Initialise the packet morpher with the given distribution `dist'.
 
         If `dist' is `None', a new discrete probability distribution is
-        generated randomly.
+        generated randomly.  The padding is accounted for in the PaddingBudget
+        `budget', or in a new one without a limit if `budget' is `None'.
         """
 
         if dist:
@@ -40,9 +163,11 @@ class PacketMorpher( object ):
             self.dist = probdist.new(lambda: random.randint(const.HDR_LENGTH,
                                                             const.MTU))
 
-    def getPadding( self, sendCrypter, sendHMAC, dataLen ):
+        self.budget = PaddingBudget() if budget is None else budget
+
+    def getPaddingFrames( self, dataLen ):
         """
-        Based on the burst's size, return a ready-to-send padding blurb.
+        Based on the burst's size, return the frames of its padding messages.
         """
 
         padLen = self.calcPadding(dataLen)
@@ -52,15 +177,19 @@ class PacketMorpher( object ):
 
         # We have to use two padding messages if the padding is > MTU.
         if padLen > const.MTU:
-            padMsgs = [message.new("", paddingLen=700 - const.HDR_LENGTH),
-                       message.new("", paddingLen=padLen - 700 - \
-                                       const.HDR_LENGTH)]
+            return [message.createPaddingFrame(700 - const.HDR_LENGTH),
+                    message.createPaddingFrame(padLen - 700 - \
+                                               const.HDR_LENGTH)]
         else:
-            padMsgs = [message.new("", paddingLen=padLen - const.HDR_LENGTH)]
+            return [message.createPaddingFrame(padLen - const.HDR_LENGTH)]
 
-        blurbs = [msg.encryptAndHMAC(sendCrypter, sendHMAC) for msg in padMsgs]
+    def getPadding( self, sendCrypter, sendHMAC, dataLen ):
+        """
+        Based on the burst's size, return a ready-to-send padding blurb.
+        """
 
-        return "".join(blurbs)
+        return "".join(message.encryptFrames(sendCrypter, sendHMAC,
+                                             self.getPaddingFrames(dataLen)))
 
     def calcPadding( self, dataLen ):
         """
@@ -71,24 +200,29 @@ class PacketMorpher( object ):
         from our probability distribution which is used to determine and return
         the padding for such packets.  This effectively gets rid of Tor's
         586-byte signature.
+
+        If that's more padding than the budget allows, the sample is drawn from
+        the lengths which need less padding instead.
         """
 
-        # The `is' and `should-be' length of the burst's last packet.
-        dataLen = dataLen % const.MTU
         sampleLen = self.dist.randomSample()
-
-        # Now determine the padding length which is in {0..MTU-1}.
-        if sampleLen >= dataLen:
-            padLen = sampleLen - dataLen
-        else:
-            padLen = (const.MTU - dataLen) + sampleLen
-
-        if padLen < const.HDR_LENGTH:
-            padLen += const.MTU
-
-        log.debug("Morphing the last %d-byte packet to %d bytes by adding %d "
-                  "bytes of padding." %
-                  (dataLen % const.MTU, sampleLen, padLen))
+        padLen = paddingLength(dataLen, sampleLen)
+
+        budget = self.budget
+        capped = False
+        if budget.fraction is not None:
+            allowance = budget.allowance(dataLen)
+            if padLen > allowance:
+                sampleLen = self.dist.randomSampleBelow(
+                    lambda length: paddingLength(dataLen, length), allowance)
+                padLen = paddingLength(dataLen, sampleLen)
+                capped = True
+
+        budget.spend(dataLen, padLen, capped)
+
+        log.debug_packet("Morphing the last %d-byte packet to %d bytes by "
+                         "adding %d bytes of padding.",
+                         dataLen % const.MTU, sampleLen, padLen)
 
         return padLen
 
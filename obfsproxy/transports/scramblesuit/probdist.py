@@ -13,6 +13,38 @@ import obfsproxy.common.log as logging
 
 log = logging.get_obfslogger()
 
+# Packet length and inter-arrival time distributions, by PRNG seed.
+_seeded = dict()
+
+
+def seededDistributions( seed ):
+    """
+    Return the packet length and inter-arrival time distributions which are
+    derived from the PRNG `seed', like the server does.
+
+    The distributions are only generated once per seed, so that connections to
+    the same bridge share them.  Up to `const.MAX_CACHED_SEEDS' seeds are
+    remembered.
+    """
+
+    try:
+        return _seeded[seed]
+    except KeyError:
+        pass
+
+    if len(_seeded) >= const.MAX_CACHED_SEEDS:
+        _seeded.clear()
+
+    prng = random.Random(seed)
+    pktDist = new(lambda: prng.randint(const.HDR_LENGTH, const.MTU),
+                  seed=seed)
+    iatDist = new(lambda: prng.random() % const.MAX_PACKET_DELAY,
+                  seed=seed)
+
+    _seeded[seed] = (pktDist, iatDist)
+
+    return (pktDist, iatDist)
+
 
 class RandProbDist:
 
@@ -88,11 +120,49 @@ class RandProbDist:
 
         rand = random.random()
 
+        # Every bin gets a uniformly drawn share of the probability which is
+        # left, so on average, the search ends after two bins.  That's faster
+        # than a binary search or an alias table.
         for cumulProb, singleton in self.sampleList:
             if rand <= cumulProb:
                 return singleton
 
         return self.sampleList[-1][1]
 
+    def randomSampleBelow( self, cost, limit ):
+        """
+        Draw and return a random sample among the singletons which cost at most
+        `limit', with the probabilities they have in the distribution.
+
+        The function `cost' returns the cost of a singleton.  If no singleton
+        is cheap enough, the cheapest one is returned.
+        """
+
+        assert len(self.sampleList) > 0
+
+        # The last bin gets the probability which is left, like it does in
+        # `randomSample()'.
+        candidates = []
+        previousProb = 0
+        for i, (cumulProb, singleton) in enumerate(self.sampleList):
+            if i == len(self.sampleList) - 1:
+                cumulProb = 1
+            if cost(singleton) <= limit:
+                candidates.append((cumulProb - previousProb, singleton))
+            previousProb = cumulProb
+
+        if not candidates:
+            return min([singleton for _, singleton in self.sampleList],
+                       key=cost)
+
+        rand = random.random() * sum([prob for prob, _ in candidates])
+
+        for prob, singleton in candidates:
+            rand -= prob
+            if rand <= 0:
+                return singleton
+
+        return candidates[-1][1]
+
 # Alias class name in order to provide a more intuitive API.
 new = RandProbDist
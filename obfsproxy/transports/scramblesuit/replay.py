@@ -3,10 +3,22 @@ This module implements a mechanism to protect against replay attacks.
 
 The replay protection mechanism is based on a dictionary which caches
 previously observed keys.  New keys can be added to the dictionary and existing
-ones can be queried.  A pruning mechanism deletes expired keys from the
-dictionary.
+ones can be queried.  Keys expire after `const.EPOCH_GRANULARITY' seconds.
+
+To expire keys without walking the whole dictionary, keys are also kept in
+buckets ordered by insertion time.  Only the oldest buckets are looked at and
+a bucket is dropped as a whole once all of its keys have expired.  Adding and
+looking up keys therefore takes amortised constant time.
+
+For very high handshake rates, `BloomTracker' bounds the memory of the replay
+table at the cost of rare false positives.
 """
 
+import collections
+import hashlib
+import math
+import os
+import struct
 import time
 
 import const
@@ -16,6 +28,20 @@ import obfsproxy.common.log as logging
 log = logging.get_obfslogger()
 
 
+def new( ):
+    """
+    Return a new replay tracker as configured in `const'.
+
+    If `const.REPLAY_BLOOM_CAPACITY' is set, a `BloomTracker' for that many
+    keys per epoch is returned.  Otherwise, an exact `Tracker' is returned.
+    """
+
+    if const.REPLAY_BLOOM_CAPACITY:
+        return BloomTracker(const.REPLAY_BLOOM_CAPACITY)
+
+    return Tracker()
+
+
 class Tracker( object ):
 
     """
@@ -30,8 +56,46 @@ class Tracker( object ):
         Initialise a `Tracker' object.
         """
 
+        # Maps elements to the Unix timestamp of their insertion.
         self.table = dict()
 
+        # Lists of elements inserted during `const.REPLAY_BUCKET_LENGTH'
+        # seconds, oldest first, as (bucket start, elements) tuples.
+        self.buckets = collections.deque()
+
+    def __setstate__( self, state ):
+        """
+        Restore a pickled `Tracker' object.
+
+        State files written by older versions only contain the dictionary, so
+        the buckets are rebuilt from it.
+        """
+
+        self.__dict__.update(state)
+
+        if "buckets" not in state:
+            table, self.table = self.table, dict()
+            self.buckets = collections.deque()
+            for element, timestamp in sorted(table.iteritems(),
+                                             key=lambda item: item[1]):
+                self.insert(element, timestamp)
+
+    def insert( self, element, timestamp ):
+        """
+        Insert `element' with the given `timestamp' into the lookup table.
+
+        Elements are expected in the order of their timestamps.  Elements which
+        are older than the newest bucket are put into the newest bucket, so
+        they are deleted late rather than early.
+        """
+
+        self.table[element] = timestamp
+
+        bucketStart = timestamp - (timestamp % const.REPLAY_BUCKET_LENGTH)
+        if not self.buckets or self.buckets[-1][0] < bucketStart:
+            self.buckets.append((bucketStart, []))
+        self.buckets[-1][1].append(element)
+
     def addElement( self, element ):
         """
         Add the given `element' to the lookup table.
@@ -41,7 +105,7 @@ class Tracker( object ):
             raise LookupError("Element already present in table.")
 
         # The key is a HMAC and the value is the current Unix timestamp.
-        self.table[element] = int(time.time())
+        self.insert(element, int(time.time()))
 
     def isPresent( self, element ):
         """
@@ -51,35 +115,178 @@ class Tracker( object ):
         otherwise.
         """
 
-        log.debug("Looking for existing element in size-%d lookup table." %
+        log.debug("Looking for existing element in size-%d lookup table.",
                   len(self.table))
 
-        # Prune the replay table before looking up the given `element'.  This
-        # could be done more efficiently, e.g. by pruning every n minutes and
-        # only checking the timestamp of this particular element.
-        self.prune()
+        now = int(time.time())
+        self.prune(now)
+
+        # The bucket of `element' might not have expired as a whole yet, so
+        # its timestamp is checked as well.
+        timestamp = self.table.get(element)
 
-        return (element in self.table)
+        return (timestamp is not None) and \
+               ((now - timestamp) <= const.EPOCH_GRANULARITY)
 
-    def prune( self ):
+    def prune( self, now=None ):
         """
         Delete expired elements from the lookup table.
 
         Keys whose Unix timestamps are older than `const.EPOCH_GRANULARITY' are
-        being removed from the lookup table.
+        being removed from the lookup table, one bucket at a time.
         """
 
-        log.debug("Pruning the replay table.")
+        if now is None:
+            now = int(time.time())
 
-        deleteList = []
-        now = int(time.time())
+        # The newest possible timestamp in a bucket is one second before the
+        # start of the next bucket.
+        while self.buckets and ((now - (self.buckets[0][0] +
+               const.REPLAY_BUCKET_LENGTH - 1)) > const.EPOCH_GRANULARITY):
+
+            bucketStart, elements = self.buckets.popleft()
+            log.debug("Deleting %d expired elements.", len(elements))
+
+            bucketEnd = bucketStart + const.REPLAY_BUCKET_LENGTH
+            for element in elements:
+                # Expired elements might have been added again since.
+                if self.table.get(element, bucketEnd) < bucketEnd:
+                    del self.table[element]
+
+
+class BloomFilter( object ):
+
+    """
+    A Bloom filter over strings.
+
+    The positions of an element's bits are derived from a salted SHA256 of the
+    element, so that clients can't choose elements which collide on purpose.
+    """
+
+    def __init__( self, capacity, errorRate ):
+        """
+        Initialise a filter for `capacity' elements with a false positive rate
+        of about `errorRate'.
+        """
+
+        self.nBits = int(math.ceil(-capacity * math.log(errorRate) /
+                                   (math.log(2) ** 2)))
+        self.nHashes = max(1, int(round(self.nBits * math.log(2) /
+                                        capacity)))
+        self.bits = bytearray((self.nBits + 7) / 8)
+        self.salt = os.urandom(16)
+        self.created = int(time.time())
+
+    def positions( self, element ):
+        """
+        Return the bit positions of `element'.
+        """
+
+        # Derive all positions from two hashes (Kirsch and Mitzenmacher).
+        (hash1, hash2) = struct.unpack("!QQ", hashlib.sha256(self.salt +
+                                       element).digest()[:16])
+
+        return [(hash1 + i * hash2) % self.nBits
+                for i in xrange(self.nHashes)]
+
+    def add( self, element ):
+        """
+        Add `element' to the filter.
+
+        Return `True' if `element' was (probably) added before and `False'
+        otherwise.
+        """
+
+        bits = self.bits
+        present = True
+
+        for pos in self.positions(element):
+            mask = 1 << (pos & 7)
+            if not (bits[pos >> 3] & mask):
+                bits[pos >> 3] |= mask
+                present = False
+
+        return present
+
+    def __contains__( self, element ):
+        """
+        Return `True' if `element' was (probably) added to the filter.
+        """
+
+        for pos in self.positions(element):
+            if not (self.bits[pos >> 3] & (1 << (pos & 7))):
+                return False
+
+        return True
+
+
+class BloomTracker( object ):
+
+    """
+    Keep track of replayed keys in constant memory.
+
+    Keys are added to a Bloom filter which is replaced by a new one every
+    `const.EPOCH_GRANULARITY' seconds.  Lookups check the current and the
+    previous filter, so a key is remembered for one to two epochs.  With more
+    than `capacity' keys per epoch, the false positive rate grows, i.e., more
+    and more fresh handshakes are taken for replays.
+    """
+
+    def __init__( self, capacity, errorRate=const.REPLAY_BLOOM_ERROR_RATE ):
+        """
+        Initialise a `BloomTracker' for `capacity' keys per epoch.
+        """
+
+        self.capacity = capacity
+        self.errorRate = errorRate
+        self.current = BloomFilter(capacity, errorRate)
+        self.previous = None
+
+    def rotate( self ):
+        """
+        Start a new filter if the current one is older than an epoch.
+        """
 
-        for element in self.table.iterkeys():
-            if (now - self.table[element]) > const.EPOCH_GRANULARITY:
-                deleteList.append(element)
+        if (int(time.time()) - self.current.created) > \
+           const.EPOCH_GRANULARITY:
+            log.debug("Rotating the replay Bloom filters.")
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.errorRate)
+
+    def insert( self, element, timestamp ):
+        """
+        Insert `element' into the lookup table.
+
+        The `timestamp' is not needed since the filters expire as a whole.
+        """
+
+        self.rotate()
+        self.current.add(element)
+
+    def addElement( self, element ):
+        """
+        Add the given `element' to the lookup table.
+        """
+
+        self.rotate()
+
+        if ((self.previous is not None) and (element in self.previous)) or \
+           self.current.add(element):
+            raise LookupError("Element already present in table.")
+
+    def isPresent( self, element ):
+        """
+        Check if the given `element' was (probably) added to the lookup table.
+        """
+
+        self.rotate()
+
+        return (element in self.current) or \
+               ((self.previous is not None) and (element in self.previous))
+
+    def prune( self ):
+        """
+        Forget about keys which are older than two epochs.
+        """
 
-        # We can't delete from a dictionary while iterating over it; therefore
-        # this construct.
-        for elem in deleteList:
-            log.debug("Deleting expired element.")
-            del self.table[elem]
+        self.rotate()
@@ -9,8 +9,14 @@ http://www.cs.kau.se/philwint/scramblesuit/
 from twisted.internet import reactor
 
 import obfsproxy.transports.base as base
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+import obfsproxy.common.executor as executor
 import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.timerwheel as timerwheel
+import obfsproxy.network.workers as workers
 
+import math
 import random
 import base64
 import yaml
@@ -26,10 +32,17 @@ import ticket
 import uniformdh
 import state
 import fifobuf
+import handshake
 
 
 log = logging.get_obfslogger()
 
+# How long inter-arrival time obfuscation held back bursts.
+iatDelay = metrics.IAT_DELAY_SECONDS.labels(const.TRANSPORT_NAME.lower())
+
+# How much padding closed circuits cost, relative to their data.
+paddingOverhead = metrics.PADDING_OVERHEAD.labels(const.TRANSPORT_NAME.lower())
+
 class ReadPassFile(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         with open(values) as f:
@@ -46,6 +59,16 @@ class ScrambleSuitTransport( base.BaseTransport ):
     modules.
     """
 
+    has_handshake = True
+
+    # Inter-arrival time obfuscation mode and minimum rate (in bytes per
+    # second) in the `adaptive' mode.
+    iatMode = const.IAT_MODE
+    iatMinRate = const.IAT_MIN_RATE
+
+    # The maximum padding as a fraction of the padded data, or `None'.
+    paddingBudget = const.PADDING_BUDGET
+
     def __init__( self ):
         """
         Initialise a ScrambleSuitTransport object.
@@ -66,16 +89,21 @@ class ScrambleSuitTransport( base.BaseTransport ):
         # Buffer for outgoing data.
         self.sendBuf = ""
 
-        # Buffer for inter-arrival time obfuscation.
+        # Buffer for inter-arrival time obfuscation, when the data in it
+        # started to wait and the timer of the next flushPieces() call.
         self.choppingBuf = fifobuf.Buffer()
+        self.burstStart = None
+        self.flushCall = None
 
         # AES instances to decrypt incoming and encrypt outgoing data.
         self.sendCrypter = mycrypto.PayloadCrypter()
         self.recvCrypter = mycrypto.PayloadCrypter()
 
-        # Packet morpher to modify the protocol's packet length distribution.
-        self.pktMorpher = packetmorpher.new(self.srvState.pktDist
-                                            if self.weAreServer else None)
+        # Packet morpher to modify the protocol's packet length distribution,
+        # within the circuit's padding budget.
+        self.pktMorpher = packetmorpher.new(
+            self.srvState.pktDist if self.weAreServer else None,
+            packetmorpher.PaddingBudget(self.paddingBudget))
 
         # Inter-arrival time morpher to obfuscate inter arrival times.
         self.iatMorpher = self.srvState.iatDist if self.weAreServer else \
@@ -89,6 +117,16 @@ class ScrambleSuitTransport( base.BaseTransport ):
         # decrypted but not yet authenticated.
         self.decryptedTicket = False
 
+        # Used by the server-side to locate and verify the HMAC of a session
+        # ticket handshake while it arrives.
+        self.ticketParser = handshake.HandshakeParser(const.TICKET_LENGTH)
+
+        # Used by the client-side: `True' once we asked the server for extra
+        # session tickets.  Used by the server-side: the number of extra
+        # session tickets we issued.
+        self.requestedTickets = False
+        self.extraTickets = 0
+
         # If we are in external mode we should already have a shared
         # secret set up because of validate_external_mode_cli().
         if self.weAreExternal:
@@ -119,7 +157,8 @@ class ScrambleSuitTransport( base.BaseTransport ):
         cls.weAreExternal = transportConfig.weAreExternal
 
         # If we are server and in managed mode, we should get the
-        # shared secret from the server transport options.
+        # shared secret, the inter-arrival time obfuscation options and the
+        # padding budget from the server transport options.
         if cls.weAreServer and not cls.weAreExternal:
             cfg  = transportConfig.getServerTransportOptions()
             if cfg and "password" in cfg:
@@ -132,7 +171,20 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
                 cls.uniformDHSecret = cls.uniformDHSecret.strip()
 
+            try:
+                cls.iatMode, cls.iatMinRate = util.parseIATOptions(cfg or {},
+                                              cls.iatMode, cls.iatMinRate)
+                cls.paddingBudget = util.parsePaddingBudget(cfg or {},
+                                                            cls.paddingBudget)
+            except ValueError as error:
+                raise base.TransportSetupFailed(str(error))
+
         if cls.weAreServer:
+            # Our workers must reject each other's replays and accept each
+            # other's session tickets.
+            if workers.pool.isWorker() or workers.pool.isSupervisor():
+                state.setShared(True)
+
             if not hasattr(cls, "uniformDHSecret"):
                 log.debug("Using fallback password for descriptor file.")
                 srv = state.load()
@@ -150,6 +202,13 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
             state.writeServerPassword(cls.uniformDHSecret)
 
+        # Our UniformDH handshakes are computed by the handshake executor,
+        # and keypairs should be ready before the first connection.  The
+        # supervisor of worker processes doesn't do handshakes.
+        if not workers.pool.isSupervisor():
+            executor.executor.start()
+            obfs3_dh.pool.refill()
+
     @classmethod
     def get_public_server_options( cls, transportOptions ):
         """
@@ -170,7 +229,8 @@ class ScrambleSuitTransport( base.BaseTransport ):
                                 base64.b32encode(srv.fallbackPassword)}
             cls.uniformDHSecret = srv.fallbackPassword
 
-        return transportOptions
+        # The inter-arrival time obfuscation options only concern us.
+        return {"password": transportOptions["password"]}
 
     def deriveSecrets( self, masterKey ):
         """
@@ -196,9 +256,10 @@ class ScrambleSuitTransport( base.BaseTransport ):
         self.sendCrypter.setSessionKey(okm[0:32],  okm[32:40])
         self.recvCrypter.setSessionKey(okm[40:72], okm[72:80])
 
-        # Set the keys for the two HMACs protecting our data integrity.
-        self.sendHMAC = okm[80:112]
-        self.recvHMAC = okm[112:144]
+        # Set the keys for the two HMACs protecting our data integrity.  Their
+        # key schedules are computed once, here.
+        self.sendHMAC = mycrypto.HMACContext(okm[80:112])
+        self.recvHMAC = mycrypto.HMACContext(okm[112:144])
 
         if self.weAreServer:
             self.sendHMAC, self.recvHMAC = self.recvHMAC, self.sendHMAC
@@ -233,6 +294,7 @@ class ScrambleSuitTransport( base.BaseTransport ):
             # yet whether the server accepted the ticket.
             log.debug("Switching to state ST_CONNECTED.")
             self.protoState = const.ST_CONNECTED
+            self.circuit.handshakeCompleted()
 
             self.flushSendBuffer()
 
@@ -251,29 +313,33 @@ class ScrambleSuitTransport( base.BaseTransport ):
         payload.
         """
 
-        log.debug("Processing %d bytes of outgoing data." % len(data))
+        log.debug_packet("Processing %d bytes of outgoing data.", len(data))
 
         # Wrap the application's data in ScrambleSuit protocol messages.
-        messages = message.createProtocolMessages(data, flags=flags)
-        blurb = "".join([msg.encryptAndHMAC(self.sendCrypter,
-                        self.sendHMAC) for msg in messages])
+        frames = message.createFrames(data, flags=flags)
 
         # Flush data chunk for chunk to obfuscate inter-arrival times.
-        if const.USE_IAT_OBFUSCATION:
+        if self.iatMode != const.IAT_MODE_OFF:
 
-            if len(self.choppingBuf) == 0:
-                self.choppingBuf.write(blurb)
-                reactor.callLater(self.iatMorpher.randomSample(),
-                                  self.flushPieces)
-            else:
-                # flushPieces() is still busy processing the chopping buffer.
-                self.choppingBuf.write(blurb)
+            # Unless the chopping buffer is empty, flushPieces() is still busy
+            # processing it.
+            idle = (len(self.choppingBuf) == 0)
+
+            for piece in message.encryptFrames(self.sendCrypter,
+                                               self.sendHMAC, frames):
+                self.choppingBuf.write(piece)
+
+            if idle:
+                self.burstStart = reactor.seconds()
+                self.flushCall = timerwheel.wheel.call_later(
+                    self.iatMorpher.randomSample(), self.flushPieces)
 
         else:
-            padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
-                                                  len(blurb))
-            self.circuit.downstream.write(blurb + padBlurb)
+            # Pad the burst, and encrypt and send it in one go.
+            burstLen = len(data) + len(frames) * const.HDR_LENGTH
+            frames += self.pktMorpher.getPaddingFrames(burstLen)
+            self.circuit.downstream.writeSequence(
+                message.encryptFrames(self.sendCrypter, self.sendHMAC, frames))
 
     def flushPieces( self ):
         """
@@ -284,23 +350,55 @@ class ScrambleSuitTransport( base.BaseTransport ):
         to flush the data.  Shortly thereafter, this function is called again
         to write the next chunk of data.  The delays in between subsequent
         write calls are controlled by the inter-arrival time obfuscator.
+
+        Chunks are MTU-sized, unless the `adaptive' mode needs larger ones to
+        keep up the circuit's minimum rate or to limit its backlog.
         """
 
-        # Drain and send an MTU-sized chunk from the chopping buffer.
-        if len(self.choppingBuf) > const.MTU:
+        delay = self.iatMorpher.randomSample()
+
+        chunkLen = const.MTU
+        if self.iatMode == const.IAT_MODE_ADAPTIVE:
+            chunkLen = self.adaptiveChunkLength(delay)
 
-            self.circuit.downstream.write(self.choppingBuf.read(const.MTU))
+        # Drain and send a chunk from the chopping buffer.
+        if len(self.choppingBuf) > chunkLen:
+
+            self.circuit.downstream.write(self.choppingBuf.read(chunkLen))
 
         # Drain and send whatever is left in the output buffer.
         else:
             blurb = self.choppingBuf.read()
-            padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
-                                                  len(blurb))
-            self.circuit.downstream.write(blurb + padBlurb)
+            padding = message.encryptFrames(self.sendCrypter, self.sendHMAC,
+                          self.pktMorpher.getPaddingFrames(len(blurb)))
+            self.circuit.downstream.writeSequence([blurb] + padding)
+
+            burstDelay = reactor.seconds() - self.burstStart
+            log.debug("Inter-arrival time obfuscation delayed the burst by "
+                      "%.3f seconds.", burstDelay)
+            iatDelay.observe(burstDelay)
+            self.flushCall = None
             return
 
-        reactor.callLater(self.iatMorpher.randomSample(), self.flushPieces)
+        self.flushCall = timerwheel.wheel.call_later(delay, self.flushPieces)
+
+    def adaptiveChunkLength( self, delay ):
+        """
+        Return how many bytes to send before waiting for `delay' seconds in the
+        `adaptive' inter-arrival time obfuscation mode.
+
+        Enough MTU-sized chunks are sent to keep up `self.iatMinRate' during
+        the delay.  If more than `const.IAT_MAX_BACKLOG' bytes are waiting,
+        the excess is sent as well.
+        """
+
+        chunks = max(1, int(math.ceil(self.iatMinRate * delay / const.MTU)))
+
+        excess = len(self.choppingBuf) - const.IAT_MAX_BACKLOG
+        if excess > 0:
+            chunks = max(chunks, int(math.ceil(float(excess) / const.MTU)))
+
+        return chunks * const.MTU
 
     def processMessages( self, data ):
         """
@@ -334,20 +432,22 @@ class ScrambleSuitTransport( base.BaseTransport ):
                                       msg.payload[const.MASTER_KEY_LENGTH:
                                                   const.MASTER_KEY_LENGTH +
                                                   const.TICKET_LENGTH], peer)
+                self.requestTickets(peer)
+
+            # Issue the extra session tickets the client asked for.
+            elif self.weAreServer and (msg.flags == const.FLAG_NEW_TICKET):
+                self.sendExtraTickets(ord(msg.payload[0]) if msg.payload
+                                      else 1)
 
             # Use the PRNG seed to generate the same probability distributions
             # as the server.  That's where the polymorphism comes from.
             elif self.weAreClient and (msg.flags == const.FLAG_PRNG_SEED):
                 assert len(msg.payload) == const.PRNG_SEED_LENGTH
                 log.debug("Obtained PRNG seed.")
-                prng = random.Random(msg.payload)
-                pktDist = probdist.new(lambda: prng.randint(const.HDR_LENGTH,
-                                                            const.MTU),
-                                       seed=msg.payload)
-                self.pktMorpher = packetmorpher.new(pktDist)
-                self.iatMorpher = probdist.new(lambda: prng.random() %
-                                               const.MAX_PACKET_DELAY,
-                                               seed=msg.payload)
+                pktDist, self.iatMorpher = probdist.seededDistributions(
+                                           msg.payload)
+                self.pktMorpher = packetmorpher.new(pktDist,
+                                                    self.pktMorpher.budget)
 
             else:
                 log.warning("Invalid message flags: %d." % msg.flags)
@@ -366,11 +466,12 @@ class ScrambleSuitTransport( base.BaseTransport ):
             return
 
         # Flush the buffered data, the application is so eager to send.
-        log.debug("Flushing %d bytes of buffered application data." %
+        log.debug("Flushing %d bytes of buffered application data.",
                   len(self.sendBuf))
 
-        self.sendRemote(self.sendBuf)
+        sendBuf = self.sendBuf
         self.sendBuf = ""
+        self.sendRemote(sendBuf)
 
     def receiveTicket( self, data ):
         """
@@ -381,8 +482,9 @@ class ScrambleSuitTransport( base.BaseTransport ):
         succeed, `True' is returned.  Otherwise, `False' is returned.
         """
 
-        if len(data) < (const.TICKET_LENGTH + const.MARK_LENGTH +
-                        const.HMAC_SHA256_128_LENGTH):
+        if self.ticketParser.excluded or \
+           (len(data) < (const.TICKET_LENGTH + const.MARK_LENGTH +
+                         const.HMAC_SHA256_128_LENGTH)):
             return False
 
         potentialTicket = data.peek()
@@ -396,47 +498,28 @@ class ScrambleSuitTransport( base.BaseTransport ):
                 self.deriveSecrets(newTicket.masterKey)
                 self.decryptedTicket = True
             else:
+                # More data won't make the ticket valid.
+                self.ticketParser.exclude()
                 return False
 
-        # First, find the mark to efficiently locate the HMAC.
-        mark = mycrypto.HMAC_SHA256_128(self.recvHMAC,
-                                        potentialTicket[:const.TICKET_LENGTH])
-
-        index = util.locateMark(mark, potentialTicket)
-        if not index:
-            return False
-
-        # Now, verify if the HMAC is valid.
-        existingHMAC = potentialTicket[index + const.MARK_LENGTH:
-                                       index + const.MARK_LENGTH +
-                                       const.HMAC_SHA256_128_LENGTH]
-        authenticated = False
-        for epoch in util.expandedEpoch():
-            myHMAC = mycrypto.HMAC_SHA256_128(self.recvHMAC,
-                                              potentialTicket[0:index + \
-                                              const.MARK_LENGTH] + epoch)
-
-            if util.isValidHMAC(myHMAC, existingHMAC, self.recvHMAC):
-                authenticated = True
-                break
-
-            log.debug("HMAC invalid.  Trying next epoch value.")
-
-        if not authenticated:
-            log.warning("Could not verify the authentication message's HMAC.")
+        # Locate and verify the HMAC, picking up where we left off last time.
+        result = self.ticketParser.parse(self.recvHMAC, potentialTicket)
+        if result is None:
             return False
+        length, existingHMAC, _ = result
 
         # Do nothing if the ticket is replayed.  Immediately closing the
-        # connection would be suspicious.
-        if self.srvState.isReplayed(existingHMAC):
+        # connection would be suspicious.  Checking and adding the HMAC is one
+        # step, so that no other process can add it in between.
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Adding the HMAC authenticating the ticket message to " \
+                      "the replay table: %s.", existingHMAC.encode('hex'))
+        if not self.srvState.registerKey(existingHMAC):
             log.warning("The HMAC was already present in the replay table.")
+            self.ticketParser.exclude()
             return False
 
-        data.drain(index + const.MARK_LENGTH + const.HMAC_SHA256_128_LENGTH)
-
-        log.debug("Adding the HMAC authenticating the ticket message to the " \
-                  "replay table: %s." % existingHMAC.encode('hex'))
-        self.srvState.registerKey(existingHMAC)
+        data.drain(length)
 
         log.debug("Switching to state ST_CONNECTED.")
         self.protoState = const.ST_CONNECTED
@@ -458,8 +541,36 @@ class ScrambleSuitTransport( base.BaseTransport ):
         # Buffer data we are not ready to transmit yet.
         else:
             self.sendBuf += data.read()
-            log.debug("Buffered %d bytes of outgoing data." %
-                      len(self.sendBuf))
+            log.debug_packet("Buffered %d bytes of outgoing data.",
+                             len(self.sendBuf))
+
+    def circuitDestroyed( self, reason, side ):
+        """
+        Stop flushing held back data, and log and account for how much padding
+        the circuit cost.
+        """
+
+        if self.flushCall is not None:
+            self.flushCall.cancel()
+            self.flushCall = None
+
+        budget = self.pktMorpher.budget
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Padding stats: %s.", budget.getStats())
+        if budget.dataBytes:
+            paddingOverhead.observe(budget.overhead())
+
+    def upstreamBacklog( self ):
+        """
+        Return the number of bytes of application data we are holding back.
+
+        Application data is held back in `self.sendBuf' until the remote
+        machine is authenticated and in `self.choppingBuf' until
+        flushPieces() gets to write it.
+        """
+
+        return len(self.sendBuf) + len(self.choppingBuf)
 
     def sendTicketAndSeed( self ):
         """
@@ -478,6 +589,47 @@ class ScrambleSuitTransport( base.BaseTransport ):
                         flags=const.FLAG_PRNG_SEED)
         self.flushSendBuffer()
 
+    def requestTickets( self, bridge ):
+        """
+        Ask the server for as many extra session tickets as we need to have
+        `const.TICKET_POOL_SIZE' unused tickets for `bridge'.
+
+        The request is a FLAG_NEW_TICKET message whose payload is the number of
+        tickets.  We only ask once per connection.  Servers which don't know
+        about extra tickets ignore the request.
+        """
+
+        if self.requestedTickets:
+            return
+        self.requestedTickets = True
+
+        missing = const.TICKET_POOL_SIZE - ticket.countStoredTickets(bridge)
+        if missing <= 0:
+            return
+
+        log.debug("Asking the server for %d extra session tickets.", missing)
+        self.sendRemote(chr(min(missing, const.MAX_EXTRA_TICKETS)),
+                        flags=const.FLAG_NEW_TICKET)
+
+    def sendExtraTickets( self, count ):
+        """
+        Send up to `count' extra session tickets to the client.
+
+        No more than `const.MAX_EXTRA_TICKETS' extra tickets are issued per
+        connection.
+        """
+
+        count = min(count, const.MAX_EXTRA_TICKETS - self.extraTickets)
+        if count <= 0:
+            log.warning("The client asked for too many session tickets.")
+            return
+
+        log.debug("Sending %d extra session tickets to the client.", count)
+        self.extraTickets += count
+        for _ in xrange(count):
+            self.sendRemote(ticket.issueTicketAndKey(self.srvState),
+                            flags=const.FLAG_NEW_TICKET)
+
     def receivedDownstream( self, data ):
         """
         Receives and processes data coming from the remote machine.
@@ -504,25 +656,13 @@ class ScrambleSuitTransport( base.BaseTransport ):
             # First, try to interpret the incoming data as session ticket.
             if self.receiveTicket(data):
                 log.debug("Ticket authentication succeeded.")
+                self.circuit.handshakeCompleted()
 
                 self.sendTicketAndSeed()
 
             # Second, interpret the data as a UniformDH handshake.
-            elif self.uniformdh.receivePublicKey(data, self.deriveSecrets,
-                    self.srvState):
-                # Now send the server's UniformDH public key to the client.
-                handshakeMsg = self.uniformdh.createHandshake()
-
-                log.debug("Sending %d bytes of UniformDH handshake and "
-                          "session ticket." % len(handshakeMsg))
-
-                self.circuit.downstream.write(handshakeMsg)
-                log.debug("UniformDH authentication succeeded.")
-
-                log.debug("Switching to state ST_CONNECTED.")
-                self.protoState = const.ST_CONNECTED
-
-                self.sendTicketAndSeed()
+            elif self.startKeyExchange(data, self.srvState):
+                return
 
             elif len(data) > const.MAX_HANDSHAKE_LENGTH:
                 self.protoState = const.ST_AUTH_FAILED
@@ -540,20 +680,95 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         elif self.weAreClient and (self.protoState == const.ST_WAIT_FOR_AUTH):
 
-            if not self.uniformdh.receivePublicKey(data, self.deriveSecrets):
+            if not self.startKeyExchange(data):
                 log.debug("Unable to finish UniformDH handshake just yet.")
-                return
+            return
 
-            log.debug("UniformDH authentication succeeded.")
+        if self.protoState == const.ST_CONNECTED:
 
-            log.debug("Switching to state ST_CONNECTED.")
-            self.protoState = const.ST_CONNECTED
-            self.flushSendBuffer()
+            self.processMessages(data.read())
 
-        if self.protoState == const.ST_CONNECTED:
+    def startKeyExchange( self, data, srvState=None ):
+        """
+        Extract the remote UniformDH public key and start the key exchange.
+
+        If `data' does not contain a valid UniformDH handshake (yet), `False'
+        is returned.  Otherwise, we switch to ST_WAIT_FOR_DH until the
+        handshake executor has computed the master key, at which point
+        `finishKeyExchange()' takes over.  Data arriving in the meantime is
+        left in `data'.
+        """
+
+        remotePublicKey = self.uniformdh.extractPublicKey(data, srvState)
+        if not remotePublicKey:
+            return False
+
+        log.debug("Switching to state ST_WAIT_FOR_DH.")
+        self.protoState = const.ST_WAIT_FOR_DH
+
+        d = self.uniformdh.computeMasterKey(remotePublicKey)
+        d.addCallback(self.finishKeyExchange, data)
+        d.addErrback(self.keyExchangeFailed)
+
+        return True
+
+    def finishKeyExchange( self, masterKey, data ):
+        """
+        Complete the UniformDH handshake using the computed `masterKey'.
+
+        The server answers with its own UniformDH handshake followed by a
+        session ticket while the client flushes the data it has queued.  Then,
+        the data which arrived during the key exchange is processed.
+        """
+
+        if self.circuit.closed:
+            return
+
+        self.deriveSecrets(masterKey)
+
+        if self.weAreServer:
+            # Now send the server's UniformDH public key to the client.
+            handshakeMsg = self.uniformdh.createHandshake()
 
+            log.debug("Sending %d bytes of UniformDH handshake and "
+                      "session ticket.", len(handshakeMsg))
+
+            self.circuit.downstream.write(handshakeMsg)
+
+        log.debug("UniformDH authentication succeeded.")
+
+        log.debug("Switching to state ST_CONNECTED.")
+        self.protoState = const.ST_CONNECTED
+        self.circuit.handshakeCompleted()
+
+        if self.weAreServer:
+            self.sendTicketAndSeed()
+        else:
+            self.flushSendBuffer()
+
+        if len(data) > 0:
             self.processMessages(data.read())
 
+    def keyExchangeFailed( self, failure ):
+        """
+        Close the circuit because the UniformDH key exchange failed.
+
+        This covers failures of the key computation as well as exceptions
+        raised while completing the handshake, e.g., a bad HMAC in the data
+        which arrived during the key exchange.  Failures other than invalid
+        data and a full handshake backlog are unexpected and logged as errors.
+        """
+
+        if failure.check(base.PluggableTransportError,
+                         executor.HandshakeBacklogFull):
+            log.info("UniformDH key exchange failed: %s" %
+                     failure.getErrorMessage())
+        else:
+            log.error("UniformDH key exchange failed unexpectedly:\n%s" %
+                      failure.getTraceback())
+
+        self.circuit.close()
+
     @classmethod
     def register_external_mode_cli( cls, subparser ):
         """
@@ -576,6 +791,23 @@ class ScrambleSuitTransport( base.BaseTransport ):
                                action=ReadPassFile,
                                dest="uniformDHSecret")
 
+        subparser.add_argument("--iat-mode",
+                               choices=const.IAT_MODES,
+                               help="Inter-arrival time obfuscation mode",
+                               dest="iatMode")
+
+        subparser.add_argument("--iat-min-rate",
+                               type=int,
+                               help="Minimum bytes per second of a circuit " \
+                                    "in the adaptive IAT mode",
+                               dest="iatMinRate")
+
+        subparser.add_argument("--padding-budget",
+                               type=str,
+                               help="Maximum padding as a fraction of the " \
+                                    "padded data, or `off'",
+                               dest="paddingBudget")
+
         super(ScrambleSuitTransport, cls).register_external_mode_cli(subparser)
 
     @classmethod
@@ -603,6 +835,21 @@ class ScrambleSuitTransport( base.BaseTransport ):
             raise base.PluggableTransportError(
                 "Pluggable Transport args invalid: %s" % args )
 
+        options = dict()
+        if getattr(args, "iatMode", None) is not None:
+            options["iat-mode"] = args.iatMode
+        if getattr(args, "iatMinRate", None) is not None:
+            options["iat-min-rate"] = args.iatMinRate
+        if getattr(args, "paddingBudget", None) is not None:
+            options["padding-budget"] = args.paddingBudget
+        try:
+            cls.iatMode, cls.iatMinRate = util.parseIATOptions(options,
+                                          cls.iatMode, cls.iatMinRate)
+            cls.paddingBudget = util.parsePaddingBudget(options,
+                                                        cls.paddingBudget)
+        except ValueError as error:
+            raise base.PluggableTransportError(str(error))
+
         if uniformDHSecret:
             rawLength = len(uniformDHSecret)
             if rawLength != const.SHARED_SECRET_LENGTH:
@@ -619,21 +866,36 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         The SOCKS authentication mechanism is (ab)used to pass arguments to
         pluggable transports.  This method receives these arguments and parses
-        them.  As argument, we only expect a UniformDH shared secret.
+        them.  We expect a UniformDH shared secret and, optionally, the
+        inter-arrival time obfuscation options `iat-mode' and `iat-min-rate'
+        and the `padding-budget'.
         """
 
         log.debug("Received the following arguments over SOCKS: %s." % args)
 
-        if len(args) != 1:
-            raise base.SOCKSArgsError("Too many SOCKS arguments "
-                                      "(expected 1 but got %d)." % len(args))
+        options = dict()
+        for arg in args:
+            key, _, value = arg.partition("=")
+            if key not in ("password", "iat-mode", "iat-min-rate",
+                           "padding-budget"):
+                raise base.SOCKSArgsError("Unknown SOCKS argument `%s'." %
+                                          key)
+            options[key] = value
 
         # The ScrambleSuit specification defines that the shared secret is
         # called "password".
-        if not args[0].startswith("password="):
-            raise base.SOCKSArgsError("The SOCKS argument must start with "
+        if "password" not in options:
+            raise base.SOCKSArgsError("The SOCKS arguments must include "
                                       "`password='.")
 
+        try:
+            self.iatMode, self.iatMinRate = util.parseIATOptions(options,
+                                            self.iatMode, self.iatMinRate)
+            self.pktMorpher.budget.fraction = util.parsePaddingBudget(options,
+                                              self.paddingBudget)
+        except ValueError as error:
+            raise base.SOCKSArgsError(str(error))
+
         # A shared secret might already be set if obfsproxy is in external
         # mode.
         if self.uniformDHSecret:
@@ -642,12 +904,12 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         try:
             self.uniformDHSecret = base64.b32decode(util.sanitiseBase32(
-                                          args[0].split('=')[1].strip()))
+                                          options["password"].strip()))
         except TypeError as error:
             log.error(error.message)
             raise base.PluggableTransportError("Given password '%s' is not " \
                     "valid Base32!  Run 'generate_password.py' to generate " \
-                    "a good password." % args[0].split('=')[1].strip())
+                    "a good password." % options["password"].strip())
 
         rawLength = len(self.uniformDHSecret)
         if rawLength != const.SHARED_SECRET_LENGTH:
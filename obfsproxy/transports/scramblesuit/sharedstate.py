@@ -0,0 +1,245 @@
+"""
+This module provides server state which is shared by several processes.
+
+Several obfsproxy processes (like the workers started by `--workers') can serve
+the same ScrambleSuit bridge if they share its replay table, its session ticket
+keys and its PRNG seed.  These are kept in a file in the state directory which
+every process maps into its memory.  Processes take turns using an `fcntl'
+lock on the file, so checking for and adding a replayed HMAC is atomic across
+processes.
+
+The replay table is a hash table of fixed-size slots, each holding an HMAC and
+the Unix timestamp at which it was added.  An HMAC lives in one of the
+`const.SHARED_REPLAY_PROBES' slots following its home slot, which is derived
+from a salted hash so that clients can't make HMACs collide on purpose.  Slots
+whose HMACs have expired are reused.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+import const
+import mycrypto
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+MAGIC = "ScrambleSuitShm1"
+
+# The header: magic, hash salt, number of slots, creation time of the ticket
+# keys, whether there are old ticket keys, the ticket keys and the PRNG seed.
+HEADER = struct.Struct("!16s16sLQB%ds%ds%ds%ds%ds" %
+                       (const.TICKET_AES_KEY_LENGTH,
+                        const.TICKET_HMAC_KEY_LENGTH,
+                        const.TICKET_AES_KEY_LENGTH,
+                        const.TICKET_HMAC_KEY_LENGTH,
+                        const.PRNG_SEED_LENGTH))
+
+# A slot of the replay table: an HMAC and the time it was added.  A timestamp
+# of 0 marks a slot which was never used.
+SLOT = struct.Struct("!%dsL" % const.HMAC_SHA256_128_LENGTH)
+
+
+class SharedState( object ):
+
+    """
+    Replay table, session ticket keys and PRNG seed, shared between processes.
+    """
+
+    def __init__( self, fileName, srvState, nSlots=None ):
+        """
+        Open (or create) the shared state in `fileName'.
+
+        A new shared state gets its ticket keys and PRNG seed from the server
+        state `srvState' and room for `nSlots' HMACs.  An existing one keeps
+        its own.
+        """
+
+        if nSlots is None:
+            nSlots = const.SHARED_REPLAY_SLOTS
+
+        self.fileName = fileName
+        self.fd = os.open(fileName, os.O_RDWR | os.O_CREAT, 0600)
+
+        with self.locked():
+            if os.fstat(self.fd).st_size == 0:
+                log.info("Creating shared state file `%s'." % fileName)
+                os.ftruncate(self.fd, HEADER.size + (nSlots * SLOT.size))
+                self.mm = mmap.mmap(self.fd, 0)
+                self.writeHeader(os.urandom(16), nSlots, srvState.keyCreation,
+                                 srvState.aesKey, srvState.hmacKey,
+                                 srvState.oldAesKey, srvState.oldHmacKey,
+                                 srvState.prngSeed)
+            else:
+                self.mm = mmap.mmap(self.fd, 0)
+
+            header = HEADER.unpack_from(self.mm, 0)
+
+        if header[0] != MAGIC:
+            raise ValueError("`%s' is not a shared state file." % fileName)
+
+        self.salt, self.nSlots = header[1], header[2]
+        self.prngSeed = header[-1]
+
+    @contextlib.contextmanager
+    def locked( self, operation=fcntl.LOCK_EX ):
+        """
+        Hold the lock on the shared state while in this context.
+        """
+
+        fcntl.lockf(self.fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def writeHeader( self, salt, nSlots, keyCreation, aesKey, hmacKey,
+                     oldAesKey, oldHmacKey, prngSeed ):
+        """
+        Write the header of the shared state.  The lock must be held.
+        """
+
+        hasOldKeys = (oldAesKey is not None) and (oldHmacKey is not None)
+
+        HEADER.pack_into(self.mm, 0, MAGIC, salt, nSlots, keyCreation,
+                         hasOldKeys, aesKey, hmacKey, oldAesKey or "",
+                         oldHmacKey or "", prngSeed)
+
+    def readKeys( self ):
+        """
+        Return the tuple (keyCreation, aesKey, hmacKey, oldAesKey, oldHmacKey)
+        of session ticket keys.  The old keys are `None' if there are none.
+        """
+
+        with self.locked(fcntl.LOCK_SH):
+            (_, _, _, keyCreation, hasOldKeys, aesKey, hmacKey, oldAesKey,
+             oldHmacKey, _) = HEADER.unpack_from(self.mm, 0)
+
+        if not hasOldKeys:
+            oldAesKey = oldHmacKey = None
+
+        return (keyCreation, aesKey, hmacKey, oldAesKey, oldHmacKey)
+
+    def checkKeys( self, srvState ):
+        """
+        Rotate the session ticket keys if they are too old and copy them to the
+        server state `srvState'.
+
+        Only one process rotates the keys; the others pick up its new keys.
+        """
+
+        with self.locked():
+            (_, _, _, keyCreation, _, aesKey, hmacKey, _, _,
+             _) = HEADER.unpack_from(self.mm, 0)
+
+            if (int(time.time()) - keyCreation) > const.KEY_ROTATION_TIME:
+                log.info("Rotating the shared session ticket keys.")
+                self.writeHeader(self.salt, self.nSlots, int(time.time()),
+                        mycrypto.strongRandom(const.TICKET_AES_KEY_LENGTH),
+                        mycrypto.strongRandom(const.TICKET_HMAC_KEY_LENGTH),
+                        aesKey, hmacKey, self.prngSeed)
+
+        (srvState.keyCreation, srvState.aesKey, srvState.hmacKey,
+         srvState.oldAesKey, srvState.oldHmacKey) = self.readKeys()
+
+    def homeSlot( self, element ):
+        """
+        Return the offset of the first slot which might hold `element'.
+        """
+
+        index = struct.unpack("!Q", hashlib.sha256(self.salt +
+                                                   element).digest()[:8])[0]
+
+        return HEADER.size + ((index % self.nSlots) * SLOT.size)
+
+    def slots( self, element ):
+        """
+        Return the offsets of all slots which might hold `element'.
+        """
+
+        home = self.homeSlot(element)
+        end = HEADER.size + (self.nSlots * SLOT.size)
+
+        offsets = []
+        for i in xrange(const.SHARED_REPLAY_PROBES):
+            offset = home + (i * SLOT.size)
+            if offset >= end:
+                offset -= (self.nSlots * SLOT.size)
+            offsets.append(offset)
+
+        return offsets
+
+    def find( self, element, now ):
+        """
+        Look for `element' in the replay table.  The lock must be held.
+
+        Return the tuple (present, offset) where `offset' is the slot where
+        `element' can be added if it's not present.
+        """
+
+        free = None
+        oldest = None
+
+        for offset in self.slots(element):
+            slotElement, timestamp = SLOT.unpack_from(self.mm, offset)
+
+            # Elements are added to the first free slot, so none of them can be
+            # behind a slot which was never used.
+            if timestamp == 0:
+                return (False, offset if free is None else free)
+
+            if (now - timestamp) > const.EPOCH_GRANULARITY:
+                if free is None:
+                    free = offset
+                continue
+
+            if slotElement == element:
+                return (True, offset)
+
+            if (oldest is None) or (timestamp < oldest[0]):
+                oldest = (timestamp, offset)
+
+        if free is None:
+            log.warning("The shared replay table is full.  Evicting an HMAC "
+                        "before it expired.")
+            free = oldest[1]
+
+        return (False, free)
+
+    def isPresent( self, element ):
+        """
+        Return `True' if `element' is in the replay table.
+        """
+
+        with self.locked(fcntl.LOCK_SH):
+            return self.find(element, int(time.time()))[0]
+
+    def addElement( self, element ):
+        """
+        Atomically add `element' to the replay table unless it's there.
+
+        Return `True' if `element' was added and `False' if it was present.
+        """
+
+        now = int(time.time())
+
+        with self.locked():
+            present, offset = self.find(element, now)
+            if not present:
+                SLOT.pack_into(self.mm, offset, element, now)
+
+        return not present
+
+    def close( self ):
+        """
+        Unmap and close the shared state.
+        """
+
+        self.mm.close()
+        os.close(self.fd)
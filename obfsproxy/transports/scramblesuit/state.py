@@ -15,7 +15,9 @@ import random
 
 import const
 import replay
+import journal
 import mycrypto
+import sharedstate
 import probdist
 import base64
 
@@ -23,32 +25,81 @@ import obfsproxy.common.log as logging
 
 log = logging.get_obfslogger()
 
+# The server's state as loaded by this process.  It is shared by all of the
+# process's connections.
+_state = None
+
+# Whether the state is shared with other server processes (see `setShared()').
+_shared = False
+
+def setShared( shared ):
+    """
+    Set whether the replay table, the session ticket keys and the PRNG seed are
+    shared with the other server processes which use the same state directory.
+
+    ScrambleSuit's `setup()' turns this on when running with `--workers'.  A
+    state which was loaded already is shared the next time `load()' is called.
+    """
+
+    global _shared
+
+    _shared = shared
+
 def load( ):
     """
     Load the server's state object from file.
 
     The server's state file is loaded and the state object returned.  If no
-    state file is found, a new one is created and returned.
+    state file is found, a new one is created and returned.  HMACs which were
+    added to the replay table since the state file was written are added from
+    the replay journal.
+
+    The state object is only loaded once and then shared.  Later calls only
+    add the HMACs which other processes appended to the replay journal since.
+    If another process wrote a new state file, it's loaded into the same state
+    object, so that the connections which hold on to it see the new state too.
+
+    If the state is shared (see `setShared()'), the replay table, the session
+    ticket keys and the PRNG seed are shared with other processes instead (see
+    `sharedstate').
     """
 
+    global _state
+
     stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
 
+    if (_state is not None) and (_state.stateFile == stateFile):
+        if _shared and (_state.shared is None):
+            _state.openSharedState()
+        if _state.shared is not None:
+            return _state
+
+        if not (_state.journal.snapshotting or
+                (_state.snapshotId == journal.fileIdentity(stateFile))):
+            _state.reload()
+        _state.journal.replay(_state.replayTracker)
+        return _state
+
     log.info("Attempting to load the server's state file from `%s'." %
              stateFile)
 
     if not os.path.exists(stateFile):
         log.info("The server's state file does not exist (yet).")
-        state = State()
-        state.genState()
-        return state
+        stateObject = State()
+        stateObject.genState()
+    else:
+        try:
+            with open(stateFile, 'rb') as fd:
+                stateObject = cPickle.load(fd)
+        except IOError as err:
+            log.error("Error reading server state file from `%s': %s" %
+                      (stateFile, err))
+            sys.exit(1)
 
-    try:
-        with open(stateFile, 'r') as fd:
-            stateObject = cPickle.load(fd)
-    except IOError as err:
-        log.error("Error reading server state file from `%s': %s" %
-                  (stateFile, err))
-        sys.exit(1)
+    stateObject.openJournal(stateFile)
+    if _shared:
+        stateObject.openSharedState()
+    _state = stateObject
 
     return stateObject
 
@@ -104,6 +155,87 @@ class State( object ):
         self.fallbackPassword = None
         self.closingThreshold = None
 
+        # Where this state is kept on disk.  Not part of the state file.
+        self.stateFile = None
+        self.snapshotId = None
+        self.journal = None
+        self.shared = None
+
+    def __getstate__( self ):
+        """
+        Return the attributes which are written to the state file.
+        """
+
+        state = self.__dict__.copy()
+        for name in ("stateFile", "snapshotId", "journal", "shared"):
+            state.pop(name, None)
+
+        return state
+
+    def __setstate__( self, state ):
+        """
+        Restore a `State' object from the state file.
+        """
+
+        self.__dict__.update(state)
+        self.stateFile = self.snapshotId = self.journal = self.shared = None
+
+    def openJournal( self, stateFile ):
+        """
+        Start journaling changes to the replay table of this state, which was
+        loaded from (or just written to) `stateFile'.
+        """
+
+        self.stateFile = stateFile
+        self.snapshotId = journal.fileIdentity(stateFile)
+        self.journal = journal.ReplayJournal(os.path.join(const.STATE_LOCATION,
+                                             const.REPLAY_JOURNAL_FILE))
+        self.journal.replay(self.replayTracker)
+
+    def reload( self ):
+        """
+        Replace this state by the one in its state file, which another process
+        wrote.
+
+        The HMACs which wait for the next group commit of the journal are kept.
+        If the state file can't be read, the current state is kept.
+        """
+
+        log.info("Loading the server's state file `%s' written by another "
+                 "process." % self.stateFile)
+
+        snapshotId = journal.fileIdentity(self.stateFile)
+        try:
+            with open(self.stateFile, 'rb') as fd:
+                stateObject = cPickle.load(fd)
+        except (IOError, EOFError, cPickle.UnpicklingError) as err:
+            log.error("Error reading server state file from `%s': %s" %
+                      (self.stateFile, err))
+            return
+
+        self.__dict__.update(stateObject.__getstate__())
+        self.snapshotId = snapshotId
+        self.journal.replayPending(self.replayTracker)
+
+    def openSharedState( self ):
+        """
+        Share the replay table, the session ticket keys and the PRNG seed of
+        this state with the other processes which serve the same bridge.
+
+        The first process creates the shared state from its own state.  All
+        others adopt the shared keys and PRNG seed.
+        """
+
+        self.shared = sharedstate.SharedState(os.path.join(
+                      const.STATE_LOCATION, const.SHARED_STATE_FILE), self)
+
+        if self.shared.prngSeed != self.prngSeed:
+            log.info("Adopting the PRNG seed of the shared state.")
+            self.prngSeed = self.shared.prngSeed
+            self.deriveDistributions()
+
+        self.shared.checkKeys(self)
+
     def genState( self ):
         """
         Populate all the local variables with values.
@@ -124,7 +256,20 @@ class State( object ):
         self.oldAesKey = None
 
         # Replay dictionary for both authentication mechanisms.
-        self.replayTracker = replay.Tracker()
+        self.replayTracker = replay.new()
+
+        # Fallback UniformDH shared secret.  Only used if the bridge operator
+        # did not set `ServerTransportOptions'.
+        self.fallbackPassword = os.urandom(const.SHARED_SECRET_LENGTH)
+
+        self.deriveDistributions()
+
+        self.writeState()
+
+    def deriveDistributions( self ):
+        """
+        Derive the parameters which depend on the PRNG seed from it.
+        """
 
         # Distributions for packet lengths and inter arrival times.
         prng = random.Random(self.prngSeed)
@@ -135,17 +280,11 @@ class State( object ):
                                     const.MAX_PACKET_DELAY,
                                     seed=self.prngSeed)
 
-        # Fallback UniformDH shared secret.  Only used if the bridge operator
-        # did not set `ServerTransportOptions'.
-        self.fallbackPassword = os.urandom(const.SHARED_SECRET_LENGTH)
-
         # Unauthenticated connections are closed after having received the
         # following amount of bytes.
         self.closingThreshold = prng.randint(const.MAX_HANDSHAKE_LENGTH,
                                              const.MAX_HANDSHAKE_LENGTH * 5)
 
-        self.writeState()
-
     def isReplayed( self, hmac ):
         """
         Check if `hmac' is present in the replay table.
@@ -158,36 +297,79 @@ class State( object ):
 
         log.debug("Querying if HMAC is present in the replay table.")
 
+        if self.shared is not None:
+            return self.shared.isPresent(hmac)
+
         return self.replayTracker.isPresent(hmac)
 
     def registerKey( self, hmac ):
         """
-        Add the given `hmac' to the replay table.
+        Add the given `hmac' to the replay table unless it's present already.
+
+        Return `True' if `hmac' was added and `False' if it was replayed.  With
+        a shared state, checking and adding is atomic across processes.
         """
 
         assert self.replayTracker is not None
 
         log.debug("Adding a new HMAC to the replay table.")
-        self.replayTracker.addElement(hmac)
 
-        # We must write the data to disk immediately so that other ScrambleSuit
-        # connections can share the same state.
-        self.writeState()
+        if self.shared is not None:
+            return self.shared.addElement(hmac)
+
+        try:
+            self.replayTracker.addElement(hmac)
+        except LookupError:
+            return False
+
+        if self.journal is None:
+            self.writeState()
+            return True
+
+        # Other processes find the HMAC in the journal after the next group
+        # commit.  Once the journal is long enough, it's compacted into a new
+        # state file.
+        self.journal.append(hmac, int(time.time()))
+        if self.journal.records >= const.JOURNAL_COMPACTION_RECORDS:
+            self.writeState()
+
+        return True
 
     def writeState( self ):
         """
         Write the state object to a file using the `cPickle' module.
+
+        Once the replay journal is open, the file is written in a thread and
+        the journal starts over.  A `Deferred' which fires once that's done is
+        returned then.
         """
 
         stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
 
+        if self.journal is not None:
+            log.debug("Writing server's state file to `%s' in the "
+                      "background.", stateFile)
+            d = self.journal.snapshot(stateFile, cPickle.dumps(self,
+                                      cPickle.HIGHEST_PROTOCOL))
+            d.addCallback(self.snapshotWritten)
+            return d
+
         log.debug("Writing server's state file to `%s'." %
                   stateFile)
 
         try:
-            with open(stateFile, 'w') as fd:
-                cPickle.dump(self, fd)
+            with open(stateFile, 'wb') as fd:
+                cPickle.dump(self, fd, cPickle.HIGHEST_PROTOCOL)
         except IOError as err:
             log.error("Error writing state file to `%s': %s" %
                       (stateFile, err))
             sys.exit(1)
+
+    def snapshotWritten( self, snapshotId ):
+        """
+        Remember the identity of the state file we just wrote, so that `load()'
+        knows it doesn't have to load it again.
+        """
+
+        if snapshotId is not None:
+            self.snapshotId = snapshotId
@@ -20,7 +20,6 @@ The 64-byte encrypted state contains:
 import os
 import time
 import const
-import yaml
 import struct
 import random
 import datetime
@@ -35,6 +34,7 @@ import obfsproxy.common.log as logging
 import mycrypto
 import util
 import state
+import ticketstore
 
 log = logging.get_obfslogger()
 
@@ -44,12 +44,15 @@ def createTicketMessage( rawTicket, HMACKey ):
     Create and return a ready-to-be-sent ticket authentication message.
 
     Pseudo-random padding and a mark are added to `rawTicket' and the result is
-    then authenticated using `HMACKey' as key for a HMAC.  The resulting
-    authentication message is then returned.
+    then authenticated using `HMACKey' (a key or a `HMACContext') as key for a
+    HMAC.  The resulting authentication message is then returned.
     """
 
     assert len(rawTicket) == const.TICKET_LENGTH
-    assert len(HMACKey) == const.TICKET_HMAC_KEY_LENGTH
+    if isinstance(HMACKey, mycrypto.HMACContext):
+        assert len(HMACKey.key) == const.TICKET_HMAC_KEY_LENGTH
+    else:
+        assert len(HMACKey) == const.TICKET_HMAC_KEY_LENGTH
 
     # Subtract the length of the ticket to make the handshake on
     # average as long as a UniformDH handshake message.
@@ -86,71 +89,70 @@ def storeNewTicket( masterKey, ticket, bridge ):
     Store a new session ticket and the according master key for future use.
 
     This method is only called by clients.  The given data, `masterKey',
-    `ticket' and `bridge', is YAMLed and stored in the global ticket
-    dictionary.  If there already is a ticket for the given `bridge', it is
-    overwritten.
+    `ticket' and `bridge', is added to the bridge's tickets in the ticket
+    store.  Only the newest `const.TICKET_POOL_SIZE' tickets of a bridge are
+    kept.
     """
 
     assert len(masterKey) == const.MASTER_KEY_LENGTH
     assert len(ticket) == const.TICKET_LENGTH
 
-    ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
+    log.debug("Storing newly received ticket.")
 
-    log.debug("Storing newly received ticket in `%s'." % ticketFile)
+    # We also store a timestamp so we later know if our ticket already expired.
+    ticketstore.get().add(str(bridge), int(time.time()), masterKey, ticket)
 
-    # Add a new (key, ticket) tuple with the given bridge as hash key.
-    tickets = dict()
-    content = util.readFromFile(ticketFile)
-    if (content is not None) and (len(content) > 0):
-        tickets = yaml.safe_load(content)
 
-    # We also store a timestamp so we later know if our ticket already expired.
-    tickets[str(bridge)] = [int(time.time()), masterKey, ticket]
-    util.writeToFile(yaml.dump(tickets), ticketFile)
+def countStoredTickets( bridge ):
+    """
+    Return the number of unused tickets we have for `bridge'.
+    """
+
+    return ticketstore.get().count(str(bridge))
 
 
 def findStoredTicket( bridge ):
     """
-    Retrieve a previously stored ticket from the ticket dictionary.
+    Retrieve a previously stored ticket from the ticket store.
 
-    The global ticket dictionary is loaded and the given `bridge' is used to
-    look up the ticket and the master key.  If the ticket dictionary does not
-    exist (yet) or the ticket data could not be found, `None' is returned.
+    The given `bridge' is used to look up the newest unexpired ticket and its
+    master key.  Every ticket is only returned once, so concurrent connections
+    to the same bridge redeem different tickets.  If no ticket could be found,
+    `None' is returned.
     """
 
     assert bridge
 
-    ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
-
-    log.debug("Attempting to read master key and ticket from file `%s'." %
-              ticketFile)
-
-    # Load the ticket hash table from file.
-    yamlBlurb = util.readFromFile(ticketFile)
-    if (yamlBlurb is None) or (len(yamlBlurb) == 0):
-        return None
-    tickets = yaml.safe_load(yamlBlurb)
+    log.debug("Attempting to find master key and ticket for bridge `%s'.",
+              bridge)
 
-    try:
-        timestamp, masterKey, ticket = tickets[str(bridge)]
-    except KeyError:
-        log.info("Found no ticket for bridge `%s'." % str(bridge))
-        return None
+    store = ticketstore.get()
+    expired = False
 
     # We can remove the ticket now since we are about to redeem it.
-    log.debug("Deleting ticket since it is about to be redeemed.")
-    del tickets[str(bridge)]
-    util.writeToFile(yaml.dump(tickets), ticketFile)
+    entry = store.pop(str(bridge))
+    while entry is not None:
+        timestamp, masterKey, ticket = entry
+
+        # If our ticket is expired, we can't redeem it.
+        ticketAge = int(time.time()) - timestamp
+        if ticketAge <= const.SESSION_TICKET_LIFETIME:
+            ticketstore.lookups["hit"] += 1
+            return (masterKey, ticket)
 
-    # If our ticket is expired, we can't redeem it.
-    ticketAge = int(time.time()) - timestamp
-    if ticketAge > const.SESSION_TICKET_LIFETIME:
         log.warning("We did have a ticket but it already expired %s ago." %
                     str(datetime.timedelta(seconds=
                         (ticketAge - const.SESSION_TICKET_LIFETIME))))
-        return None
+        expired = True
+        entry = store.pop(str(bridge))
 
-    return (masterKey, ticket)
+    if expired:
+        ticketstore.lookups["expired"] += 1
+    else:
+        log.info("Found no ticket for bridge `%s'." % str(bridge))
+        ticketstore.lookups["miss"] += 1
+
+    return None
 
 
 def checkKeys( srvState ):
@@ -160,12 +162,22 @@ def checkKeys( srvState ):
     The key material (i.e., AES and HMAC keys for session tickets) contained in
     `srvState' is checked if it needs to be rotated.  If so, the old keys are
     stored and new ones are created.
+
+    If the key material is shared with other processes, it is rotated only
+    once and keys rotated by other processes are picked up.
     """
 
     assert (srvState.hmacKey is not None) and \
            (srvState.aesKey is not None) and \
            (srvState.keyCreation is not None)
 
+    if srvState.shared is not None:
+        keyCreation = srvState.keyCreation
+        srvState.shared.checkKeys(srvState)
+        if srvState.keyCreation != keyCreation:
+            srvState.writeState()
+        return
+
     if (int(time.time()) - srvState.keyCreation) > const.KEY_ROTATION_TIME:
         log.info("Rotating server key material for session tickets.")
 
@@ -202,8 +214,7 @@ def decrypt( ticket, srvState ):
 
     # Verify the ticket's authenticity before decrypting.
     hmac = HMAC.new(srvState.hmacKey, ticket[0:80], digestmod=SHA256).digest()
-    if util.isValidHMAC(hmac, ticket[80:const.TICKET_LENGTH],
-                        srvState.hmacKey):
+    if util.isValidHMAC(hmac, ticket[80:const.TICKET_LENGTH]):
         aesKey = srvState.aesKey
     else:
         if srvState.oldHmacKey is None:
@@ -212,8 +223,7 @@ def decrypt( ticket, srvState ):
         # Was the HMAC created using the rotated key material?
         oldHmac = HMAC.new(srvState.oldHmacKey, ticket[0:80],
                            digestmod=SHA256).digest()
-        if util.isValidHMAC(oldHmac, ticket[80:const.TICKET_LENGTH],
-                            srvState.oldHmacKey):
+        if util.isValidHMAC(oldHmac, ticket[80:const.TICKET_LENGTH]):
             aesKey = srvState.oldAesKey
         else:
             return None
@@ -384,8 +394,8 @@ if __name__ == "__main__":
     print "[+] Writing new session ticket to `%s'." % args.ticket_file
     tickets = dict()
     server = IPv4Address('TCP', args.ip_addr, args.tcp_port)
-    tickets[str(server)] = [int(time.time()), masterKey, ticket]
+    tickets[str(server)] = [(int(time.time()), masterKey, ticket)]
 
-    util.writeToFile(yaml.dump(tickets), args.ticket_file)
+    util.writeToFile(ticketstore.pack(tickets), args.ticket_file)
 
     print "[+] Success."
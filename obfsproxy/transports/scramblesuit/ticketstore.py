@@ -0,0 +1,289 @@
+"""
+This module keeps the client's session tickets.
+
+Clients keep up to `const.TICKET_POOL_SIZE' unused tickets per bridge, so that
+several connections to the same bridge can each redeem their own ticket.
+
+Clients used to read and YAML-parse their ticket file, and then rewrite it,
+whenever they connected to a bridge or received a new ticket.  Instead, the
+tickets are now kept in a dictionary which is indexed by bridge, and which is
+only loaded again when another process changed the ticket file.
+
+Several client processes (like the workers started by `--workers') can share
+the ticket file.  Every change holds an `fcntl' lock while it picks up the
+other processes' changes, makes its own and atomically replaces the ticket
+file, so a ticket is never redeemed twice and no change is lost.
+
+The ticket file is a sequence of binary records, one per ticket:
+ +----------------------+--------+-------------------+------------+--------+
+ | 2-byte bridge length | bridge | 4-byte issue date | master key | ticket |
+ +----------------------+--------+-------------------+------------+--------+
+
+Tickets in the YAML file of older versions are read if there is no ticket file
+yet.
+"""
+
+import contextlib
+import fcntl
+import os
+import struct
+
+import yaml
+
+import const
+import journal
+import util
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+MAGIC = "ScrambleSuitTkt1"
+
+BRIDGE_LENGTH = struct.Struct("!H")
+RECORD = struct.Struct("!L%ds%ds" % (const.MASTER_KEY_LENGTH,
+                                     const.TICKET_LENGTH))
+
+# The ticket store used by this process.
+_store = None
+
+# How often connections found an unexpired ticket to redeem, found none, or
+# found only expired ones.
+lookups = {"hit": 0, "miss": 0, "expired": 0}
+
+
+def get( ):
+    """
+    Return the ticket store of this process, loading it if necessary.
+
+    A new store is loaded if `const.STATE_LOCATION' changed.  Changes of other
+    processes are picked up by the store itself.
+    """
+
+    global _store
+
+    ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_STORE_FILE
+
+    if (_store is None) or (_store.fileName != ticketFile):
+        _store = TicketStore(ticketFile)
+        _store.load()
+
+    return _store
+
+
+def pack( tickets ):
+    """
+    Return the ticket file content for the dictionary `tickets' which maps
+    bridges to lists of (issue date, master key, ticket) tuples.
+    """
+
+    return MAGIC + "".join([packBridge(bridge, entries)
+                            for bridge, entries in tickets.iteritems()])
+
+
+def packBridge( bridge, entries ):
+    """
+    Return the records of the ticket file for the list `entries' of (issue
+    date, master key, ticket) tuples of `bridge'.
+    """
+
+    data = []
+    for timestamp, masterKey, ticket in entries:
+        data.append(BRIDGE_LENGTH.pack(len(bridge)))
+        data.append(bridge)
+        data.append(RECORD.pack(timestamp, masterKey, ticket))
+
+    return "".join(data)
+
+
+def unpack( data ):
+    """
+    Return the dictionary of tickets in the ticket file content `data'.
+
+    A `ValueError' is raised if `data' is not a valid ticket file.
+    """
+
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a ticket file.")
+
+    tickets = dict()
+    offset = len(MAGIC)
+
+    try:
+        while offset < len(data):
+            (bridgeLength,) = BRIDGE_LENGTH.unpack_from(data, offset)
+            offset += BRIDGE_LENGTH.size
+            bridge = data[offset:offset + bridgeLength]
+            offset += bridgeLength
+            tickets.setdefault(bridge, []).append(RECORD.unpack_from(data,
+                                                                    offset))
+            offset += RECORD.size
+    except struct.error:
+        raise ValueError("Truncated ticket file.")
+
+    return tickets
+
+
+class TicketStore( object ):
+
+    """
+    The client's unused session tickets, indexed by bridge, oldest first.
+    """
+
+    def __init__( self, fileName ):
+        """
+        Initialise an empty ticket store which is kept in `fileName'.
+        """
+
+        self.fileName = fileName
+        self.lockName = fileName + ".lock"
+        self.fileId = None
+        self.tickets = dict()
+
+        # The records of every bridge in the ticket file, so that a change
+        # only packs the tickets of its own bridge again.
+        self.records = dict()
+
+    @contextlib.contextmanager
+    def locked( self ):
+        """
+        Hold the lock on the ticket file while in this context, so that no
+        other process changes the file in the meantime.
+
+        The ticket file is replaced on every write, so the lock is taken on a
+        separate file which stays in place.
+        """
+
+        fd = os.open(self.lockName, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def load( self ):
+        """
+        Load the tickets from the ticket file, or from the YAML file of older
+        versions if there is no ticket file yet.
+        """
+
+        self.fileId = journal.fileIdentity(self.fileName)
+        self.tickets = dict()
+        self.records = dict()
+
+        if self.fileId is not None:
+            log.debug("Loading session tickets from `%s'.", self.fileName)
+            content = util.readFromFile(self.fileName)
+            try:
+                self.tickets = unpack(content or "")
+            except ValueError as err:
+                log.warning("Ignoring ticket file `%s': %s" %
+                            (self.fileName, err))
+            return
+
+        yamlFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
+        content = util.readFromFile(yamlFile)
+        if (content is None) or (len(content) == 0):
+            return
+
+        log.info("Importing session tickets from `%s'." % yamlFile)
+        for bridge, (timestamp, masterKey, ticket) in \
+                yaml.safe_load(content).iteritems():
+            self.tickets[bridge] = [(timestamp, masterKey, ticket)]
+
+    def refresh( self ):
+        """
+        Load the tickets again if another process replaced the ticket file
+        since we last read or wrote it.  The lock must be held.
+        """
+
+        if journal.fileIdentity(self.fileName) != self.fileId:
+            self.load()
+
+    def add( self, bridge, timestamp, masterKey, ticket ):
+        """
+        Store the `ticket' and `masterKey' issued at `timestamp' by `bridge'.
+
+        If we have `const.TICKET_POOL_SIZE' tickets for `bridge' already, the
+        oldest one is dropped.
+        """
+
+        with self.locked():
+            self.refresh()
+
+            entries = self.tickets.setdefault(bridge, [])
+            entries.append((timestamp, masterKey, ticket))
+            del entries[:-const.TICKET_POOL_SIZE]
+
+            self.write(bridge)
+
+    def pop( self, bridge ):
+        """
+        Remove and return the newest (issue date, master key, ticket) tuple of
+        `bridge', or `None' if we have no ticket for it.
+
+        The ticket is removed from the ticket file before it's returned, so no
+        other process can redeem it as well.
+        """
+
+        with self.locked():
+            self.refresh()
+
+            entries = self.tickets.get(bridge)
+            if not entries:
+                return None
+
+            entry = entries.pop()
+            if not entries:
+                del self.tickets[bridge]
+
+            self.write(bridge)
+
+        return entry
+
+    def count( self, bridge ):
+        """
+        Return the number of tickets we have for `bridge'.
+
+        Tickets which other processes stored or redeemed since our last change
+        are not taken into account.
+        """
+
+        return len(self.tickets.get(bridge, ()))
+
+    def write( self, bridge ):
+        """
+        Atomically replace the ticket file by our tickets, of which the ones of
+        `bridge' changed.  The lock must be held.
+        """
+
+        if bridge in self.tickets:
+            self.records[bridge] = packBridge(bridge, self.tickets[bridge])
+        else:
+            self.records.pop(bridge, None)
+
+        # Pack the bridges we didn't pack since the tickets were loaded.
+        for other, entries in self.tickets.iteritems():
+            if other not in self.records:
+                self.records[other] = packBridge(other, entries)
+
+        try:
+            journal.writeFile(self.fileName,
+                              MAGIC + "".join(self.records.itervalues()),
+                              False)
+        except (IOError, OSError) as err:
+            log.error("Error writing ticket file `%s': %s" %
+                      (self.fileName, err))
+            return
+
+        self.fileId = journal.fileIdentity(self.fileName)
+
+
+metrics.SESSION_TICKET_LOOKUPS.set_function(lambda: lookups["hit"], "hit")
+metrics.SESSION_TICKET_LOOKUPS.set_function(lambda: lookups["miss"], "miss")
+metrics.SESSION_TICKET_LOOKUPS.set_function(lambda: lookups["expired"],
+                                            "expired")
@@ -13,6 +13,7 @@ import Crypto.Hash.SHA256
 
 import util
 import mycrypto
+import handshake
 
 import obfsproxy.transports.obfs3_dh as obfs3_dh
 import obfsproxy.transports.base as base
@@ -40,6 +41,13 @@ class UniformDH( object ):
         # The shared UniformDH secret.
         self.sharedSecret = sharedSecret
 
+        # The shared secret prepared for computing HMACs.
+        self.hmacKey = None if sharedSecret is None else \
+                       mycrypto.HMACContext(sharedSecret)
+
+        # Locates and verifies the HMAC of the remote handshake as it arrives.
+        self.parser = handshake.HandshakeParser(const.PUBLIC_KEY_LENGTH)
+
         # Cache a UniformDH public key until it's added to the replay table.
         self.remotePublicKey = None
 
@@ -70,12 +78,7 @@ class UniformDH( object ):
         if not remotePublicKey:
             return False
 
-        if self.weAreServer:
-            self.remotePublicKey = remotePublicKey
-            # As server, we need a DH object; as client, we already have one.
-            self.udh = obfs3_dh.UniformDH()
-
-        assert self.udh is not None
+        self.prepareKeyExchange(remotePublicKey)
 
         try:
             uniformDHSecret = self.udh.get_secret(remotePublicKey)
@@ -90,6 +93,41 @@ class UniformDH( object ):
 
         return True
 
+    def computeMasterKey( self, remotePublicKey ):
+        """
+        Compute the master key shared with the owner of `remotePublicKey'.
+
+        The public key must have been extracted by `extractPublicKey()'.  The
+        UniformDH secret is computed by the handshake executor, off the event
+        loop.  A Deferred is returned which fires with the master key.  It
+        fails with a `PluggableTransportError' if the public key is corrupted
+        or with `HandshakeBacklogFull' if the executor is too busy.
+        """
+
+        self.prepareKeyExchange(remotePublicKey)
+
+        def corrupted( failure ):
+            failure.trap(ValueError)
+            raise base.PluggableTransportError("Corrupted public key.")
+
+        d = self.udh.get_secret_deferred(remotePublicKey)
+        d.addCallbacks(lambda secret: Crypto.Hash.SHA256.new(secret).digest(),
+                       corrupted)
+
+        return d
+
+    def prepareKeyExchange( self, remotePublicKey ):
+        """
+        Get ready to compute the UniformDH secret with `remotePublicKey'.
+        """
+
+        if self.weAreServer:
+            self.remotePublicKey = remotePublicKey
+            # As server, we need a DH object; as client, we already have one.
+            self.udh = obfs3_dh.pool.get()
+
+        assert self.udh is not None
+
     def extractPublicKey( self, data, srvState=None ):
         """
         Extract and return a UniformDH public key out of `data'.
@@ -102,59 +140,38 @@ class UniformDH( object ):
 
         assert self.sharedSecret is not None
 
-        # Do we already have the minimum amount of data?
-        if len(data) < (const.PUBLIC_KEY_LENGTH + const.MARK_LENGTH +
-                        const.HMAC_SHA256_128_LENGTH):
+        # Do we already have the minimum amount of data, and can it still be
+        # a valid handshake?
+        if self.parser.excluded or \
+           (len(data) < (const.PUBLIC_KEY_LENGTH + const.MARK_LENGTH +
+                         const.HMAC_SHA256_128_LENGTH)):
             return False
 
         log.debug("Attempting to extract the remote machine's UniformDH "
                   "public key out of %d bytes of data." % len(data))
 
-        handshake = data.peek()
-
-        # First, find the mark to efficiently locate the HMAC.
-        publicKey = handshake[:const.PUBLIC_KEY_LENGTH]
-        mark = mycrypto.HMAC_SHA256_128(self.sharedSecret, publicKey)
-
-        index = util.locateMark(mark, handshake)
-        if not index:
-            return False
-
-        # Now that we know where the authenticating HMAC is: verify it.
-        hmacStart = index + const.MARK_LENGTH
-        existingHMAC = handshake[hmacStart:
-                                 (hmacStart + const.HMAC_SHA256_128_LENGTH)]
-
-        authenticated = False
-        for epoch in util.expandedEpoch():
-            myHMAC = mycrypto.HMAC_SHA256_128(self.sharedSecret,
-                                              handshake[0 : hmacStart] + epoch)
-
-            if util.isValidHMAC(myHMAC, existingHMAC, self.sharedSecret):
-                self.echoEpoch = epoch
-                authenticated = True
-                break
-
-            log.debug("HMAC invalid.  Trying next epoch value.")
-
-        if not authenticated:
-            log.warning("Could not verify the authentication message's HMAC.")
+        # Locate and verify the HMAC, picking up where we left off last time.
+        potentialHandshake = data.peek()
+        result = self.parser.parse(self.hmacKey, potentialHandshake)
+        if result is None:
             return False
+        length, existingHMAC, self.echoEpoch = result
 
         # Do nothing if the ticket is replayed.  Immediately closing the
-        # connection would be suspicious.
-        if srvState is not None and srvState.isReplayed(existingHMAC):
-            log.warning("The HMAC was already present in the replay table.")
-            return False
-
-        data.drain(index + const.MARK_LENGTH + const.HMAC_SHA256_128_LENGTH)
-
+        # connection would be suspicious.  Another process might add the HMAC
+        # right after we checked, so that's checked again when adding it.
         if srvState is not None:
             log.debug("Adding the HMAC authenticating the UniformDH message " \
                       "to the replay table: %s." % existingHMAC.encode('hex'))
-            srvState.registerKey(existingHMAC)
+            if not srvState.registerKey(existingHMAC):
+                log.warning("The HMAC was already present in the replay "
+                            "table.")
+                self.parser.exclude()
+                return False
+
+        data.drain(length)
 
-        return handshake[:const.PUBLIC_KEY_LENGTH]
+        return potentialHandshake[:const.PUBLIC_KEY_LENGTH]
 
     def createHandshake( self ):
         """
@@ -170,7 +187,7 @@ class UniformDH( object ):
         log.debug("Creating UniformDH handshake message.")
 
         if self.udh is None:
-            self.udh = obfs3_dh.UniformDH()
+            self.udh = obfs3_dh.pool.get()
         publicKey = self.udh.get_public()
 
         assert (const.MAX_PADDING_LENGTH - const.PUBLIC_KEY_LENGTH) >= 0
@@ -183,7 +200,7 @@ class UniformDH( object ):
                                         const.PUBLIC_KEY_LENGTH))
 
         # Add a mark which enables efficient location of the HMAC.
-        mark = mycrypto.HMAC_SHA256_128(self.sharedSecret, publicKey)
+        mark = mycrypto.HMAC_SHA256_128(self.hmacKey, publicKey)
 
         if self.echoEpoch is None:
             epoch = util.getEpoch()
@@ -192,7 +209,7 @@ class UniformDH( object ):
             log.debug("Echoing epoch rather than recreating it.")
 
         # Authenticate the handshake including the current approximate epoch.
-        mac = mycrypto.HMAC_SHA256_128(self.sharedSecret,
+        mac = mycrypto.HMAC_SHA256_128(self.hmacKey,
                                        publicKey + padding + mark + epoch)
 
         return publicKey + padding + mark + mac
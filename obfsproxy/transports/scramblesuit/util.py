@@ -7,12 +7,11 @@ from files and to convert a number to raw text.
 
 import obfsproxy.common.log as logging
 
+import hmac
 import os
 import time
 import const
 
-import mycrypto
-
 log = logging.get_obfslogger()
 
 def setStateLocation( stateLocation ):
@@ -45,24 +44,18 @@ def setStateLocation( stateLocation ):
     const.STATE_LOCATION = stateLocation
 
 
-def isValidHMAC( hmac1, hmac2, key ):
+def isValidHMAC( hmac1, hmac2 ):
     """
-    Compares `hmac1' and `hmac2' after HMACing them again using `key'.
+    Compares `hmac1' and `hmac2' in constant time.
 
-    The arguments `hmac1' and `hmac2' are compared.  If they are equal, `True'
-    is returned and otherwise `False'.  To prevent timing attacks, double HMAC
-    verification is used meaning that the two arguments are HMACed again before
-    (variable-time) string comparison.  The idea is taken from:
-    https://www.isecpartners.com/blog/2011/february/double-hmac-verification.aspx
+    If they are equal, `True' is returned and otherwise `False'.  The time the
+    comparison takes does not depend on where the HMACs differ, so it does not
+    help timing attacks.
     """
 
     assert len(hmac1) == len(hmac2)
 
-    # HMAC the arguments again to prevent timing attacks.
-    doubleHmac1 = mycrypto.HMAC_SHA256_128(key, hmac1)
-    doubleHmac2 = mycrypto.HMAC_SHA256_128(key, hmac2)
-
-    if doubleHmac1 != doubleHmac2:
+    if not hmac.compare_digest(hmac1, hmac2):
         return False
 
     log.debug("The computed HMAC is valid.")
@@ -183,3 +176,58 @@ def sanitiseBase32( data ):
         data = data.replace("0", "O")
 
     return data
+
+
+def parseIATOptions( options, mode, minRate ):
+    """
+    Return the inter-arrival time obfuscation mode and minimum rate which are
+    set in the dictionary `options'.
+
+    The options are called `iat-mode' and `iat-min-rate'.  If they are not set,
+    `mode' and `minRate' are returned.  A `ValueError' is raised if they are
+    invalid.
+    """
+
+    mode = options.get("iat-mode", mode)
+    if mode not in const.IAT_MODES:
+        raise ValueError("Invalid IAT mode `%s' (expected one of %s)." %
+                         (mode, ", ".join(const.IAT_MODES)))
+
+    try:
+        minRate = int(options.get("iat-min-rate", minRate))
+    except ValueError:
+        raise ValueError("Invalid minimum IAT rate `%s'." %
+                         options["iat-min-rate"])
+    if minRate <= 0:
+        raise ValueError("The minimum IAT rate must be positive (not %d)." %
+                         minRate)
+
+    return (mode, minRate)
+
+
+def parsePaddingBudget( options, budget ):
+    """
+    Return the padding budget which is set in the dictionary `options'.
+
+    The option is called `padding-budget'.  It is the maximum amount of padding
+    as a fraction of the data which is padded, e.g., `0.25', or `off' for no
+    limit, which is returned as `None'.  If it is not set, `budget' is
+    returned.  A `ValueError' is raised if it is invalid.
+    """
+
+    if "padding-budget" not in options:
+        return budget
+
+    value = options["padding-budget"]
+    if value in ("off", None):
+        return None
+
+    try:
+        budget = float(value)
+    except ValueError:
+        raise ValueError("Invalid padding budget `%s'." % value)
+    if not (budget >= 0):
+        raise ValueError("The padding budget must not be negative (not %s)." %
+                         value)
+
+    return budget
@@ -30,5 +30,17 @@ def get_transport_class(name, role):
     else:
         raise TransportNotFound
 
+def get_transport_name(transport_class):
+    """
+    Return the name of the transport implemented by 'transport_class'
+    (or by one of its base classes), or 'unknown'.
+    """
+    for cls in transport_class.__mro__:
+        for name, classes in transports.items():
+            if cls in classes.values():
+                return name
+
+    return 'unknown'
+
 class TransportNotFound(Exception): pass
 